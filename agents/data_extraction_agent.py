@@ -1,17 +1,18 @@
 import os
 from pydantic_ai import Agent, RunContext
 from pydantic_ai.models.test import TestModel
+from providers.rate_limit import RateLimitedModel
 from models.dependencies import ExtractorAgentDependencies
-from models.invoice import Invoice, InvoiceItem
+from models.invoice import Invoice
 
 # Determinar el modelo a usar según el entorno
-def get_model_for_environment():
+def get_model_for_environment(model_name: str = 'gpt-4'):
     # Si estamos en un entorno de prueba, usamos TestModel
     if os.environ.get('PYDANTICAI_ALLOW_MODEL_REQUESTS', 'true').lower() == 'false':
         print("ExtractionAgent: Usando TestModel para pruebas")
         return TestModel()
-    # Si no, usamos el modelo OpenAI normal
-    return 'openai:gpt-4'
+    # Si no, usamos el modelo OpenAI indicado, limitado por RPM/TPM
+    return RateLimitedModel(f'openai:{model_name}')
 
 extraction_agent = Agent(
     get_model_for_environment(),
@@ -43,28 +44,3 @@ async def parse_invoice_text(
     # Este método podría usar otro LLM para estructurar los datos,
     # pero por ahora dejamos que el agente principal lo maneje
     pass
-
-@extraction_agent.tool
-async def validate_amounts(
-    ctx: RunContext[ExtractorAgentDependencies],
-    items: list[InvoiceItem],
-    total_amount: float,
-    tax_amount: float
-) -> bool:
-    """
-    Valida que los montos de los items coincidan con el total.
-    
-    Args:
-        ctx: Contexto de ejecución
-        items: Lista de items de la factura
-        total_amount: Monto total declarado
-        tax_amount: Monto de impuestos
-        
-    Returns:
-        bool: True si los montos son consistentes
-    """
-    subtotal = sum(item.total for item in items)
-    calculated_total = subtotal + tax_amount
-    
-    # Permitimos una pequeña diferencia por redondeo
-    return abs(calculated_total - total_amount) < 0.01
@@ -1,15 +1,10 @@
 import os
-from pydantic import BaseModel, Field
 from pydantic_ai import Agent, RunContext
 from pydantic_ai.models.test import TestModel
+from providers.rate_limit import RateLimitedModel
 from models.dependencies import StorageAgentDependencies
 from models.invoice import Invoice
-
-class StorageResult(BaseModel):
-    """Resultado de la operación de almacenamiento"""
-    invoice_id: str = Field(description="ID de la factura almacenada")
-    success: bool = Field(description="Indica si la operación fue exitosa")
-    message: str = Field(description="Mensaje descriptivo del resultado")
+from models.storage import StorageResult
 
 # Determinar el modelo a usar según el entorno
 def get_model_for_environment():
@@ -17,8 +12,8 @@ def get_model_for_environment():
     if os.environ.get('PYDANTICAI_ALLOW_MODEL_REQUESTS', 'true').lower() == 'false':
         print("StorageAgent: Usando TestModel para pruebas")
         return TestModel()
-    # Si no, usamos el modelo OpenAI normal
-    return 'openai:gpt-4'
+    # Si no, usamos el modelo OpenAI normal, limitado por RPM/TPM
+    return RateLimitedModel('openai:gpt-4')
 
 storage_agent = Agent(
     get_model_for_environment(),
@@ -0,0 +1,165 @@
+import re
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from models.invoice import Invoice, InvoiceItem
+
+# Formas en que los modelos y los recibos escriben la moneda, con su código ISO 4217
+CURRENCY_ALIASES = {
+    "US$": "USD", "U$S": "USD", "DOLARES": "USD", "DÓLARES": "USD", "DOLLARS": "USD",
+    "COL$": "COP", "PESOS": "COP", "PESOS COLOMBIANOS": "COP",
+    "MX$": "MXN", "PESOS MEXICANOS": "MXN",
+    "€": "EUR", "EUROS": "EUR",
+}
+
+# Tasas de IVA con las que se deduce un impuesto que falta (Colombia 19 % y 5 %,
+# México 16 % y 8 %, España 21 %). Otra diferencia puede ser un ítem omitido y
+# se deja como problema para la petición dirigida
+KNOWN_TAX_RATES = (0.05, 0.08, 0.16, 0.19, 0.21)
+
+# Desviación máxima de la tasa deducida por el redondeo de cada línea
+TAX_RATE_TOLERANCE = 0.002
+
+
+def amounts_are_consistent(
+    items: Iterable[InvoiceItem],
+    total_amount: float,
+    tax_amount: Optional[float],
+    tolerance: float = 0.01
+) -> bool:
+    """
+    Comprueba que la suma de los ítems más los impuestos coincida con el total.
+
+    Args:
+        items: Ítems de la factura
+        total_amount: Monto total declarado
+        tax_amount: Monto de impuestos (None cuenta como 0)
+        tolerance: Diferencia máxima admitida por redondeo
+
+    Returns:
+        bool: True si los montos son consistentes
+    """
+    subtotal = sum(item.total for item in items)
+    calculated_total = subtotal + (tax_amount or 0.0)
+    return abs(calculated_total - total_amount) < tolerance
+
+
+def validate_invoice(
+    invoice: Invoice,
+    now: Optional[datetime] = None,
+    max_age_days: int = 5 * 365,
+    tolerance: float = 0.01
+) -> List[str]:
+    """
+    Comprueba localmente una factura extraída: campos obligatorios, montos y fecha.
+
+    Args:
+        invoice: Factura extraída
+        now: Fecha de referencia (por defecto, la actual)
+        max_age_days: Antigüedad máxima aceptada para la fecha de la factura
+        tolerance: Diferencia máxima admitida por redondeo en los montos
+
+    Returns:
+        List[str]: Problemas encontrados; vacía si la factura es válida
+    """
+    problems = []
+    for name in ("invoice_number", "vendor_name"):
+        if not getattr(invoice, name).strip():
+            problems.append(f"{name} vacío")
+    if not invoice.items:
+        problems.append("sin ítems")
+    elif not amounts_are_consistent(invoice.items, invoice.total_amount, invoice.tax_amount, tolerance):
+        problems.append("los ítems más el impuesto no suman el total")
+    now = now or datetime.now(invoice.date.tzinfo)
+    if invoice.date > now + timedelta(days=1):
+        problems.append("fecha futura")
+    elif invoice.date < now - timedelta(days=max_age_days):
+        problems.append("fecha demasiado antigua")
+    return problems
+
+
+def normalize_currency(currency: str) -> str:
+    """
+    Convierte la moneda de una factura a su código ISO 4217.
+
+    Args:
+        currency: Moneda tal como la devolvió el modelo ("pesos", "US$", "usd"...)
+
+    Returns:
+        str: Código de tres letras, o la moneda original si no se reconoce
+    """
+    key = re.sub(r"\s+", " ", (currency or "").strip().upper())
+    if key in CURRENCY_ALIASES:
+        return CURRENCY_ALIASES[key]
+    if re.fullmatch(r"[A-Z]{3}", key):
+        return key
+    return currency
+
+
+def repair_invoice(invoice: Invoice, tolerance: float = 0.01) -> Tuple[Invoice, List[str]]:
+    """
+    Corrige localmente los errores evidentes de una factura extraída.
+
+    - Normaliza la moneda a su código ISO
+    - Si los totales de los ítems suman el total de la factura pero no cuadran
+      con cantidad × precio, corrige la cantidad (o el precio unitario)
+    - Si no, recalcula el total de cada ítem como cantidad × precio
+    - Si falta el impuesto, lo deduce de la diferencia con el total solo cuando
+      corresponde a una tasa de KNOWN_TAX_RATES
+    - Si el total difiere de ítems + impuesto en una potencia de 10 (separador
+      de miles leído como decimal), lo recalcula
+
+    Args:
+        invoice: Factura extraída
+        tolerance: Diferencia máxima admitida por redondeo
+
+    Returns:
+        Tuple[Invoice, List[str]]: Factura corregida y los tipos de corrección aplicados
+    """
+    repairs = []
+    update = {}
+    currency = normalize_currency(invoice.currency)
+    if currency != invoice.currency:
+        update["currency"] = currency
+        repairs.append("moneda")
+
+    items = list(invoice.items)
+    tax = invoice.tax_amount or 0.0
+    mismatched = [
+        index for index, item in enumerate(items)
+        if abs(item.quantity * item.unit_price - item.total) >= tolerance
+    ]
+    if mismatched:
+        if amounts_are_consistent(items, invoice.total_amount, tax, tolerance):
+            # Los totales de los ítems son correctos: falla la cantidad o el precio
+            for index in mismatched:
+                item = items[index]
+                quantity = item.total / item.unit_price if item.total > 0 else 0
+                if quantity >= 1 and abs(quantity - round(quantity)) < 1e-6:
+                    items[index] = item.model_copy(update={"quantity": float(round(quantity))})
+                    repairs.append("cantidad")
+                elif item.total > 0:
+                    items[index] = item.model_copy(update={"unit_price": round(item.total / item.quantity, 2)})
+                    repairs.append("precio unitario")
+        else:
+            for index in mismatched:
+                item = items[index]
+                items[index] = item.model_copy(update={"total": round(item.quantity * item.unit_price, 2)})
+                repairs.append("total del ítem")
+        update["items"] = items
+
+    subtotal = sum(item.total for item in items)
+    total = invoice.total_amount
+    if items and not amounts_are_consistent(items, total, tax, tolerance):
+        gap = total - subtotal
+        if not tax and gap > 0 and any(abs(gap / subtotal - rate) <= TAX_RATE_TOLERANCE for rate in KNOWN_TAX_RATES):
+            update["tax_amount"] = round(gap, 2)
+            repairs.append("impuesto")
+        elif any(
+            abs(total * 10 ** exponent - (subtotal + tax)) < tolerance
+            for exponent in (-3, -2, -1, 1, 2, 3)
+        ):
+            update["total_amount"] = round(subtotal + tax, 2)
+            repairs.append("total")
+
+    return (invoice.model_copy(update=update) if update else invoice), repairs
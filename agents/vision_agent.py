@@ -2,6 +2,7 @@ import os
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent, RunContext
 from pydantic_ai.models.test import TestModel
+from providers.rate_limit import RateLimitedModel
 from models.dependencies import VisionAgentDependencies
 
 class VisionResult(BaseModel):
@@ -20,7 +21,7 @@ def get_model_for_environment():
     # Si no, usamos un modelo OpenAI con capacidades de visión
     # gpt-4o es el modelo actual con capacidades de visión
     print("VisionAgent: Utilizando modelo OpenAI gpt-4o")
-    return 'openai:gpt-4o'
+    return RateLimitedModel('openai:gpt-4o')
 
 vision_agent = Agent(
     get_model_for_environment(),
@@ -66,7 +67,8 @@ async def process_invoice_image(
     
     return VisionResult(
         extracted_text=result["extracted_text"],
-        confidence=0.95,  # Este valor debería venir del proveedor
+        # El OCR local informa su confianza; los modelos de visión no la devuelven
+        confidence=result.get("confidence", 0.95),
         provider=result["provider"],
         model=result["model"]
     )
@@ -1,6 +1,6 @@
 from pydantic import Field, field_validator, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Optional
+from typing import Literal, Optional
 
 class Settings(BaseSettings):
     """Configuraciu00f3n de la aplicaciu00f3n basada en variables de entorno"""
@@ -27,9 +27,152 @@ class Settings(BaseSettings):
             raise ValueError("Se requiere la variable de entorno MONGO_CONNECTION_STRING")
         return v
     
+    # Driver de MongoDB: "motor" (asíncrono) o "pymongo" (síncrono en hilos, alternativa sin motor)
+    STORAGE_BACKEND: Literal["motor", "pymongo"] = "motor"
+    
+    # Escritura diferida: agrupa los guardados de facturas en bulk_write por tamaño o tiempo
+    STORAGE_WRITE_BEHIND: bool = False
+    STORAGE_WRITE_BEHIND_BATCH_SIZE: int = Field(100, ge=1)
+    STORAGE_WRITE_BEHIND_FLUSH_INTERVAL: float = Field(0.5, gt=0)
+    
+    # Pool de conexiones de MongoDB (un único cliente por proceso)
+    MONGO_DATABASE_NAME: str = "invoices_db"
+    MONGO_MAX_POOL_SIZE: int = Field(50, ge=1)
+    MONGO_MIN_POOL_SIZE: int = Field(0, ge=0)
+    MONGO_MAX_IDLE_TIME_MS: int = Field(60000, ge=0)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = Field(5000, ge=1)
+    MONGO_CONNECT_TIMEOUT_MS: int = Field(5000, ge=1)
+    
+    # Clientes HTTP compartidos (OpenAI, Graph API de WhatsApp)
+    HTTP_POOL_LIMIT: int = Field(100, ge=1)
+    HTTP_POOL_LIMIT_PER_HOST: int = Field(20, ge=1)
+    HTTP_DNS_CACHE_TTL_SECONDS: int = Field(300, ge=0)
+    HTTP_KEEPALIVE_TIMEOUT_SECONDS: float = Field(30.0, gt=0)
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = Field(10.0, gt=0)
+    HTTP_TOTAL_TIMEOUT_SECONDS: float = Field(60.0, gt=0)
+    
+    # Reintentos con backoff y circuitos por host para las llamadas a proveedores
+    RETRY_MAX_ATTEMPTS: int = Field(3, ge=1)
+    RETRY_BASE_DELAY_SECONDS: float = Field(0.5, ge=0)
+    RETRY_MAX_DELAY_SECONDS: float = Field(20.0, ge=0)
+    # Si Retry-After pide esperar más que esto, se falla en lugar de reintentar
+    RETRY_MAX_RETRY_AFTER_SECONDS: float = Field(60.0, ge=0)
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = Field(5, ge=1)
+    CIRCUIT_BREAKER_RESET_SECONDS: float = Field(30.0, gt=0)
+    
+    # Limitador RPM/TPM por modelo de OpenAI; las cabeceras x-ratelimit-* ajustan los límites reales
+    OPENAI_RATE_LIMIT: bool = True
+    OPENAI_REQUESTS_PER_MINUTE: int = Field(500, ge=1)
+    OPENAI_TOKENS_PER_MINUTE: int = Field(30000, ge=1)
+    # Archivo SQLite para compartir el presupuesto entre procesos; vacío para un limitador por proceso
+    OPENAI_RATE_LIMIT_SHARED_PATH: str = ""
+    
+    # Preprocesamiento de imágenes antes del modelo de visión
+    IMAGE_PREPROCESSING: bool = True
+    IMAGE_MAX_LONG_EDGE: int = Field(2048, ge=256)
+    IMAGE_JPEG_QUALITY: int = Field(85, ge=1, le=95)
+    IMAGE_GRAYSCALE: Literal["auto", "always", "never"] = "auto"
+    # Política de tamaño según el costo en teselas: none, fit (mismos tokens, menos bytes),
+    # min_tiles (menos teselas sin bajar de IMAGE_MIN_SHORT_SIDE) o low (detail="low")
+    VISION_SIZING_POLICY: Literal["none", "fit", "min_tiles", "low"] = "fit"
+    IMAGE_MIN_SHORT_SIDE: int = Field(512, ge=64)
+    # 0 ejecuta el preprocesamiento en hilos; N > 0 usa un pool de N procesos
+    IMAGE_PREPROCESSING_PROCESSES: int = Field(0, ge=0)
+    
+    # Caché de resultados de visión por contenido de la imagen
+    VISION_CACHE: bool = True
+    VISION_CACHE_SIZE: int = Field(1000, ge=1)
+    VISION_CACHE_TTL_SECONDS: int = Field(7 * 24 * 3600, ge=1)
+    # Archivo SQLite del nivel en disco; vacío para usar solo memoria
+    VISION_CACHE_PATH: str = "data/vision_cache.sqlite3"
+    
+    # Backends de visión: "modelo" o "modelo@url_base" separados por comas; vacío usa VISION_MODEL en OpenAI
+    VISION_BACKENDS: str = ""
+    # Enrutamiento por latencia EWMA y solicitudes de cobertura (hedging) contra la cola de latencia
+    VISION_HEDGING: bool = False
+    VISION_HEDGE_PERCENTILE: float = Field(0.95, gt=0, lt=1)
+    VISION_HEDGE_MIN_DELAY_SECONDS: float = Field(1.0, ge=0)
+    VISION_ROUTING_EWMA_ALPHA: float = Field(0.2, gt=0, le=1)
+    # Tasa de errores EWMA a partir de la cual un backend deja de recibir tráfico
+    VISION_BACKEND_MAX_ERROR_RATE: float = Field(0.5, gt=0, le=1)
+    VISION_BACKEND_RECOVERY_SECONDS: float = Field(30.0, gt=0)
+    
+    # Recibos largos: las imágenes con alto/ancho mayor que VISION_TILE_MIN_ASPECT_RATIO se procesan
+    # en franjas solapadas de alto/ancho VISION_TILE_ASPECT_RATIO, en paralelo
+    VISION_TILING: bool = True
+    VISION_TILE_MIN_ASPECT_RATIO: float = Field(2.5, gt=1)
+    VISION_TILE_ASPECT_RATIO: float = Field(2.0, gt=0)
+    VISION_TILE_OVERLAP: float = Field(0.15, ge=0, lt=0.5)
+    VISION_MAX_TILES: int = Field(8, ge=2)
+    
+    # OCR local con Tesseract antes del modelo de visión (requiere el binario tesseract)
+    VISION_LOCAL_OCR: bool = False
+    TESSERACT_CMD: str = "tesseract"
+    TESSERACT_LANGUAGES: str = "spa+eng"
+    TESSERACT_PSM: int = Field(4, ge=0, le=13)
+    # Subprocesos de Tesseract simultáneos; 0 usa el número de CPUs
+    TESSERACT_PROCESSES: int = Field(0, ge=0)
+    # Por debajo de esta confianza media (0-1) o de este número de palabras se usa el modelo de visión
+    VISION_OCR_MIN_CONFIDENCE: float = Field(0.80, ge=0, le=1)
+    VISION_OCR_MIN_WORDS: int = Field(20, ge=0)
+    
+    # Detección de casi duplicados por hash perceptual (misma factura fotografiada o reenviada).
+    # Desactivada por defecto: dos recibos distintos con la plantilla de un mismo vendedor
+    # quedan tan cerca como un reenvío (ver benchmarks/near_duplicates.py)
+    NEAR_DUPLICATE_DETECTION: bool = False
+    # Distancia de Hamming máxima entre dHash de 256 bits para considerar dos imágenes iguales
+    NEAR_DUPLICATE_MAX_DISTANCE: int = Field(16, ge=0, le=128)
+    NEAR_DUPLICATE_TTL_SECONDS: int = Field(30 * 24 * 3600, ge=1)
+    # Fracción de coincidencias que se procesan igualmente para medir falsos positivos
+    NEAR_DUPLICATE_VERIFY_RATE: float = Field(0.05, ge=0, le=1)
+    
+    # Streaming de la respuesta de visión: permite avisar al usuario en cuanto llega el texto
+    VISION_STREAMING: bool = False
+    # Caracteres recibidos tras los que se envía la notificación de progreso (0 = sin notificación)
+    VISION_STREAM_PROGRESS_CHARS: int = Field(200, ge=0)
+    
+    # Modo del pipeline: "agents" (agente de visión + agente de extracción, 3 llamadas) o
+    # "direct" (la imagen va una vez a VISION_MODEL y vuelve como Invoice con salidas estructuradas)
+    PIPELINE_MODE: Literal["agents", "direct"] = "agents"
+    
+    # Extracción por plantillas (NIT, IVA, Total...) antes del agente de extracción
+    RULE_EXTRACTION: bool = True
+    # Archivo JSON con plantillas propias; vacío para usar las incluidas
+    RULE_EXTRACTION_TEMPLATES_PATH: str = ""
+    
     # Modelos AI
     VISION_MODEL: str = "gpt-4o"
     EXTRACTION_MODEL: str = "gpt-4"
+    # Modelos más baratos, separados por comas, que se prueban antes de EXTRACTION_MODEL;
+    # se escala al siguiente si la factura no pasa la validación local (vacío = solo EXTRACTION_MODEL)
+    EXTRACTION_MODEL_TIERS: str = "gpt-4o-mini"
+    # Peticiones dirigidas extra al último nivel para los campos que la reparación local no corrige
+    EXTRACTION_MAX_REASKS: int = Field(1, ge=0)
+    
+    # Pool de workers para procesamiento en segundo plano
+    WORKER_CONCURRENCY: int = Field(4, ge=1)
+    WORKER_QUEUE_MAX_SIZE: int = Field(1000, ge=1)
+    WORKER_DRAIN_TIMEOUT: float = 30.0
+    
+    # Cola de trabajos persistente (SQLite)
+    JOB_QUEUE_PATH: str = "data/jobs.sqlite3"
+    JOB_QUEUE_VISIBILITY_TIMEOUT: float = Field(60.0, gt=0)
+    JOB_QUEUE_MAX_ATTEMPTS: int = Field(5, ge=1)
+    JOB_QUEUE_MAX_PENDING: int = Field(10000, ge=1)
+    JOB_QUEUE_BATCH_SIZE: int = Field(10, ge=1)
+    JOB_QUEUE_POLL_INTERVAL: float = Field(1.0, gt=0)
+    JOB_QUEUE_RETENTION_HOURS: float = 72.0
+    
+    # Deduplicación de mensajes por ID de WhatsApp
+    DEDUP_CACHE_SIZE: int = Field(10000, ge=1)
+    DEDUP_MEMORY_TTL_SECONDS: float = Field(3600.0, gt=0)
+    DEDUP_PERSISTENT_TTL_SECONDS: int = Field(7 * 24 * 3600, gt=0)
+    
+    # Notificaciones de estado (sent/delivered/read): agregarlas en métricas o descartarlas
+    WEBHOOK_STATUS_METRICS: bool = True
+    
+    # Mensajes de un mismo webhook procesados en paralelo por la Azure Function (blueprint.py)
+    WEBHOOK_MAX_CONCURRENCY: int = Field(4, ge=1)
     
     @computed_field
     @property
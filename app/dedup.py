@@ -0,0 +1,127 @@
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from providers.cache import LRUTTLCache
+from providers.storage.base import StorageProvider
+
+
+class MessageDeduplicator:
+    """
+    Detecta mensajes de WhatsApp repetidos usando su ID.
+
+    Usa una caché LRU+TTL en memoria como primer nivel y un conjunto de mensajes
+    vistos persistido en el proveedor de almacenamiento como segundo nivel, de modo
+    que las reentregas de Meta se descartan antes de descargar la imagen.
+
+    Un mensaje reclamado queda en proceso durante `lease` segundos hasta que se
+    completa (`complete`) o se libera (`release`). Si el worker muere en medio,
+    el lease vence y el reintento de la cola puede reclamarlo de nuevo.
+    """
+
+    def __init__(
+        self,
+        storage_provider: Optional[StorageProvider] = None,
+        max_size: int = 10000,
+        ttl: float = 3600.0,
+        lease: float = 300.0
+    ):
+        """
+        Args:
+            storage_provider: Proveedor con el conjunto persistido de mensajes vistos
+            max_size: Mensajes recordados en memoria
+            ttl: Segundos que se recuerda un mensaje en memoria
+            lease: Segundos que un mensaje reclamado se considera en proceso
+        """
+        self.storage_provider = storage_provider
+        self.lease = lease
+        # ID -> fin del lease (monotónico) mientras está en proceso, o None cuando terminó
+        self._seen = LRUTTLCache(max_size=max_size, ttl=ttl)
+        self._memory_hits = 0
+        self._storage_hits = 0
+        self._misses = 0
+        self._storage_errors = 0
+
+    async def claim(self, message_id: Optional[str]) -> bool:
+        """
+        Reclama un mensaje para procesarlo.
+
+        Args:
+            message_id: ID del mensaje de WhatsApp
+
+        Returns:
+            bool: True si el mensaje es nuevo (o su reclamo anterior venció) y debe
+                procesarse, False si es un duplicado
+        """
+        if not message_id:
+            return True
+
+        missing = object()
+        lease_until = self._seen.get(message_id, missing)
+        if lease_until is not missing and (lease_until is None or lease_until > time.monotonic()):
+            self._memory_hits += 1
+            return False
+
+        if self.storage_provider is not None:
+            try:
+                is_new = await self.storage_provider.mark_message_seen(message_id, lease_seconds=self.lease)
+            except Exception as e:
+                # Ante un fallo del almacenamiento preferimos procesar de nuevo que perder el mensaje
+                self._storage_errors += 1
+                logging.error(f"MessageDeduplicator: error consultando mensajes vistos: {str(e)}")
+                is_new = True
+            if not is_new:
+                self._storage_hits += 1
+                return False
+
+        self._misses += 1
+        self._seen.set(message_id, time.monotonic() + self.lease)
+        return True
+
+    async def complete(self, message_id: Optional[str]) -> None:
+        """
+        Marca un mensaje reclamado como procesado: sus reentregas ya no se procesan.
+
+        Args:
+            message_id: ID del mensaje de WhatsApp
+        """
+        if not message_id:
+            return
+        self._seen.set(message_id, None)
+        if self.storage_provider is not None:
+            try:
+                await self.storage_provider.complete_message_seen(message_id)
+            except Exception as e:
+                self._storage_errors += 1
+                logging.error(f"MessageDeduplicator: error completando mensaje {message_id}: {str(e)}")
+
+    async def release(self, message_id: Optional[str]) -> None:
+        """
+        Olvida un mensaje para que pueda reprocesarse (ej: tras un fallo).
+
+        Args:
+            message_id: ID del mensaje de WhatsApp
+        """
+        if not message_id:
+            return
+        self._seen.pop(message_id)
+        if self.storage_provider is not None:
+            try:
+                await self.storage_provider.forget_message_seen(message_id)
+            except Exception as e:
+                self._storage_errors += 1
+                logging.error(f"MessageDeduplicator: error liberando mensaje {message_id}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve contadores de aciertos y fallos"""
+        hits = self._memory_hits + self._storage_hits
+        total = hits + self._misses
+        return {
+            "hits": hits,
+            "memory_hits": self._memory_hits,
+            "storage_hits": self._storage_hits,
+            "misses": self._misses,
+            "storage_errors": self._storage_errors,
+            "hit_ratio": hits / total if total else 0.0,
+            "cached_ids": len(self._seen),
+        }
@@ -1,34 +1,245 @@
-from fastapi import Depends, HTTPException, status
-from typing import Annotated, Generator
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import Depends, HTTPException, Request, status
+from typing import Annotated, Generator, Optional
 
 from app.config import settings
+from providers.vision.base import VisionProvider
 from providers.vision.openai_provider import OpenAIVisionProvider
+from providers.vision.cache import CachingVisionProvider, SqliteResultCache
+from providers.vision.routing import LatencyRoutingVisionProvider, VisionBackend, parse_vision_backends
+from providers.vision.tiling import TilingVisionProvider
+from providers.vision.tesseract_provider import ConfidenceRoutingVisionProvider, TesseractVisionProvider
+from providers.vision.preprocessing import ImagePreprocessor
+from providers.vision.image_tokens import get_sizing_policy
+from providers.vision.streaming import VisionStreamMetrics
+from providers.storage.base import StorageProvider
 from providers.storage.mongodb_provider import MongoDBProvider
+from providers.storage.write_behind import WriteBehindStorageProvider
+from providers.http import HttpClientRegistry, get_http_clients, set_http_clients
+from providers.resilience import ResilienceRegistry, RetryPolicy, set_resilience
+from providers.rate_limit import RateLimitRegistry, get_rate_limits, set_rate_limits
+from agents.data_extraction_agent import extraction_agent, get_model_for_environment
 from models.dependencies import VisionAgentDependencies, StorageAgentDependencies, ExtractorAgentDependencies
+from app.job_queue import JobDispatcher
+from app.dedup import MessageDeduplicator
+from app.persistence import InvoicePersister
+from app.near_duplicates import NearDuplicateIndex
+from app.model_tiers import ModelTier, TieredExtractor, parse_model_tiers
+from app.rule_extraction import DEFAULT_TEMPLATES, RuleBasedExtractor, load_templates
+from app.status_events import DeliveryMetrics
+
+# Preprocesamiento de imágenes
+_image_preprocessor: Optional[ImagePreprocessor] = None
+_image_executor: Optional[ProcessPoolExecutor] = None
+
+def get_image_preprocessor() -> Optional[ImagePreprocessor]:
+    """Proporciona la etapa de preprocesamiento de imágenes, o None si está desactivada"""
+    global _image_preprocessor, _image_executor
+    if not settings.IMAGE_PREPROCESSING:
+        return None
+    if _image_preprocessor is None:
+        if settings.IMAGE_PREPROCESSING_PROCESSES:
+            _image_executor = ProcessPoolExecutor(max_workers=settings.IMAGE_PREPROCESSING_PROCESSES)
+        _image_preprocessor = ImagePreprocessor(
+            max_long_edge=settings.IMAGE_MAX_LONG_EDGE,
+            quality=settings.IMAGE_JPEG_QUALITY,
+            grayscale=settings.IMAGE_GRAYSCALE,
+            sizing_policy=get_sizing_policy(
+                settings.VISION_SIZING_POLICY,
+                min_short_side=settings.IMAGE_MIN_SHORT_SIDE
+            ),
+            executor=_image_executor
+        )
+    return _image_preprocessor
 
 # Vision Provider
-def get_vision_provider() -> OpenAIVisionProvider:
-    """Proporciona el proveedor de visión"""
-    return OpenAIVisionProvider()
+_vision_provider: Optional[VisionProvider] = None
+_vision_router: Optional[ConfidenceRoutingVisionProvider] = None
+_vision_backends: Optional[LatencyRoutingVisionProvider] = None
+_vision_tiler: Optional[TilingVisionProvider] = None
+
+def _build_vision_backends() -> VisionProvider:
+    """Proveedor OpenAI único o, con VISION_BACKENDS o cobertura activa, el enrutador por latencia"""
+    global _vision_backends
+    specs = parse_vision_backends(settings.VISION_BACKENDS)
+    if not specs and not settings.VISION_HEDGING:
+        return OpenAIVisionProvider(preprocessor=get_image_preprocessor())
+    backends = [
+        VisionBackend(
+            name=f"{model}@{api_base}" if api_base else model,
+            provider=OpenAIVisionProvider(
+                preprocessor=get_image_preprocessor(),
+                api_base=api_base or "https://api.openai.com/v1"
+            ),
+            model_name=model,
+            alpha=settings.VISION_ROUTING_EWMA_ALPHA
+        )
+        for model, api_base in specs or [(settings.VISION_MODEL, None)]
+    ]
+    _vision_backends = LatencyRoutingVisionProvider(
+        backends,
+        hedging=settings.VISION_HEDGING,
+        hedge_percentile=settings.VISION_HEDGE_PERCENTILE,
+        min_hedge_delay=settings.VISION_HEDGE_MIN_DELAY_SECONDS,
+        max_error_rate=settings.VISION_BACKEND_MAX_ERROR_RATE,
+        recovery_seconds=settings.VISION_BACKEND_RECOVERY_SECONDS
+    )
+    return _vision_backends
+
+def get_vision_provider() -> VisionProvider:
+    """Proporciona el proveedor de visión compartido, con caché de resultados si está activa"""
+    global _vision_provider, _vision_router, _vision_backends, _vision_tiler, _structured_vision_provider
+    if _vision_provider is None:
+        _vision_provider = _build_vision_backends()
+        if settings.VISION_TILING:
+            _vision_tiler = _vision_provider = TilingVisionProvider(
+                _vision_provider,
+                min_aspect_ratio=settings.VISION_TILE_MIN_ASPECT_RATIO,
+                tile_aspect_ratio=settings.VISION_TILE_ASPECT_RATIO,
+                overlap=settings.VISION_TILE_OVERLAP,
+                max_tiles=settings.VISION_MAX_TILES,
+                executor=_image_executor
+            )
+        if settings.VISION_LOCAL_OCR:
+            local_provider = TesseractVisionProvider(
+                command=settings.TESSERACT_CMD,
+                languages=settings.TESSERACT_LANGUAGES,
+                page_segmentation_mode=settings.TESSERACT_PSM,
+                max_processes=settings.TESSERACT_PROCESSES or None
+            )
+            if not local_provider.available():
+                logging.warning(f"Tesseract no encontrado ({settings.TESSERACT_CMD}); todas las imágenes irán al modelo de visión")
+            _vision_router = _vision_provider = ConfidenceRoutingVisionProvider(
+                local_provider,
+                _vision_provider,
+                min_confidence=settings.VISION_OCR_MIN_CONFIDENCE,
+                min_words=settings.VISION_OCR_MIN_WORDS
+            )
+        if settings.VISION_CACHE:
+            disk_cache = None
+            if settings.VISION_CACHE_PATH:
+                disk_cache = SqliteResultCache(settings.VISION_CACHE_PATH, ttl=settings.VISION_CACHE_TTL_SECONDS)
+                disk_cache.open()
+            _vision_provider = CachingVisionProvider(
+                _vision_provider,
+                max_size=settings.VISION_CACHE_SIZE,
+                ttl=settings.VISION_CACHE_TTL_SECONDS,
+                disk_cache=disk_cache
+            )
+    return _vision_provider
+
+def get_vision_router() -> Optional[ConfidenceRoutingVisionProvider]:
+    """Proporciona el enrutador OCR local / modelo de visión, o None si el OCR local está desactivado"""
+    get_vision_provider()
+    return _vision_router
+
+def get_vision_tiler() -> Optional[TilingVisionProvider]:
+    """Proporciona la etapa de división de recibos largos, o None si está desactivada"""
+    get_vision_provider()
+    return _vision_tiler
+
+def get_vision_backends() -> Optional[LatencyRoutingVisionProvider]:
+    """Proporciona el enrutador por latencia entre backends de visión, o None si no está configurado"""
+    get_vision_provider()
+    return _vision_backends
 
 # Storage Provider
-def get_storage_provider() -> MongoDBProvider:
-    """Proporciona el proveedor de almacenamiento"""
-    return MongoDBProvider(connection_string=settings.MONGO_CONNECTION_STRING)
+_storage_provider: Optional[StorageProvider] = None
+
+def _storage_provider_class() -> type:
+    """Devuelve la clase del proveedor según STORAGE_BACKEND, con pymongo como alternativa"""
+    if settings.STORAGE_BACKEND == "motor":
+        try:
+            from providers.storage.motor_provider import MotorMongoDBProvider
+            return MotorMongoDBProvider
+        except ImportError:
+            logging.warning("motor no está instalado; se usa el proveedor de pymongo")
+    return MongoDBProvider
+
+def get_storage_provider() -> StorageProvider:
+    """Proporciona el proveedor de almacenamiento compartido por todo el proceso"""
+    global _storage_provider
+    if _storage_provider is None:
+        _storage_provider = _storage_provider_class()(
+            connection_string=settings.MONGO_CONNECTION_STRING,
+            database_name=settings.MONGO_DATABASE_NAME,
+            seen_messages_ttl=settings.DEDUP_PERSISTENT_TTL_SECONDS,
+            maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS
+        )
+        if settings.STORAGE_WRITE_BEHIND:
+            _storage_provider = WriteBehindStorageProvider(
+                _storage_provider,
+                max_batch_size=settings.STORAGE_WRITE_BEHIND_BATCH_SIZE,
+                flush_interval=settings.STORAGE_WRITE_BEHIND_FLUSH_INTERVAL
+            )
+    return _storage_provider
+
+# Guardado determinista de facturas
+_invoice_persister: Optional[InvoicePersister] = None
+
+def get_invoice_persister() -> InvoicePersister:
+    """Proporciona la etapa de guardado de facturas, con los mismos reintentos que los proveedores"""
+    global _invoice_persister
+    if _invoice_persister is None:
+        _invoice_persister = InvoicePersister(
+            get_storage_provider(),
+            retry_policy=RetryPolicy(
+                max_attempts=settings.RETRY_MAX_ATTEMPTS,
+                base_delay=settings.RETRY_BASE_DELAY_SECONDS,
+                max_delay=settings.RETRY_MAX_DELAY_SECONDS
+            )
+        )
+    return _invoice_persister
+
+# Deduplicación de mensajes
+_message_deduplicator: Optional[MessageDeduplicator] = None
+
+def get_message_deduplicator() -> MessageDeduplicator:
+    """Proporciona el deduplicador de mensajes compartido por todo el proceso"""
+    global _message_deduplicator
+    if _message_deduplicator is None:
+        _message_deduplicator = MessageDeduplicator(
+            storage_provider=get_storage_provider(),
+            max_size=settings.DEDUP_CACHE_SIZE,
+            ttl=settings.DEDUP_MEMORY_TTL_SECONDS,
+            # Tras una caída la cola retoma el trabajo como pronto 2/3 del visibility timeout
+            # después de reclamar el mensaje (se renueva cada 1/3); para entonces su lease venció
+            lease=settings.JOB_QUEUE_VISIBILITY_TIMEOUT / 2
+        )
+    return _message_deduplicator
 
 # Dependencias para agentes
+# Proveedor con salidas estructuradas para el modo de pipeline "direct"
+_structured_vision_provider: Optional[OpenAIVisionProvider] = None
+
+def get_structured_vision_provider() -> OpenAIVisionProvider:
+    """Proporciona el proveedor de OpenAI que extrae la factura de la imagen en una sola llamada"""
+    global _structured_vision_provider
+    if _structured_vision_provider is None:
+        _structured_vision_provider = OpenAIVisionProvider(preprocessor=get_image_preprocessor())
+    return _structured_vision_provider
+
 def get_vision_deps(
-    vision_provider: Annotated[OpenAIVisionProvider, Depends(get_vision_provider)]
+    vision_provider: Annotated[VisionProvider, Depends(get_vision_provider)]
 ) -> VisionAgentDependencies:
     """Proporciona las dependencias para el agente de visión"""
     return VisionAgentDependencies(
         vision_provider=vision_provider,
         model_name=settings.VISION_MODEL,
-        api_key=settings.OPENAI_API_KEY
+        api_key=settings.OPENAI_API_KEY,
+        streaming=settings.VISION_STREAMING,
+        stream_progress_chars=settings.VISION_STREAM_PROGRESS_CHARS,
+        pipeline_mode=settings.PIPELINE_MODE,
+        structured_provider=get_structured_vision_provider() if settings.PIPELINE_MODE == "direct" else None
     )
 
 def get_storage_deps(
-    storage_provider: Annotated[MongoDBProvider, Depends(get_storage_provider)]
+    storage_provider: Annotated[StorageProvider, Depends(get_storage_provider)]
 ) -> StorageAgentDependencies:
     """Proporciona las dependencias para el agente de almacenamiento"""
     return StorageAgentDependencies(
@@ -42,3 +253,141 @@ def get_extractor_deps() -> ExtractorAgentDependencies:
         temperature=0.0,
         max_tokens=1000
     )
+
+# Ciclo de vida de los proveedores compartidos
+async def startup_providers() -> None:
+    """Crea los proveedores compartidos y prepara los índices. Se llama una vez en el lifespan"""
+    set_http_clients(HttpClientRegistry(
+        limit=settings.HTTP_POOL_LIMIT,
+        limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+        dns_cache_ttl=settings.HTTP_DNS_CACHE_TTL_SECONDS,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT_SECONDS,
+        connect_timeout=settings.HTTP_CONNECT_TIMEOUT_SECONDS,
+        total_timeout=settings.HTTP_TOTAL_TIMEOUT_SECONDS
+    ))
+    set_resilience(ResilienceRegistry(
+        retry_policy=RetryPolicy(
+            max_attempts=settings.RETRY_MAX_ATTEMPTS,
+            base_delay=settings.RETRY_BASE_DELAY_SECONDS,
+            max_delay=settings.RETRY_MAX_DELAY_SECONDS,
+            max_retry_after=settings.RETRY_MAX_RETRY_AFTER_SECONDS
+        ),
+        failure_threshold=settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.CIRCUIT_BREAKER_RESET_SECONDS
+    ))
+    if settings.OPENAI_RATE_LIMIT:
+        set_rate_limits(RateLimitRegistry(
+            requests_per_minute=settings.OPENAI_REQUESTS_PER_MINUTE,
+            tokens_per_minute=settings.OPENAI_TOKENS_PER_MINUTE,
+            shared_path=settings.OPENAI_RATE_LIMIT_SHARED_PATH or None
+        ))
+    vision_provider = get_vision_provider()
+    disk_cache = getattr(vision_provider, "disk_cache", None)
+    if disk_cache is not None:
+        await disk_cache.purge()
+    storage_provider = get_storage_provider()
+    try:
+        await storage_provider.ensure_indexes()
+    except Exception as e:
+        # Sin base de datos la aplicación sigue aceptando webhooks; los trabajos se reintentan
+        logging.error(f"No se pudieron crear los índices de almacenamiento: {str(e)}")
+
+async def shutdown_providers() -> None:
+    """Cierra los proveedores compartidos. Se llama una vez al cerrar la aplicación (escribe las facturas pendientes)"""
+    global _storage_provider, _message_deduplicator, _image_preprocessor, _image_executor, _invoice_persister
+    global _vision_provider, _vision_router, _vision_backends, _vision_tiler, _structured_vision_provider
+    _message_deduplicator = None
+    _invoice_persister = None
+    if _vision_provider is not None:
+        disk_cache = getattr(_vision_provider, "disk_cache", None)
+        if disk_cache is not None:
+            disk_cache.close()
+        _vision_provider = None
+        _vision_router = None
+        _vision_backends = None
+        _vision_tiler = None
+    _structured_vision_provider = None
+    _image_preprocessor = None
+    if _image_executor is not None:
+        _image_executor.shutdown(wait=False, cancel_futures=True)
+        _image_executor = None
+    await get_http_clients().close()
+    set_http_clients(None)
+    set_resilience(None)
+    if get_rate_limits() is not None:
+        get_rate_limits().close()
+        set_rate_limits(None)
+    if _storage_provider is not None:
+        await _storage_provider.close()
+        _storage_provider = None
+
+# Casi duplicados de imágenes
+_near_duplicate_index: Optional[NearDuplicateIndex] = None
+
+def get_near_duplicate_index() -> Optional[NearDuplicateIndex]:
+    """Proporciona el índice de imágenes casi duplicadas, o None si está desactivado"""
+    global _near_duplicate_index
+    if not settings.NEAR_DUPLICATE_DETECTION:
+        return None
+    if _near_duplicate_index is None:
+        _near_duplicate_index = NearDuplicateIndex(
+            max_distance=settings.NEAR_DUPLICATE_MAX_DISTANCE,
+            ttl=settings.NEAR_DUPLICATE_TTL_SECONDS,
+            verify_rate=settings.NEAR_DUPLICATE_VERIFY_RATE
+        )
+    return _near_duplicate_index
+
+# Extracción por plantillas
+_rule_extractor: Optional[RuleBasedExtractor] = None
+
+def get_rule_extractor() -> Optional[RuleBasedExtractor]:
+    """Proporciona el extractor por plantillas previo al agente de extracción, o None si está desactivado"""
+    global _rule_extractor
+    if not settings.RULE_EXTRACTION:
+        return None
+    if _rule_extractor is None:
+        templates = (
+            load_templates(settings.RULE_EXTRACTION_TEMPLATES_PATH)
+            if settings.RULE_EXTRACTION_TEMPLATES_PATH
+            else DEFAULT_TEMPLATES
+        )
+        _rule_extractor = RuleBasedExtractor(templates)
+    return _rule_extractor
+
+# Niveles de modelo del agente de extracción
+_tiered_extractor: Optional[TieredExtractor] = None
+
+def get_tiered_extractor() -> TieredExtractor:
+    """Proporciona el enrutador de extracción que prueba primero los modelos baratos"""
+    global _tiered_extractor
+    if _tiered_extractor is None:
+        _tiered_extractor = TieredExtractor(extraction_agent, [
+            ModelTier(name, get_model_for_environment(name))
+            for name in parse_model_tiers(settings.EXTRACTION_MODEL_TIERS, settings.EXTRACTION_MODEL)
+        ], max_reasks=settings.EXTRACTION_MAX_REASKS)
+    return _tiered_extractor
+
+# Métricas de entrega
+_delivery_metrics = DeliveryMetrics()
+
+def get_delivery_metrics() -> DeliveryMetrics:
+    """Proporciona el agregador de notificaciones de estado del proceso"""
+    return _delivery_metrics
+
+# Métricas de las respuestas de visión en streaming
+_vision_stream_metrics = VisionStreamMetrics()
+
+def get_vision_stream_metrics() -> VisionStreamMetrics:
+    """Proporciona los tiempos (TTFT y total) de las respuestas de visión en streaming"""
+    return _vision_stream_metrics
+
+# Cola de trabajos
+def get_job_dispatcher(request: Request) -> JobDispatcher:
+    """Proporciona el dispatcher de la cola de trabajos creado en el lifespan de la aplicación"""
+    dispatcher = getattr(request.app.state, "job_dispatcher", None)
+    if dispatcher is None or not dispatcher.pool.running:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Job queue not available"
+        )
+    return dispatcher
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+async def run_grouped(
+    items: Iterable[T],
+    key: Callable[[T], Optional[Hashable]],
+    handler: Callable[[T], Awaitable[Any]],
+    max_concurrency: int
+) -> List[Any]:
+    """
+    Ejecuta `handler` sobre todos los elementos de forma concurrente.
+
+    Los elementos con la misma clave se procesan en orden y de uno en uno; el
+    número total de handlers en ejecución nunca supera `max_concurrency`.
+
+    Args:
+        items: Elementos a procesar
+        key: Función que devuelve la clave de ordenamiento de cada elemento
+        handler: Corrutina a ejecutar por elemento
+        max_concurrency: Límite global de handlers simultáneos
+
+    Returns:
+        List[Any]: Resultado (o excepción) de cada elemento, en el orden original
+    """
+    items = list(items)
+    results: List[Any] = [None] * len(items)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    # Agrupar por clave conservando el orden de llegada dentro de cada grupo
+    groups: Dict[Hashable, List[int]] = {}
+    for index, item in enumerate(items):
+        item_key = key(item)
+        groups.setdefault(item_key if item_key is not None else ("__index__", index), []).append(index)
+
+    async def run_group(indexes: List[int]) -> None:
+        for index in indexes:
+            async with semaphore:
+                try:
+                    results[index] = await handler(items[index])
+                except Exception as e:
+                    logging.error(f"Error procesando elemento {index}: {str(e)}")
+                    results[index] = e
+
+    await asyncio.gather(*(run_group(indexes) for indexes in groups.values()))
+    return results
@@ -0,0 +1,454 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.worker_pool import Job, QueueFullError, WorkerPool
+
+# Estados posibles de un trabajo persistido
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    lease_token TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    ordering_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs (status, available_at);
+"""
+
+# Colas creadas antes de que existiera el orden por clave
+_MIGRATIONS = (
+    ("ordering_key", "ALTER TABLE jobs ADD COLUMN ordering_key TEXT"),
+)
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_jobs_ordering_key ON jobs (ordering_key, id);
+"""
+
+
+@dataclass
+class ClaimedJob:
+    """Trabajo reclamado por un worker con un lease activo"""
+    id: int
+    job_key: str
+    payload: Dict[str, Any]
+    attempts: int
+    lease_token: str
+
+
+class DurableJobQueue:
+    """
+    Cola de trabajos persistente sobre un archivo SQLite en modo WAL.
+
+    Cada trabajo se reclama con un lease (visibility timeout); si el proceso muere
+    antes de completarlo, el lease expira y el trabajo vuelve a estar disponible.
+    Los trabajos terminados no se vuelven a reclamar. Los trabajos con la misma
+    clave de orden se reclaman de uno en uno y en orden de llegada: mientras uno
+    está en curso o esperando su reintento, los siguientes esperan.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        visibility_timeout: float = 60.0,
+        max_attempts: int = 5,
+        max_pending: int = 10000
+    ):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        """Abre la base de datos y crea el esquema si no existe"""
+        if self._conn is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, migration in _MIGRATIONS:
+            if column not in columns:
+                conn.execute(migration)
+        conn.executescript(_INDEXES)
+        self._conn = conn
+
+    def close(self) -> None:
+        """Cierra la conexión con la base de datos"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    async def enqueue(self, job_key: str, payload: Dict[str, Any], ordering_key: Optional[str] = None) -> bool:
+        """
+        Persiste un trabajo. Las claves repetidas se ignoran.
+
+        Args:
+            job_key: Clave única del trabajo (ej: ID del mensaje de WhatsApp)
+            payload: Datos serializables a JSON del trabajo
+            ordering_key: Clave de orden (ej: remitente); None si puede ejecutarse en cualquier orden
+
+        Returns:
+            bool: True si el trabajo es nuevo, False si ya existía
+
+        Raises:
+            QueueFullError: Si hay demasiados trabajos pendientes
+        """
+        return await self.enqueue_many([(job_key, payload)], [ordering_key]) == 1
+
+    async def enqueue_many(
+        self,
+        jobs: List[Tuple[str, Dict[str, Any]]],
+        ordering_keys: Optional[List[Optional[str]]] = None
+    ) -> int:
+        """
+        Persiste varios trabajos en una sola transacción. Las claves repetidas se ignoran.
+
+        Args:
+            jobs: Pares (clave única, payload serializable a JSON)
+            ordering_keys: Clave de orden de cada trabajo; sin ella no se impone orden
+
+        Returns:
+            int: Número de trabajos nuevos
+
+        Raises:
+            QueueFullError: Si hay demasiados trabajos pendientes
+        """
+        if not jobs:
+            return 0
+        ordering_keys = ordering_keys or [None] * len(jobs)
+        rows = [
+            (job_key, json.dumps(payload), ordering_key)
+            for (job_key, payload), ordering_key in zip(jobs, ordering_keys)
+        ]
+        return await asyncio.to_thread(self._enqueue, rows)
+
+    async def claim(self, limit: int) -> List[ClaimedJob]:
+        """
+        Reclama hasta `limit` trabajos disponibles en una sola transacción.
+
+        Args:
+            limit: Número máximo de trabajos a reclamar
+
+        Returns:
+            List[ClaimedJob]: Trabajos reclamados con su lease
+        """
+        if limit <= 0:
+            return []
+        return await asyncio.to_thread(self._claim, limit)
+
+    async def extend_lease(self, job_id: int, lease_token: str) -> bool:
+        """Extiende el lease de un trabajo en curso. Devuelve False si se perdió el lease"""
+        return await asyncio.to_thread(self._extend_lease, job_id, lease_token)
+
+    async def complete(self, job_id: int, lease_token: str) -> None:
+        """Marca un trabajo como terminado"""
+        await asyncio.to_thread(self._complete, job_id, lease_token)
+
+    async def fail(self, job_id: int, lease_token: str, error: str) -> str:
+        """
+        Registra un intento fallido y reprograma el trabajo con backoff exponencial.
+
+        Returns:
+            str: Nuevo estado del trabajo (pending o dead)
+        """
+        return await asyncio.to_thread(self._fail, job_id, lease_token, error)
+
+    async def purge(self, older_than: float) -> int:
+        """Elimina trabajos terminados o muertos con más de `older_than` segundos"""
+        return await asyncio.to_thread(self._purge, older_than)
+
+    async def stats(self) -> Dict[str, int]:
+        """Devuelve el número de trabajos por estado"""
+        return await asyncio.to_thread(self._stats)
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        if self._conn is None:
+            raise RuntimeError("La cola de trabajos no está abierta")
+        return self._conn.execute(sql, params)
+
+    def _enqueue(self, rows: List[Tuple[str, str, Optional[str]]]) -> int:
+        now = time.time()
+        with self._lock:
+            self._execute("BEGIN IMMEDIATE")
+            try:
+                pending = self._execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (PENDING, RUNNING)
+                ).fetchone()[0]
+                if pending + len(rows) > self.max_pending:
+                    raise QueueFullError(
+                        f"Cola persistente llena ({self.max_pending} trabajos pendientes)"
+                    )
+                created = 0
+                for job_key, payload, ordering_key in rows:
+                    cursor = self._execute(
+                        "INSERT OR IGNORE INTO jobs "
+                        "(job_key, payload, status, attempts, available_at, created_at, updated_at, ordering_key) "
+                        "VALUES (?, ?, ?, 0, ?, ?, ?, ?)",
+                        (job_key, payload, PENDING, now, now, now, ordering_key)
+                    )
+                    created += cursor.rowcount
+                self._execute("COMMIT")
+            except BaseException:
+                self._execute("ROLLBACK")
+                raise
+        return created
+
+    def _claim(self, limit: int) -> List[ClaimedJob]:
+        now = time.time()
+        lease_until = now + self.visibility_timeout
+        claimed = []
+        with self._lock:
+            self._execute("BEGIN IMMEDIATE")
+            try:
+                # Un trabajo espera mientras otro anterior con su clave de orden siga
+                # pendiente (también esperando su reintento) o en curso
+                rows = self._execute(
+                    "SELECT id, job_key, payload, attempts FROM jobs AS job "
+                    "WHERE ((status = ? AND available_at <= ?) OR (status = ? AND lease_until <= ?)) "
+                    "AND (ordering_key IS NULL OR NOT EXISTS ("
+                    "SELECT 1 FROM jobs AS earlier WHERE earlier.ordering_key = job.ordering_key "
+                    "AND earlier.id < job.id AND earlier.status IN (?, ?))) "
+                    "ORDER BY id LIMIT ?",
+                    (PENDING, now, RUNNING, now, PENDING, RUNNING, limit)
+                ).fetchall()
+                for job_id, job_key, payload, attempts in rows:
+                    token = uuid.uuid4().hex
+                    self._execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, "
+                        "lease_token = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, lease_until, token, now, job_id)
+                    )
+                    claimed.append(ClaimedJob(
+                        id=job_id,
+                        job_key=job_key,
+                        payload=json.loads(payload),
+                        attempts=attempts + 1,
+                        lease_token=token
+                    ))
+                self._execute("COMMIT")
+            except BaseException:
+                self._execute("ROLLBACK")
+                raise
+        return claimed
+
+    def _extend_lease(self, job_id: int, lease_token: str) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_token = ?",
+                (now + self.visibility_timeout, now, job_id, RUNNING, lease_token)
+            )
+        return cursor.rowcount > 0
+
+    def _complete(self, job_id: int, lease_token: str) -> None:
+        with self._lock:
+            self._execute(
+                "UPDATE jobs SET status = ?, lease_until = NULL, lease_token = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_token = ?",
+                (DONE, time.time(), job_id, lease_token)
+            )
+
+    def _fail(self, job_id: int, lease_token: str, error: str) -> str:
+        now = time.time()
+        with self._lock:
+            row = self._execute(
+                "SELECT attempts FROM jobs WHERE id = ? AND lease_token = ?",
+                (job_id, lease_token)
+            ).fetchone()
+            if row is None:
+                return RUNNING
+            attempts = row[0]
+            new_status = DEAD if attempts >= self.max_attempts else PENDING
+            backoff = min(2 ** attempts, 300)
+            self._execute(
+                "UPDATE jobs SET status = ?, available_at = ?, lease_until = NULL, "
+                "lease_token = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                (new_status, now + backoff, error[:1000], now, job_id)
+            )
+        return new_status
+
+    def _purge(self, older_than: float) -> int:
+        with self._lock:
+            cursor = self._execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, DEAD, time.time() - older_than)
+            )
+        return cursor.rowcount
+
+    def _stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        stats = {PENDING: 0, RUNNING: 0, DONE: 0, DEAD: 0}
+        stats.update(dict(rows))
+        return stats
+
+
+class JobDispatcher:
+    """
+    Reclama trabajos de la cola persistente por lotes y los ejecuta en el pool de workers.
+
+    Solo reclama tantos trabajos como workers libres haya, de modo que los leases no
+    expiren mientras los trabajos esperan en la cola en memoria.
+    """
+
+    def __init__(
+        self,
+        queue: DurableJobQueue,
+        pool: WorkerPool,
+        handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        batch_size: int = 10,
+        poll_interval: float = 1.0,
+        key_func: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None
+    ):
+        self.queue = queue
+        self.pool = pool
+        self.handler = handler
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.key_func = key_func
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self._heartbeats: set = set()
+
+    async def enqueue(self, job_key: str, payload: Dict[str, Any]) -> bool:
+        """
+        Persiste un trabajo en la cola y despierta al dispatcher.
+
+        Returns:
+            bool: True si el trabajo es nuevo, False si ya existía
+        """
+        return await self.enqueue_many([(job_key, payload)]) == 1
+
+    async def enqueue_many(self, jobs: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        Persiste varios trabajos en una sola transacción y despierta al dispatcher.
+
+        Returns:
+            int: Número de trabajos nuevos
+        """
+        ordering_keys = [self.key_func(payload) for _, payload in jobs] if self.key_func else None
+        created = await self.queue.enqueue_many(jobs, ordering_keys)
+        if created:
+            self.notify()
+        return created
+
+    def notify(self) -> None:
+        """Despierta al dispatcher cuando hay trabajos nuevos o workers libres"""
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        """Inicia el ciclo de reclamación de trabajos"""
+        if self._task is not None:
+            return
+        self._running = True
+        self._task = asyncio.create_task(self._run(), name="job-dispatcher")
+
+    async def stop(self) -> None:
+        """Deja de reclamar trabajos nuevos; los trabajos en curso siguen en el pool"""
+        self._running = False
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def close(self) -> None:
+        """
+        Detiene la renovación de leases de los trabajos que no llegaron a ejecutarse.
+
+        Debe llamarse después de drenar el pool; esos trabajos se retoman cuando expire su lease.
+        """
+        await self.stop()
+        for heartbeat in list(self._heartbeats):
+            heartbeat.cancel()
+        await asyncio.gather(*self._heartbeats, return_exceptions=True)
+        self._heartbeats.clear()
+
+    async def _run(self) -> None:
+        while self._running:
+            self._wakeup.clear()
+            claimed = []
+            try:
+                capacity = min(self.batch_size, self.pool.idle_capacity)
+                claimed = await self.queue.claim(capacity)
+                for job in claimed:
+                    # El lease se renueva desde el reclamo, también mientras el trabajo
+                    # espera en el pool detrás de otro con la misma clave
+                    heartbeat = asyncio.create_task(self._heartbeat(job))
+                    self._heartbeats.add(heartbeat)
+                    heartbeat.add_done_callback(self._heartbeats.discard)
+                    try:
+                        self.pool.submit(Job(
+                            name=f"queued:{job.job_key}",
+                            func=self._execute,
+                            args=(job, heartbeat),
+                            key=self.key_func(job.payload) if self.key_func else None
+                        ))
+                    except Exception:
+                        heartbeat.cancel()
+                        raise
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"JobDispatcher: error al reclamar trabajos: {str(e)}")
+
+            # Si el lote vino completo probablemente quedan más trabajos disponibles
+            if claimed and len(claimed) == self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: ClaimedJob, heartbeat: asyncio.Task) -> None:
+        try:
+            await self.handler(job.payload)
+        except Exception as e:
+            status = await self.queue.fail(job.id, job.lease_token, str(e))
+            logging.error(
+                f"JobDispatcher: trabajo {job.job_key} falló (intento {job.attempts}, estado {status}): {str(e)}"
+            )
+            raise
+        else:
+            await self.queue.complete(job.id, job.lease_token)
+        finally:
+            heartbeat.cancel()
+            self.notify()
+
+    async def _heartbeat(self, job: ClaimedJob) -> None:
+        # Renovar el lease mientras el trabajo sigue en ejecución
+        interval = max(self.queue.visibility_timeout / 3, 0.1)
+        while True:
+            await asyncio.sleep(interval)
+            if not await self.queue.extend_lease(job.id, job.lease_token):
+                logging.warning(f"JobDispatcher: se perdió el lease del trabajo {job.job_key}")
+                return
@@ -0,0 +1,211 @@
+import logging
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from pydantic_ai import Agent
+
+from agents.validation import repair_invoice, validate_invoice
+from models.invoice import Invoice
+from providers.stats import percentile
+
+# Precios de OpenAI en USD por millón de tokens (entrada, salida)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+# Segunda petición al modelo, limitada a lo que la reparación local no pudo corregir
+REASK_PROMPT = (
+    "La factura extraída de este texto no pasa la validación: {problems}. "
+    "Corrige solo esos campos según el texto y deja el resto igual.\n\n"
+    "Factura extraída:\n{invoice}\n\n"
+    "Texto de la factura:\n{text}"
+)
+
+
+def parse_model_tiers(spec: str, final_model: str) -> List[str]:
+    """
+    Interpreta la lista de modelos de extracción, del más barato al más capaz.
+
+    Args:
+        spec: Modelos separados por comas que se prueban antes del final (ej: "gpt-4o-mini")
+        final_model: Modelo del último nivel, cuyo resultado se acepta siempre
+
+    Returns:
+        List[str]: Nombres de los niveles en orden, terminando en `final_model`
+    """
+    names = []
+    for name in [name.strip() for name in spec.split(",")] + [final_model]:
+        if name and name not in names:
+            names.append(name)
+    names.remove(final_model)
+    return names + [final_model]
+
+
+def estimate_cost(model_name: str, request_tokens: int, response_tokens: int) -> Optional[float]:
+    """Costo en USD de una llamada según MODEL_PRICES, o None si el modelo no tiene precio conocido"""
+    prices = MODEL_PRICES.get(model_name)
+    if prices is None:
+        return None
+    return (request_tokens * prices[0] + response_tokens * prices[1]) / 1_000_000
+
+
+class ModelTier:
+    """Un nivel de modelo de extracción con su latencia, uso y escalados"""
+
+    def __init__(self, name: str, model: Any, window: int = 1000):
+        """
+        Args:
+            name: Nombre del modelo (para precios y métricas)
+            model: Modelo de pydantic_ai con el que se ejecuta el agente
+            window: Latencias recientes guardadas para los percentiles
+        """
+        self.name = name
+        self.model = model
+        self.calls = 0
+        self.accepted = 0
+        self.escalated = 0
+        self.errors = 0
+        self.tokens = 0
+        self.cost: Optional[float] = 0.0 if name in MODEL_PRICES else None
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float, usage) -> None:
+        """Registra una llamada completada con su uso de tokens"""
+        self.calls += 1
+        self._latencies.append(latency)
+        self.tokens += usage.total_tokens or 0
+        cost = estimate_cost(self.name, usage.request_tokens or 0, usage.response_tokens or 0)
+        if cost is not None:
+            self.cost += cost
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = list(self._latencies)
+        return {
+            "calls": self.calls,
+            "accepted": self.accepted,
+            "escalated": self.escalated,
+            "errors": self.errors,
+            "escalation_rate": self.escalated / (self.calls + self.errors) if self.calls + self.errors else 0.0,
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "tokens": self.tokens,
+            "cost_usd": round(self.cost, 6) if self.cost is not None else None,
+        }
+
+
+class TieredExtractor:
+    """
+    Ejecuta el agente de extracción con el modelo más barato primero.
+
+    Cada factura se repara localmente (moneda, cantidad × precio, impuesto y
+    total) y se valida (campos obligatorios, montos y fecha). Si aún tiene
+    problemas, o el modelo falla, se escala al siguiente nivel con una
+    petición dirigida: la factura actual y solo los problemas que quedan, en
+    lugar de volver a extraerla entera. Tras el último nivel se hacen como
+    mucho `max_reasks` peticiones dirigidas más al mismo modelo; después se
+    acepta el último resultado, como antes de haber niveles.
+    """
+
+    def __init__(
+        self,
+        agent: Agent,
+        tiers: Sequence[ModelTier],
+        validate: Callable[[Invoice], List[str]] = validate_invoice,
+        repair: Callable[[Invoice], Tuple[Invoice, List[str]]] = repair_invoice,
+        max_reasks: int = 1
+    ):
+        """
+        Args:
+            agent: Agente de extracción con result_type Invoice
+            tiers: Niveles en orden, del más barato al más capaz
+            validate: Validación local; devuelve la lista de problemas
+            repair: Reparación local; devuelve la factura corregida y las correcciones
+            max_reasks: Peticiones dirigidas adicionales al último nivel
+        """
+        if not tiers:
+            raise ValueError("Se necesita al menos un nivel de modelo")
+        self.agent = agent
+        self.tiers = list(tiers)
+        self.validate = validate
+        self.repair = repair
+        self.max_reasks = max_reasks
+        self._extractions = 0
+        self._repaired = 0
+        self._repairs: Counter = Counter()
+        self._reasks = 0
+        self._reasks_resolved = 0
+
+    async def run(self, text: str, deps) -> Invoice:
+        """
+        Extrae la factura del texto escalando de nivel hasta obtener una válida.
+
+        Args:
+            text: Texto extraído de la imagen
+            deps: Dependencias del agente de extracción
+
+        Returns:
+            Invoice: Factura reparada del primer intento que pasa la validación, o la del último
+        """
+        self._extractions += 1
+        attempts = self.tiers + [self.tiers[-1]] * self.max_reasks
+        invoice, problems, invoice_tier = None, [], None
+        for number, tier in enumerate(attempts):
+            last = number == len(attempts) - 1
+            reask = invoice is not None
+            prompt = REASK_PROMPT.format(
+                problems="; ".join(problems),
+                invoice=invoice.model_dump_json(),
+                text=text
+            ) if reask else text
+            start = time.perf_counter()
+            try:
+                result = await self.agent.run(prompt, deps=deps, model=tier.model)
+            except Exception as e:
+                tier.errors += 1
+                if last:
+                    if invoice_tier is tier:
+                        logging.warning(f"Petición dirigida a {tier.name} fallida; se acepta su factura anterior")
+                        return invoice
+                    raise
+                tier.escalated += 1
+                logging.warning(f"Extracción con {tier.name} fallida ({e.__class__.__name__}: {str(e)[:200]}); se escala")
+                continue
+            tier.record(time.perf_counter() - start, result.usage())
+            self._reasks += reask
+            invoice, repairs = self.repair(result.data)
+            invoice_tier = tier
+            if repairs:
+                self._repaired += 1
+                self._repairs.update(repairs)
+                logging.info(f"Factura de {tier.name} reparada localmente: {', '.join(repairs)}")
+            problems = self.validate(invoice)
+            if problems and not last:
+                tier.escalated += 1
+                logging.info(f"Extracción con {tier.name} rechazada ({'; '.join(problems)}); se pide de nuevo")
+                continue
+            if problems:
+                logging.warning(f"Factura de {tier.name} aceptada con problemas: {'; '.join(problems)}")
+            elif reask:
+                self._reasks_resolved += 1
+            tier.accepted += 1
+            return invoice
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve extracciones, reparaciones, peticiones dirigidas y, por nivel, llamadas, escalados, latencia, tokens y costo"""
+        return {
+            "extractions": self._extractions,
+            # Fracción de extracciones que no se resolvieron con el primer nivel
+            "escalation_rate": self.tiers[0].escalated / self._extractions if self._extractions else 0.0,
+            "repaired": self._repaired,
+            "repairs": dict(self._repairs),
+            "reasks": self._reasks,
+            "reasks_resolved": self._reasks_resolved,
+            "tiers": {tier.name: tier.stats() for tier in self.tiers},
+        }
@@ -0,0 +1,196 @@
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from providers.cache import LRUTTLCache
+from providers.vision.preprocessing import hamming_distance
+
+
+class BKTree:
+    """
+    Árbol BK para búsquedas por distancia de Hamming.
+
+    Cada nodo guarda sus hijos indexados por la distancia al nodo; la
+    desigualdad triangular permite descartar las ramas que no pueden contener
+    hashes dentro del radio buscado sin compararlos uno a uno.
+    """
+
+    def __init__(self):
+        self._root: Optional[list] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, item: Any) -> None:
+        """
+        Inserta un hash; si ya existe exactamente, reemplaza su elemento.
+
+        Args:
+            value: Hash
+            item: Dato asociado al hash
+        """
+        if self._root is None:
+            self._root = [value, item, {}]
+            self._size = 1
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1] = item
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, {}]
+                self._size += 1
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int, Any]]:
+        """
+        Busca los hashes a distancia menor o igual que `max_distance`.
+
+        Args:
+            value: Hash buscado
+            max_distance: Distancia de Hamming máxima
+
+        Returns:
+            List[Tuple[int, int, Any]]: (distancia, hash, elemento), de menor a mayor distancia
+        """
+        results = []
+        pending = [self._root] if self._root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                results.append((distance, node[0], node[1]))
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+@dataclass
+class NearDuplicateMatch:
+    """Imagen anterior parecida a la consultada"""
+    value: Any
+    distance: int
+    dhash: int
+
+
+class NearDuplicateIndex:
+    """
+    Índice de imágenes ya procesadas por remitente, buscado por distancia de Hamming.
+
+    Permite reutilizar la extracción de una factura cuando el mismo remitente
+    envía otra foto o un reenvío de la misma. Solo se comparan imágenes del mismo
+    remitente, lo que reduce el riesgo de falsos positivos entre facturas
+    parecidas de distintos clientes.
+
+    Para medir la tasa de falsos positivos, una fracción `verify_rate` de las
+    coincidencias se procesa igualmente y el resultado se compara con el reutilizado.
+    """
+
+    def __init__(
+        self,
+        max_distance: int = 24,
+        max_entries_per_sender: int = 50,
+        max_senders: int = 10000,
+        ttl: Optional[float] = 30 * 24 * 3600,
+        verify_rate: float = 0.0
+    ):
+        self.max_distance = max_distance
+        self.max_entries_per_sender = max_entries_per_sender
+        self.ttl = ttl
+        self.verify_rate = verify_rate
+        self._senders = LRUTTLCache(max_size=max_senders, ttl=ttl)
+        self._lookups = 0
+        self._matches = 0
+        self._distances: Dict[int, int] = {}
+        self._verified = 0
+        self._false_positives = 0
+
+    def lookup(self, sender: Hashable, value: int) -> Optional[NearDuplicateMatch]:
+        """
+        Busca la imagen anterior más parecida del remitente.
+
+        Args:
+            sender: Remitente (número de teléfono)
+            value: dHash de la imagen
+
+        Returns:
+            Optional[NearDuplicateMatch]: Coincidencia más cercana dentro del umbral, o None
+        """
+        self._lookups += 1
+        index = self._senders.get(sender)
+        if index is None:
+            return None
+        entries, tree = index
+        now = time.time()
+        for distance, dhash, _ in tree.search(value, self.max_distance):
+            added_at, item = entries[dhash]
+            if self.ttl is not None and now - added_at >= self.ttl:
+                continue
+            self._matches += 1
+            self._distances[distance] = self._distances.get(distance, 0) + 1
+            return NearDuplicateMatch(value=item, distance=distance, dhash=dhash)
+        return None
+
+    def add(self, sender: Hashable, value: int, item: Any) -> None:
+        """
+        Registra una imagen procesada.
+
+        Args:
+            sender: Remitente (número de teléfono)
+            value: dHash de la imagen
+            item: Resultado a reutilizar (ej: la factura extraída)
+        """
+        index = self._senders.get(sender)
+        if index is None:
+            index = ({}, BKTree())
+        entries, tree = index
+        entries.pop(value, None)
+        entries[value] = (time.time(), item)
+        if len(entries) > self.max_entries_per_sender:
+            # Los diccionarios conservan el orden de inserción: se descartan las más antiguas.
+            # El árbol BK no admite borrados, así que se reconstruye (pocas entradas por remitente)
+            for dhash in list(entries)[:len(entries) - self.max_entries_per_sender]:
+                del entries[dhash]
+            tree = BKTree()
+            for dhash in entries:
+                tree.add(dhash, None)
+        else:
+            tree.add(value, None)
+        self._senders.set(sender, (entries, tree))
+
+    def should_verify(self) -> bool:
+        """Indica si una coincidencia debe procesarse igualmente para medir falsos positivos"""
+        return self.verify_rate > 0 and random.random() < self.verify_rate
+
+    def record_verification(self, same: bool) -> None:
+        """
+        Registra el resultado de verificar una coincidencia.
+
+        Args:
+            same: True si el procesamiento completo dio el mismo resultado que el reutilizado
+        """
+        self._verified += 1
+        if not same:
+            self._false_positives += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve búsquedas, coincidencias por distancia y tasa de falsos positivos medida"""
+        return {
+            "max_distance": self.max_distance,
+            "lookups": self._lookups,
+            "matches": self._matches,
+            "match_ratio": self._matches / self._lookups if self._lookups else 0.0,
+            "matches_by_distance": dict(sorted(self._distances.items())),
+            "verified": self._verified,
+            "false_positives": self._false_positives,
+            "false_positive_rate": self._false_positives / self._verified if self._verified else None,
+            "senders": len(self._senders),
+        }
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import pymongo.errors
+
+from models.invoice import Invoice
+from models.storage import StorageResult
+from providers.resilience import RetryPolicy
+from providers.stats import percentile
+from providers.storage.base import StorageProvider
+
+
+def is_transient_storage_error(error: BaseException) -> bool:
+    """
+    Indica si un error de almacenamiento es pasajero y tiene sentido reintentar.
+
+    Args:
+        error: Excepción del proveedor de almacenamiento
+
+    Returns:
+        bool: True para caídas de conexión, timeouts y escrituras marcadas como reintentables
+    """
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, pymongo.errors.PyMongoError):
+        return isinstance(error, pymongo.errors.ConnectionFailure) or error.has_error_label("RetryableWriteError")
+    return False
+
+
+class InvoicePersister:
+    """
+    Etapa determinista de guardado de facturas, sin pasar por un LLM.
+
+    Llama directamente a `StorageProvider.save_invoice` y devuelve un
+    StorageResult tipado, igual que la herramienta `store_invoice` del
+    storage_agent pero sin la llamada a GPT-4 que decide invocarla. Los errores
+    pasajeros (conexión, timeouts) se reintentan con backoff exponencial; los
+    guardados son upserts por número de factura, así que repetirlos es seguro.
+    """
+
+    def __init__(
+        self,
+        storage_provider: StorageProvider,
+        retry_policy: Optional[RetryPolicy] = None,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+        window: int = 1000
+    ):
+        """
+        Args:
+            storage_provider: Proveedor de almacenamiento
+            retry_policy: Intentos y backoff; por defecto 3 intentos desde 0.5 s
+            sleep: Función de espera (inyectable en pruebas)
+            window: Latencias recientes guardadas para los percentiles
+        """
+        self.storage_provider = storage_provider
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.sleep = sleep
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._saved = 0
+        self._failed = 0
+        self._retries = 0
+
+    async def persist(self, invoice: Invoice) -> StorageResult:
+        """
+        Guarda una factura reintentando los errores pasajeros.
+
+        Args:
+            invoice: Factura a guardar
+
+        Returns:
+            StorageResult: ID guardado o el motivo del fallo; nunca lanza excepciones del proveedor
+        """
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                invoice_id = await self.storage_provider.save_invoice(invoice)
+                break
+            except Exception as e:
+                if not is_transient_storage_error(e) or attempt >= self.retry_policy.max_attempts:
+                    self._failed += 1
+                    logging.error(f"InvoicePersister: no se pudo guardar la factura {invoice.invoice_number} tras {attempt} intentos: {str(e)}")
+                    return StorageResult(
+                        invoice_id="",
+                        success=False,
+                        message=f"Error al almacenar la factura: {str(e)}"
+                    )
+                delay = self.retry_policy.backoff(attempt)
+                self._retries += 1
+                logging.warning(f"InvoicePersister: {e.__class__.__name__} guardando {invoice.invoice_number} (intento {attempt}); reintento en {delay:.2f}s")
+                await self.sleep(delay)
+
+        self._saved += 1
+        self._latencies.append(time.perf_counter() - start)
+        return StorageResult(
+            invoice_id=invoice_id,
+            success=True,
+            message=f"Factura {invoice_id} almacenada correctamente"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve facturas guardadas, fallidas, reintentos y latencia p50/p95 del guardado"""
+        latencies = list(self._latencies)
+        return {
+            "saved": self._saved,
+            "failed": self._failed,
+            "retries": self._retries,
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+        }
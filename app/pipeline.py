@@ -0,0 +1,394 @@
+import asyncio
+import logging
+from dataclasses import replace
+
+from utils import send_whatsapp_message, get_image_from_whatsapp
+from agents.vision_agent import vision_agent
+from agents.validation import repair_invoice
+from app.dependencies import (
+    get_vision_provider,
+    get_storage_provider,
+    get_vision_deps,
+    get_storage_deps,
+    get_extractor_deps,
+    get_image_preprocessor,
+    get_message_deduplicator,
+    get_invoice_persister,
+    get_near_duplicate_index,
+    get_rule_extractor,
+    get_tiered_extractor,
+    get_vision_stream_metrics
+)
+from providers.resilience import CircuitOpenError, ProviderError
+from providers.vision.preprocessing import image_dhash
+from models.invoice import Invoice
+
+
+def message_ordering_key(payload: dict):
+    """Clave de ordenamiento de un trabajo: los mensajes de un mismo remitente se procesan en orden"""
+    return payload["message"].get("from")
+
+
+async def process_queued_message(payload: dict) -> None:
+    """
+    Procesa un mensaje persistido en la cola de trabajos.
+
+    Las dependencias se construyen en el worker porque no se pueden persistir
+    junto con el mensaje.
+
+    Args:
+        payload: Datos del trabajo con el mensaje de WhatsApp en la clave "message"
+    """
+    message = payload["message"]
+    message_id = message.get("id")
+
+    # Descartar reentregas antes de descargar la imagen o llamar a los modelos
+    deduplicator = get_message_deduplicator()
+    if not await deduplicator.claim(message_id):
+        logging.info(f"Mensaje duplicado descartado: {message_id}")
+        return
+
+    vision_deps = get_vision_deps(get_vision_provider())
+    storage_deps = get_storage_deps(get_storage_provider())
+    extractor_deps = get_extractor_deps()
+    try:
+        await handle_message(message, vision_deps, extractor_deps, storage_deps)
+    except BaseException:
+        # Permitir que el reintento de la cola (o el reinicio, si el trabajo se canceló)
+        # vuelva a procesar el mensaje; si el proceso muere aquí, lo libera el lease
+        await deduplicator.release(message_id)
+        raise
+    await deduplicator.complete(message_id)
+
+
+async def handle_message(message: dict, vision_deps, extractor_deps, storage_deps=None) -> None:
+    """
+    Procesa un mensaje individual de WhatsApp según su tipo.
+
+    Args:
+        message: Mensaje recibido en el webhook
+        vision_deps: Dependencias para el agente de visión
+        extractor_deps: Dependencias para el agente de extracción
+        storage_deps: Dependencias para almacenamiento
+    """
+    # Asegurar que el número esté en formato E.164
+    from_number = message.get("from")
+    if from_number and not from_number.startswith("+"):
+        from_number = "+" + from_number
+    logging.info(f"Número formateado: {from_number}")
+    message_type = message.get("type")
+
+    logging.info("Message details:")
+    logging.info(f"- From: {from_number}")
+    logging.info(f"- Type: {message_type}")
+    logging.info(f"- Timestamp: {message.get('timestamp')}")
+
+    # Procesar mensaje según su tipo
+    if message_type == 'image':
+        await process_image(message, from_number, vision_deps, extractor_deps, storage_deps)
+    elif message_type == 'text':
+        message_body = message.get('text', {}).get('body', '')
+        logging.info(f'- Body: {message_body}')
+        response_message = "Recibí tu mensaje. Por favor, envía una imagen de una factura para procesarla."
+        await send_whatsapp_message(from_number, response_message)
+    else:
+        logging.info(f'- Full message content: {message}')
+        await send_whatsapp_message(
+            from_number,
+            "❌ Tipo de mensaje no soportado. Por favor, envía una imagen de una factura."
+        )
+
+
+async def stream_invoice_text(image_data: bytes, vision_deps, on_progress=None) -> str:
+    """
+    Lee el texto de una factura en streaming directamente del proveedor de visión.
+
+    Cuando han llegado `vision_deps.stream_progress_chars` caracteres se lanza
+    `on_progress` en segundo plano, sin detener la lectura del resto del texto.
+
+    Args:
+        image_data: Datos binarios de la imagen
+        vision_deps: Dependencias para el agente de visión
+        on_progress: Corrutina opcional que recibe el texto parcial
+
+    Returns:
+        str: Texto completo extraído
+    """
+    stream = vision_deps.vision_provider.stream_image(
+        image_data=image_data,
+        model_name=vision_deps.model_name,
+        api_key=vision_deps.api_key
+    )
+    progress = None
+    async for _ in stream:
+        if (
+            progress is None
+            and on_progress is not None
+            and vision_deps.stream_progress_chars
+            and len(stream.text) >= vision_deps.stream_progress_chars
+        ):
+            progress = asyncio.create_task(on_progress(stream.text))
+    get_vision_stream_metrics().record(stream)
+    logging.info(
+        f"Texto recibido en streaming: primer fragmento en {stream.time_to_first_token or 0:.2f}s, "
+        f"total {stream.total_time:.2f}s"
+    )
+
+    if progress is not None:
+        try:
+            await progress
+        except Exception as e:
+            logging.error(f"Error enviando la notificación de progreso: {str(e)}")
+    if stream.details.get("error"):
+        raise Exception(stream.text)
+    return stream.text
+
+
+async def extract_invoice(image_data: bytes, vision_deps, extractor_deps, on_progress=None):
+    """
+    Extrae una factura de una imagen con el agente de visión y el de extracción.
+
+    Si el texto tiene un formato conocido y sus montos cuadran, la factura se
+    construye con las plantillas del extractor por reglas, sin llamar al agente
+    de extracción. El agente prueba primero los modelos baratos de
+    `EXTRACTION_MODEL_TIERS` y escala si la factura no pasa la validación local.
+
+    Con `vision_deps.streaming` el texto se lee en streaming directamente del
+    proveedor de visión en lugar de pasar por el agente de visión. Con
+    `vision_deps.pipeline_mode == "direct"` la imagen se convierte en la factura
+    en una sola llamada con salidas estructuradas, sin ninguno de los dos agentes.
+
+    Args:
+        image_data: Datos binarios de la imagen
+        vision_deps: Dependencias para el agente de visión
+        extractor_deps: Dependencias para el agente de extracción
+        on_progress: Corrutina opcional que recibe el texto parcial (solo en streaming)
+
+    Returns:
+        Invoice: Factura extraída
+    """
+    if vision_deps.pipeline_mode == "direct":
+        return await extract_invoice_direct(image_data, vision_deps)
+    if vision_deps.streaming:
+        extracted_text = await stream_invoice_text(image_data, vision_deps, on_progress)
+    else:
+        extracted_text = await run_vision_agent(image_data, vision_deps)
+    
+    # 2. Extraer datos estructurados: primero con las plantillas de formatos conocidos
+    rule_extractor = get_rule_extractor()
+    if rule_extractor is not None:
+        invoice = rule_extractor.extract(extracted_text)
+        if invoice is not None:
+            logging.info(f"Factura {invoice.invoice_number} extraída por plantilla, sin el agente de extracción")
+            return invoice
+    logging.info("Extrayendo datos estructurados")
+    invoice = await get_tiered_extractor().run(extracted_text, extractor_deps)
+    logging.info(f"Datos estructurados extraidos: {invoice}")
+    return invoice
+
+
+async def extract_invoice_direct(image_data: bytes, vision_deps) -> Invoice:
+    """
+    Extrae la factura de la imagen en una sola llamada al modelo de visión.
+
+    El modelo responde con salidas estructuradas ajustadas al esquema de
+    Invoice, así que no hacen falta el agente de visión ni el de extracción.
+
+    Args:
+        image_data: Datos binarios de la imagen
+        vision_deps: Dependencias para el agente de visión (usa `structured_provider`)
+
+    Returns:
+        Invoice: Factura extraída y validada
+    """
+    provider = vision_deps.structured_provider or vision_deps.vision_provider
+    logging.info(f"Extrayendo la factura en una sola llamada con {vision_deps.model_name}")
+    result = await provider.extract_structured(
+        image_data=image_data,
+        model_name=vision_deps.model_name,
+        api_key=vision_deps.api_key,
+        output_type=Invoice
+    )
+    invoice, repairs = repair_invoice(result["data"])
+    if repairs:
+        logging.info(f"Factura reparada localmente: {', '.join(repairs)}")
+    logging.info(f"Datos estructurados extraidos: {invoice}")
+    return invoice
+
+
+async def run_vision_agent(image_data: bytes, vision_deps) -> str:
+    """
+    Extrae el texto de una factura con el agente de visión.
+
+    Args:
+        image_data: Datos binarios de la imagen
+        vision_deps: Dependencias para el agente de visión
+
+    Returns:
+        str: Texto extraído
+    """
+    # 1. Procesar con Vision Agent
+    logging.info("Iniciando extracción de texto con Vision Agent")
+    
+    try:
+        # Agregar la imagen a las dependencias
+        logging.info(f"Tamaño de la imagen: {len(image_data)} bytes")
+        
+        # Verificar que vision_deps tenga los valores correctos antes de la llamada
+        logging.info(f"Vision provider: {vision_deps.vision_provider.__class__.__name__}")
+        logging.info(f"Model name: {vision_deps.model_name}")
+        logging.info(f"API key configurada: {bool(vision_deps.api_key)}")
+        
+        # Crear un objeto de dependencias con la imagen incluida, sin mutar
+        # las dependencias compartidas entre trabajos concurrentes
+        vision_deps = replace(vision_deps, image_data=image_data)
+        logging.info("Imagen agregada a las dependencias correctamente")
+        
+        # Llamar al vision_agent con un prompt simple, el agente usará la herramienta process_invoice_image
+        logging.info("Iniciando llamada a vision_agent.run()...")
+        vision_result = await vision_agent.run(
+            "Procesa esta imagen de factura y extrae todo su texto",
+            deps=vision_deps
+        )
+        
+        logging.info("Vision agent ejecutado correctamente")
+    except Exception as e:
+        logging.error(f"Error en vision_agent: {str(e)}")
+        raise
+    logging.info(f"Texto extraído: {len(vision_result.data.extracted_text)} caracteres")
+    return vision_result.data.extracted_text
+
+
+async def image_fingerprint(image_data: bytes):
+    """
+    Calcula el dHash de la imagen para detectar casi duplicados.
+
+    Con el preprocesamiento activo, la huella sale de la misma decodificación que
+    después reutiliza el proveedor de visión; sin él se decodifica solo para el hash.
+
+    Args:
+        image_data: Datos binarios de la imagen
+
+    Returns:
+        Optional[int]: dHash, o None si la imagen no se pudo decodificar
+    """
+    preprocessor = get_image_preprocessor()
+    if preprocessor is not None:
+        try:
+            return (await preprocessor.process(image_data)).dhash
+        except Exception as e:
+            logging.warning(f"No se pudo preprocesar la imagen para su huella: {str(e)}")
+            return None
+    return await asyncio.to_thread(image_dhash, image_data)
+
+
+async def process_image(message: dict, from_number: str, vision_deps, extractor_deps, storage_deps=None) -> dict:
+    """
+    Procesa una imagen de factura recibida por WhatsApp
+    
+    Args:
+        message: Mensaje recibido con la imagen
+        from_number: Número de teléfono del remitente
+        vision_deps: Dependencias para el agente de visión
+        extractor_deps: Dependencias para el agente de extracción
+        storage_deps: Dependencias para almacenamiento; sin ellas la factura no se guarda
+        
+    Returns:
+        dict: Resultado de la operación
+
+    Raises:
+        ProviderError: Si el proveedor falló de forma pasajera (o su circuito está
+            abierto), tras avisar al usuario, para que la cola reintente el trabajo
+    """
+    try:
+        # Notificar al usuario que estamos procesando
+        await send_whatsapp_message(
+            from_number,
+            "Procesando tu imagen... Esto puede tomar unos segundos."
+        )
+        
+        # 1. Obtener la imagen
+        logging.info(f"Obteniendo imagen de WhatsApp de: {from_number}")
+        image_data = await get_image_from_whatsapp(message)
+        logging.info(f"Imagen recibida: {len(image_data)} bytes")
+        
+        # 2. Reutilizar la extracción si el remitente ya envió esta factura (otra foto o un reenvío)
+        near_duplicates = get_near_duplicate_index()
+        fingerprint = await image_fingerprint(image_data) if near_duplicates else None
+        match = near_duplicates.lookup(from_number, fingerprint) if fingerprint is not None else None
+        
+        reused = match is not None and not near_duplicates.should_verify()
+        if reused:
+            invoice = match.value
+            logging.info(f"Imagen casi duplicada (distancia {match.distance}); se reutiliza la factura {invoice.invoice_number}")
+        else:
+            # 3. Extraer la factura con los agentes de visión y extracción
+            invoice = await extract_invoice(
+                image_data,
+                vision_deps,
+                extractor_deps,
+                on_progress=lambda text: send_whatsapp_message(
+                    from_number,
+                    "Factura leída, extrayendo los datos..."
+                )
+            )
+            if match is not None:
+                # Coincidencia verificada: cuenta como falso positivo si es otra factura
+                near_duplicates.record_verification(
+                    invoice.invoice_number == match.value.invoice_number
+                    and invoice.total_amount == match.value.total_amount
+                )
+            # 4. Guardar la factura directamente en el proveedor, sin un LLM de por medio
+            if storage_deps is not None:
+                stored = await get_invoice_persister().persist(invoice)
+                if not stored.success:
+                    await send_whatsapp_message(
+                        from_number,
+                        "✗ La factura se leyó pero no se pudo guardar. Por favor, intenta de nuevo en unos minutos."
+                    )
+                    return {"status": "error", "message": stored.message}
+            if fingerprint is not None:
+                near_duplicates.add(from_number, fingerprint, invoice)
+        
+        # 5. Preparar respuesta
+        response_message = (
+            "✓ Factura procesada correctamente\n" +
+            f"- Número: {invoice.invoice_number}\n" +
+            f"- Total: {invoice.total_amount} {invoice.currency}\n" +
+            f"- Vendedor: {invoice.vendor_name}"
+        )
+        
+        # 6. Enviar respuesta a WhatsApp
+        logging.info(f"Enviando resultado al usuario: {from_number}")
+        await send_whatsapp_message(from_number, response_message)
+        
+        return {
+            "status": "success",
+            "reused": reused,
+            "extracted_data": {
+                "invoice_number": invoice.invoice_number,
+                "total_amount": invoice.total_amount,
+                "currency": invoice.currency,
+                "vendor_name": invoice.vendor_name
+            }
+        }
+        
+    except Exception as e:
+        error_msg = f"Error al procesar la imagen: {str(e)}"
+        logging.error(error_msg)
+        
+        # Notificar al usuario del error; si el proveedor está caído, no es culpa de la imagen
+        transient = isinstance(e, ProviderError) and (e.retryable or isinstance(e, CircuitOpenError))
+        if transient:
+            user_message = "✗ El servicio de lectura de facturas no está disponible en este momento. Por favor, intenta de nuevo en unos minutos."
+        else:
+            user_message = "✗ Error al procesar la imagen. Por favor, asegúrate de enviar una imagen clara de una factura."
+        await send_whatsapp_message(from_number, user_message)
+        if transient:
+            # Propagar para que la cola de trabajos libere el mensaje y lo reintente con backoff
+            raise
+        
+        return {
+            "status": "error",
+            "message": str(e)
+        }
@@ -0,0 +1,252 @@
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+
+from agents.validation import amounts_are_consistent
+from models.invoice import Invoice, InvoiceItem
+
+FLAGS = re.IGNORECASE | re.MULTILINE
+
+
+def parse_amount(text: str) -> Optional[float]:
+    """
+    Convierte un monto impreso en un recibo a float.
+
+    Admite punto o coma como separador de miles o de decimales. Si el último
+    separador va seguido de exactamente tres dígitos es de miles, como en los
+    recibos colombianos ("119.000" o "1.234.567,89").
+
+    Args:
+        text: Monto tal como aparece en el texto, con o sin símbolo de moneda
+
+    Returns:
+        Optional[float]: Monto, o None si no contiene un número
+    """
+    digits = re.sub(r"[^\d.,]", "", text or "")
+    if not re.search(r"\d", digits):
+        return None
+    last = max(digits.rfind("."), digits.rfind(","))
+    if last == -1:
+        return float(digits)
+    decimals = digits[last + 1:]
+    if len(decimals) == 3:
+        # Separador de miles: "119.000", "1,234,567"
+        return float(re.sub(r"[.,]", "", digits))
+    integer = re.sub(r"[.,]", "", digits[:last])
+    return float(f"{integer or 0}.{decimals or 0}")
+
+
+@dataclass
+class InvoiceTemplate:
+    """
+    Plantilla de expresiones regulares para un formato fijo de factura.
+
+    Cada campo es una expresión con un grupo de captura, salvo `item`, que usa
+    grupos con nombre (`description`, `total` y opcionalmente `quantity` y
+    `unit_price`) y se aplica a cada línea. La plantilla solo se prueba si
+    todas las expresiones de `detect` aparecen en el texto.
+    """
+    name: str
+    detect: Tuple[str, ...]
+    invoice_number: str
+    date: str
+    total: str
+    item: str
+    tax: Optional[str] = None
+    vendor_tax_id: Optional[str] = None
+    # Sin expresión, el vendedor es la primera línea no vacía del texto
+    vendor_name: Optional[str] = None
+    currency: str = "USD"
+    date_formats: Tuple[str, ...] = ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d/%m/%y")
+    _compiled: Dict[str, Any] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.detect = tuple(self.detect)
+        self.date_formats = tuple(self.date_formats)
+        self._compiled = {
+            "detect": [re.compile(pattern, FLAGS) for pattern in self.detect],
+            **{
+                name: re.compile(getattr(self, name), FLAGS)
+                for name in ("invoice_number", "date", "total", "item", "tax", "vendor_tax_id", "vendor_name")
+                if getattr(self, name)
+            },
+        }
+
+    def matches(self, text: str) -> bool:
+        """Indica si el texto tiene el formato de la plantilla"""
+        return all(pattern.search(text) for pattern in self._compiled["detect"])
+
+    def _search(self, name: str, text: str) -> Optional[str]:
+        pattern = self._compiled.get(name)
+        found = pattern.search(text) if pattern is not None else None
+        return found.group(1).strip() if found else None
+
+    def _date(self, text: str) -> Optional[datetime]:
+        value = self._search("date", text)
+        for date_format in self.date_formats:
+            try:
+                return datetime.strptime(value, date_format)
+            except (TypeError, ValueError):
+                continue
+        return None
+
+    def _items(self, text: str) -> List[InvoiceItem]:
+        items = []
+        for found in self._compiled["item"].finditer(text):
+            groups = found.groupdict()
+            total = parse_amount(groups["total"])
+            quantity = parse_amount(groups.get("quantity") or "1")
+            unit_price = parse_amount(groups.get("unit_price") or "") or (total / quantity if total and quantity else None)
+            items.append(InvoiceItem(
+                description=groups["description"].strip(),
+                quantity=quantity,
+                unit_price=unit_price,
+                total=total
+            ))
+        return items
+
+    def parse(self, text: str) -> Invoice:
+        """
+        Construye la factura a partir del texto.
+
+        Args:
+            text: Texto extraído de la imagen
+
+        Returns:
+            Invoice: Factura con los campos de la plantilla
+
+        Raises:
+            ValueError: Si falta un campo obligatorio o la factura no es válida
+        """
+        vendor_name = self._search("vendor_name", text) if self.vendor_name else next(
+            (line.strip() for line in text.splitlines() if line.strip()), None
+        )
+        fields = {
+            "invoice_number": self._search("invoice_number", text),
+            "date": self._date(text),
+            "vendor_name": vendor_name,
+            "total_amount": parse_amount(self._search("total", text) or ""),
+        }
+        missing = [name for name, value in fields.items() if value is None]
+        if missing:
+            raise ValueError(f"Campos no encontrados: {', '.join(missing)}")
+        try:
+            return Invoice(
+                **fields,
+                vendor_tax_id=self._search("vendor_tax_id", text),
+                tax_amount=parse_amount(self._search("tax", text) or "") or 0.0,
+                items=self._items(text),
+                currency=self.currency
+            )
+        except ValidationError as e:
+            raise ValueError(str(e)) from e
+
+
+# Recibos colombianos: NIT del vendedor, IVA y total en pesos ("$ 119.000")
+COLOMBIAN_RECEIPT = InvoiceTemplate(
+    name="co_nit_iva",
+    detect=(r"\bNIT\b", r"^\s*IVA\b", r"^\s*TOTAL\b"),
+    invoice_number=r"(?:FACTURA(?:\s+(?:DE\s+VENTA|ELECTR[OÓ]NICA))?|TIQUETE|RECIBO)\s*(?:N[Ooº°]\.?|#|NUM(?:ERO)?\.?)\s*:?\s*([A-Z0-9][A-Z0-9-]*)",
+    date=r"FECHA(?:\s+DE\s+EXPEDICI[OÓ]N)?\s*:?\s*(\d{1,4}[/-]\d{1,2}[/-]\d{2,4})",
+    total=r"^\s*TOTAL(?:\s+A\s+PAGAR)?\s*:?\s*(\$?\s*[\d.,]+)\s*$",
+    tax=r"^\s*IVA(?:\s*\(?\d+(?:[.,]\d+)?\s*%\)?)?\s*:?\s*(\$?\s*[\d.,]+)\s*$",
+    vendor_tax_id=r"\bNIT\.?\s*:?\s*(\d[\d.]*-?\d?)",
+    item=(
+        r"^(?!\s*(?:SUB\s*TOTAL|TOTAL|IVA|NIT|FECHA|FACTURA|CAMBIO|EFECTIVO))"
+        r"(?P<description>[^\d\s][^\n]*?)\s+(?P<quantity>\d+(?:[.,]\d+)?)\s*[xX*]?\s*"
+        r"\$?\s*(?P<unit_price>\d[\d.,]*)\s+\$?\s*(?P<total>\d[\d.,]*)\s*$"
+    ),
+    currency="COP",
+)
+
+DEFAULT_TEMPLATES: Tuple[InvoiceTemplate, ...] = (COLOMBIAN_RECEIPT,)
+
+
+def load_templates(path: str) -> List[InvoiceTemplate]:
+    """
+    Carga plantillas desde un archivo JSON con una lista de objetos.
+
+    Cada objeto tiene los campos de InvoiceTemplate, por ejemplo
+    {"name": "...", "detect": ["..."], "invoice_number": "...", ...}.
+
+    Args:
+        path: Ruta del archivo JSON
+
+    Returns:
+        List[InvoiceTemplate]: Plantillas en el orden del archivo
+    """
+    with open(path, encoding="utf-8") as templates_file:
+        return [InvoiceTemplate(**entry) for entry in json.load(templates_file)]
+
+
+class RuleBasedExtractor:
+    """
+    Extractor de facturas por plantillas, previo al agente de extracción.
+
+    Prueba las plantillas cuyo formato coincide con el texto y acepta la
+    primera factura cuyos montos cuadran (ítems + IVA = total). Si ninguna
+    plantilla encaja o la validación falla, devuelve None y el texto pasa al
+    agente de extracción.
+    """
+
+    def __init__(self, templates: Sequence[InvoiceTemplate] = DEFAULT_TEMPLATES):
+        """
+        Args:
+            templates: Plantillas en orden de prioridad
+        """
+        self.templates = list(templates)
+        self._texts = 0
+        self._hits = 0
+        self._template_stats = {
+            template.name: {"matched": 0, "hits": 0, "incomplete": 0, "inconsistent": 0}
+            for template in self.templates
+        }
+
+    def extract(self, text: str) -> Optional[Invoice]:
+        """
+        Extrae la factura con la primera plantilla que produce montos consistentes.
+
+        Args:
+            text: Texto extraído de la imagen
+
+        Returns:
+            Optional[Invoice]: Factura validada, o None si hay que usar el agente de extracción
+        """
+        self._texts += 1
+        for template in self.templates:
+            if not template.matches(text):
+                continue
+            counters = self._template_stats[template.name]
+            counters["matched"] += 1
+            try:
+                invoice = template.parse(text)
+            except ValueError as e:
+                counters["incomplete"] += 1
+                logging.info(f"Plantilla {template.name}: {str(e)[:200]}")
+                continue
+            if not amounts_are_consistent(invoice.items, invoice.total_amount, invoice.tax_amount):
+                counters["inconsistent"] += 1
+                logging.info(f"Plantilla {template.name}: los montos de {invoice.invoice_number} no cuadran")
+                continue
+            counters["hits"] += 1
+            self._hits += 1
+            return invoice
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve textos procesados, aciertos y, por plantilla, coincidencias, aciertos y motivos de descarte"""
+        return {
+            "texts": self._texts,
+            "hits": self._hits,
+            "fallbacks": self._texts - self._hits,
+            "hit_ratio": self._hits / self._texts if self._texts else 0.0,
+            "templates": {
+                name: {**counters, "hit_rate": counters["hits"] / counters["matched"] if counters["matched"] else None}
+                for name, counters in self._template_stats.items()
+            },
+        }
@@ -0,0 +1,81 @@
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable
+
+from models.webhook import Status, WebhookPayload
+
+# Tipos de payload según su contenido
+MESSAGES = "messages"
+STATUSES = "statuses"
+UNKNOWN = "unknown"
+
+# Se buscan las claves JSON, no los valores: todos los cambios llevan "field": "messages",
+# y las comillas dentro de textos de usuario llegan escapadas
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+_STATUSES_KEY = re.compile(rb'"statuses"\s*:')
+
+
+def classify_payload(body: bytes) -> str:
+    """
+    Clasifica un payload del webhook sin parsearlo.
+
+    Args:
+        body: Cuerpo crudo de la solicitud
+
+    Returns:
+        str: STATUSES si solo contiene notificaciones de estado, MESSAGES si contiene
+        mensajes de usuario, UNKNOWN en cualquier otro caso
+    """
+    if _MESSAGES_KEY.search(body):
+        return MESSAGES
+    if _STATUSES_KEY.search(body):
+        return STATUSES
+    return UNKNOWN
+
+
+class DeliveryMetrics:
+    """Agrega las notificaciones de estado (sent, delivered, read, failed) en contadores"""
+
+    def __init__(self):
+        self._by_status: Counter = Counter()
+        self._errors_by_code: Counter = Counter()
+        self._payloads = 0
+        self._last_event_at: float = 0.0
+
+    def record(self, statuses: Iterable[Status]) -> None:
+        """
+        Registra las notificaciones de estado de un payload.
+
+        Args:
+            statuses: Notificaciones de estado recibidas
+        """
+        self._payloads += 1
+        for status in statuses:
+            self._by_status[status.status or "unknown"] += 1
+            for error in status.errors:
+                self._errors_by_code[str(error.code)] += 1
+        self._last_event_at = time.time()
+
+    def record_payload(self, body: bytes) -> None:
+        """
+        Parsea un payload de solo estados y registra sus notificaciones.
+
+        Args:
+            body: Cuerpo crudo de la solicitud
+
+        Raises:
+            pydantic.ValidationError: Si el cuerpo no es un payload válido
+        """
+        self.record(WebhookPayload.model_validate_json(body).iter_statuses())
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve los contadores de entrega"""
+        sent = self._by_status.get("sent", 0)
+        return {
+            "payloads": self._payloads,
+            "by_status": dict(self._by_status),
+            "errors_by_code": dict(self._errors_by_code),
+            "read_ratio": self._by_status.get("read", 0) / sent if sent else 0.0,
+            "last_event_at": self._last_event_at or None,
+        }
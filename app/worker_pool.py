@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class QueueFullError(Exception):
+    """Se lanza cuando la cola de trabajos alcanzó su capacidad máxima"""
+
+
+@dataclass
+class Job:
+    """
+    Unidad de trabajo que se ejecuta en el pool de workers.
+
+    Los trabajos con la misma `key` se ejecutan de uno en uno y en el orden
+    en que se encolaron (ej: mensajes de un mismo remitente).
+    """
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    args: tuple = ()
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    key: Optional[str] = None
+
+
+class WorkerPool:
+    """Pool de workers asyncio que consume trabajos de una cola acotada"""
+
+    def __init__(self, concurrency: int = 4, max_queue_size: int = 1000, name: str = "jobs"):
+        if concurrency < 1:
+            raise ValueError("La concurrencia debe ser al menos 1")
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._accepting = False
+        # Claves con un trabajo encolado o en ejecución y trabajos en espera por clave
+        self._active_keys: set = set()
+        self._key_backlog: Dict[str, deque] = {}
+        self._backlog_size = 0
+        self._active = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    @property
+    def running(self) -> bool:
+        """Indica si el pool está aceptando trabajos"""
+        return self._accepting
+
+    @property
+    def idle_capacity(self) -> int:
+        """Número de trabajos que pueden empezar de inmediato sin esperar en la cola"""
+        if not self._accepting:
+            return 0
+        queued = self._queue.qsize()
+        free_workers = self.concurrency - self._active - queued
+        free_slots = self.max_queue_size - queued - self._backlog_size
+        return max(min(free_workers, free_slots), 0)
+
+    async def start(self) -> None:
+        """Inicia los workers. Debe llamarse dentro del event loop de la aplicación"""
+        if self._workers:
+            return
+        # El límite de la cola se aplica en submit() contando también los trabajos en espera por clave
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"{self.name}-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        self._accepting = True
+        logging.info(f"WorkerPool [{self.name}]: {self.concurrency} workers iniciados")
+
+    def submit(self, job: Job) -> None:
+        """
+        Encola un trabajo sin bloquear.
+
+        Args:
+            job: Trabajo a ejecutar
+
+        Raises:
+            RuntimeError: Si el pool no está en ejecución
+            QueueFullError: Si la cola alcanzó su capacidad máxima
+        """
+        if not self._accepting:
+            raise RuntimeError(f"WorkerPool [{self.name}] no está aceptando trabajos")
+        if self._queue.qsize() + self._backlog_size >= self.max_queue_size:
+            self._rejected += 1
+            raise QueueFullError(
+                f"Cola de trabajos llena ({self.max_queue_size} trabajos pendientes)"
+            )
+
+        if job.key is not None:
+            if job.key in self._active_keys:
+                # Esperar a que termine el trabajo anterior con la misma clave
+                self._key_backlog.setdefault(job.key, deque()).append(job)
+                self._backlog_size += 1
+                return
+            self._active_keys.add(job.key)
+        self._queue.put_nowait(job)
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Deja de aceptar trabajos y espera a que la cola se vacíe.
+
+        Args:
+            timeout: Segundos máximos de espera antes de cancelar los workers
+
+        Returns:
+            bool: True si todos los trabajos pendientes terminaron a tiempo
+        """
+        self._accepting = False
+        if not self._workers:
+            return True
+
+        drained = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            drained = False
+            logging.warning(
+                f"WorkerPool [{self.name}]: timeout al drenar, "
+                f"{self._queue.qsize() + self._backlog_size} trabajos pendientes descartados"
+            )
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logging.info(f"WorkerPool [{self.name}]: detenido")
+        return drained
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve métricas del pool"""
+        return {
+            "running": self._accepting,
+            "concurrency": self.concurrency,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "backlogged": self._backlog_size,
+            "active": self._active,
+            "processed": self._processed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+        }
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            self._active += 1
+            try:
+                await job.func(*job.args, **job.kwargs)
+                self._processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                logging.error(f"WorkerPool [{self.name}]: error en trabajo {job.name}: {str(e)}")
+            finally:
+                self._active -= 1
+                # Liberar la clave antes de task_done() para que drain() no termine antes de tiempo
+                self._release_key(job.key)
+                self._queue.task_done()
+
+    def _release_key(self, key: Optional[str]) -> None:
+        if key is None:
+            return
+        backlog = self._key_backlog.get(key)
+        if backlog:
+            next_job = backlog.popleft()
+            self._backlog_size -= 1
+            if not backlog:
+                del self._key_backlog[key]
+            self._queue.put_nowait(next_job)
+        else:
+            self._active_keys.discard(key)
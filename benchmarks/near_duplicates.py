@@ -0,0 +1,105 @@
+"""
+Calibración del umbral de Hamming para detectar facturas casi duplicadas.
+
+Genera facturas sintéticas con la misma plantilla (encabezado, tabla de ítems y
+totales con contenidos distintos) y versiones alteradas de cada una como las que
+produce WhatsApp o una segunda foto: reducción, recompresión fuerte, recorte
+leve, cambio de brillo y una pequeña rotación. Para cada umbral muestra:
+
+- detección: fracción de versiones alteradas reconocidas como la misma factura
+- falsos positivos: fracción de pares de facturas distintas tomadas como iguales
+- misma plantilla: lo mismo para recibos de un mismo vendedor, con la misma
+  disposición y solo el número y los montos distintos. Es el caso real de
+  riesgo y el motivo de que NEAR_DUPLICATE_DETECTION esté desactivado por defecto
+
+Uso:
+    python -m benchmarks.near_duplicates [--invoices 150] [--seed 1]
+"""
+import argparse
+import io
+import itertools
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+from providers.vision.preprocessing import DHASH_SIZE, hamming_distance, image_dhash
+
+
+def _invoice(rng: random.Random) -> Image.Image:
+    """Factura sintética: misma plantilla, contenido aleatorio"""
+    image = Image.new("L", (1200, 1600), 250)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((80, 80, rng.randint(500, 900), 160), fill=20)
+    for line in range(rng.randint(4, 16)):
+        top = 300 + line * 70
+        draw.rectangle((80, top, rng.randint(250, 700), top + 30), fill=40)
+        draw.rectangle((900, top, rng.randint(960, 1120), top + 30), fill=40)
+    draw.rectangle((700, 1400, rng.randint(900, 1120), 1460), fill=10)
+    return image
+
+
+def _same_layout_receipt(rng: random.Random) -> Image.Image:
+    """Recibo de un mismo vendedor: texto fijo, solo cambian el número y los montos"""
+    image = Image.new("L", (600, 1200), 255)
+    draw = ImageDraw.Draw(image)
+    draw.text((40, 40), "SUPERMERCADO LA ECONOMIA S.A.S.", fill=0)
+    draw.text((40, 70), "NIT: 900.123.456-7", fill=0)
+    draw.text((40, 100), f"FACTURA No. FE-{rng.randint(10000, 99999)}", fill=0)
+    amounts = [rng.randint(1000, 99999) for _ in range(rng.randint(3, 8))]
+    for line, amount in enumerate(amounts):
+        draw.text((40, 180 + line * 40), f"Producto {rng.randint(1, 99):02d}", fill=0)
+        draw.text((420, 180 + line * 40), f"{amount:>8}", fill=0)
+    draw.text((40, 900), "TOTAL", fill=0)
+    draw.text((420, 900), f"{sum(amounts):>8}", fill=0)
+    return image
+
+
+def _variants(image: Image.Image, rng: random.Random):
+    """Versiones alteradas de la misma factura"""
+    width, height = image.size
+    yield image.resize((width * 3 // 4, height * 3 // 4)), 40
+    yield image.crop((rng.randint(0, 30), rng.randint(0, 30), width - rng.randint(0, 30), height - rng.randint(0, 30))), 80
+    yield ImageEnhance.Brightness(image).enhance(rng.uniform(0.8, 1.2)), 80
+    yield image.rotate(rng.uniform(-2, 2), fillcolor=250, resample=Image.BICUBIC), 80
+
+
+def _encode(image: Image.Image, quality: int) -> bytes:
+    output = io.BytesIO()
+    image.convert("RGB").save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=150, help="Facturas distintas a generar")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    originals, duplicates = [], []
+    for _ in range(args.invoices):
+        image = _invoice(rng)
+        original = image_dhash(_encode(image, 90))
+        originals.append(original)
+        for variant, quality in _variants(image, rng):
+            duplicates.append(hamming_distance(original, image_dhash(_encode(variant, quality))))
+
+    distinct = [hamming_distance(a, b) for a, b in itertools.combinations(originals, 2)]
+    receipts = [image_dhash(_encode(_same_layout_receipt(rng), 90)) for _ in range(args.invoices)]
+    same_layout = [hamming_distance(a, b) for a, b in itertools.combinations(receipts, 2)]
+    print(f"{args.invoices} facturas, {len(duplicates)} versiones alteradas, {len(distinct)} pares distintos")
+    print(f"{'umbral':>6} {'detección':>10} {'falsos positivos':>17} {'misma plantilla':>16}")
+    bits = DHASH_SIZE * DHASH_SIZE
+    for threshold in range(0, bits // 4 + 1, bits // 64):
+        recall = sum(d <= threshold for d in duplicates) / len(duplicates)
+        false_positives = sum(d <= threshold for d in distinct) / len(distinct)
+        same_layout_matches = sum(d <= threshold for d in same_layout) / len(same_layout)
+        print(f"{threshold:>6} {recall:>10.1%} {false_positives:>17.3%} {same_layout_matches:>16.3%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Comparación de los modos del pipeline de extracción de facturas.
+
+- agents: agente de visión (GPT-4o) -> herramienta process_invoice_image
+  (GPT-4o vía OpenAIVisionProvider) -> agente de extracción (GPT-4): al menos
+  tres llamadas al modelo por factura
+- direct: la imagen va una sola vez a GPT-4o y vuelve como Invoice validado
+  con salidas estructuradas
+
+Para cada modo mide la latencia por factura (p50/p95), las llamadas al modelo
+y los tokens por factura, y la exactitud por campo frente a las respuestas
+esperadas. Los tokens y las llamadas se cuentan con el limitador RPM/TPM, que
+concilia el uso real de cada llamada de los dos caminos.
+
+Hace llamadas reales a OpenAI: necesita el .env de la aplicación
+(OPENAI_API_KEY). Cada imagen del directorio de muestras (jpg, jpeg o png)
+se acompaña de un JSON con el mismo nombre y los campos esperados de Invoice.
+La caché de visión no se usa, para medir siempre llamadas reales.
+
+Uso:
+    python -m benchmarks.pipeline_modes --samples muestras/ [--runs 1] [--modes agents,direct]
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.dependencies import get_image_preprocessor, get_structured_vision_provider
+from app.pipeline import extract_invoice
+from models.dependencies import ExtractorAgentDependencies, VisionAgentDependencies
+from providers.rate_limit import RateLimitRegistry, set_rate_limits
+from providers.stats import percentile
+from providers.vision.openai_provider import OpenAIVisionProvider
+
+FIELDS = ("invoice_number", "date", "vendor_name", "total_amount", "tax_amount", "currency", "items")
+
+
+def _normalize(value) -> str:
+    return re.sub(r"\W+", "", str(value or "")).lower()
+
+
+def score(invoice, expected: dict) -> dict:
+    """Aciertos por campo de una factura extraída frente a la esperada"""
+    hits = {}
+    for field in FIELDS:
+        if field not in expected:
+            continue
+        actual = getattr(invoice, field)
+        if field == "date":
+            hits[field] = actual.date() == datetime.fromisoformat(expected[field]).date()
+        elif field in ("total_amount", "tax_amount"):
+            hits[field] = abs((actual or 0) - (expected[field] or 0)) <= 0.01
+        elif field == "items":
+            hits[field] = len(actual) == len(expected[field])
+        else:
+            hits[field] = _normalize(actual) == _normalize(expected[field])
+    return hits
+
+
+def _samples(directory: Path):
+    for image in sorted(directory.iterdir()):
+        if image.suffix.lower() in (".jpg", ".jpeg", ".png") and image.with_suffix(".json").exists():
+            yield image.name, image.read_bytes(), json.loads(image.with_suffix(".json").read_text())
+
+
+async def run_mode(mode: str, samples: list, runs: int) -> dict:
+    """Procesa todas las muestras con un modo y agrega latencia, uso y exactitud"""
+    # Límites altos: el registro solo se usa para contar llamadas y tokens reales
+    registry = RateLimitRegistry(requests_per_minute=100000, tokens_per_minute=100000000)
+    set_rate_limits(registry)
+    vision_deps = VisionAgentDependencies(
+        vision_provider=OpenAIVisionProvider(preprocessor=get_image_preprocessor()),
+        model_name=settings.VISION_MODEL,
+        api_key=settings.OPENAI_API_KEY,
+        pipeline_mode=mode,
+        structured_provider=get_structured_vision_provider()
+    )
+    extractor_deps = ExtractorAgentDependencies(model_name=settings.EXTRACTION_MODEL)
+
+    latencies, hits, errors = [], [], 0
+    try:
+        for _ in range(runs):
+            for name, image_data, expected in samples:
+                start = time.perf_counter()
+                try:
+                    invoice = await extract_invoice(image_data, vision_deps, extractor_deps)
+                except Exception as e:
+                    errors += 1
+                    print(f"  [{mode}] {name}: error {e.__class__.__name__}: {str(e)[:120]}")
+                    continue
+                latencies.append(time.perf_counter() - start)
+                hits.extend(score(invoice, expected).values())
+    finally:
+        set_rate_limits(None)
+
+    models = registry.stats()["models"]
+    invoices = runs * len(samples)
+    return {
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+        "calls": sum(model["acquired"] for model in models.values()) / invoices,
+        "tokens": sum(model["actual_tokens"] for model in models.values()) / invoices,
+        "accuracy": sum(hits) / len(hits) if hits else None,
+        "errors": errors,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=Path, required=True, help="Directorio con imágenes y sus JSON esperados")
+    parser.add_argument("--runs", type=int, default=1, help="Repeticiones de cada muestra")
+    parser.add_argument("--modes", default="agents,direct")
+    args = parser.parse_args()
+
+    samples = list(_samples(args.samples))
+    if not samples:
+        parser.error(f"No hay imágenes con su JSON esperado en {args.samples}")
+    print(f"{len(samples)} facturas x {args.runs} repeticiones")
+    print(f"{'modo':>7} {'p50 (s)':>8} {'p95 (s)':>8} {'llamadas':>9} {'tokens':>8} {'exactitud':>10} {'errores':>8}")
+    for mode in args.modes.split(","):
+        result = await run_mode(mode.strip(), samples, args.runs)
+        print(
+            f"{mode:>7} {result['latency_p50'] or 0:>8.2f} {result['latency_p95'] or 0:>8.2f} "
+            f"{result['calls']:>9.1f} {result['tokens']:>8.0f} "
+            f"{(result['accuracy'] or 0):>10.1%} {result['errors']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
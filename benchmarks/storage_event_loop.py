@@ -0,0 +1,166 @@
+"""
+Benchmark del bloqueo del event loop por el proveedor de almacenamiento.
+
+Lanza N guardados de facturas concurrentes mientras una tarea "latido" mide
+cuánto se retrasa el event loop respecto a su intervalo. Compara:
+
+- bloqueante: pymongo llamado directamente desde corrutinas (comportamiento anterior)
+- pymongo+hilos: MongoDBProvider, cada operación en asyncio.to_thread
+- motor: MotorMongoDBProvider, driver asíncrono nativo
+
+Con --connection-string se usa un servidor real. Sin él se usa mongomock con una
+latencia de red simulada por operación (time.sleep en los caminos síncronos,
+asyncio.sleep en motor), que es lo que determina el bloqueo.
+
+Uso:
+    python -m benchmarks.storage_event_loop [--operations 200] [--latency-ms 5]
+    python -m benchmarks.storage_event_loop --connection-string mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.invoice import Invoice, InvoiceItem
+from providers.storage.mongodb_provider import MongoDBProvider
+
+
+class _SlowCollection:
+    """Colección de mongomock con latencia simulada en cada operación"""
+
+    def __init__(self, collection, latency: float, asynchronous: bool):
+        self._collection = collection
+        self._latency = latency
+        self._asynchronous = asynchronous
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in ("insert_one", "replace_one", "bulk_write", "find_one", "delete_one"):
+            return attr
+        if self._asynchronous:
+            async def slow_async(*args, **kwargs):
+                await asyncio.sleep(self._latency)
+                return await attr(*args, **kwargs)
+            return slow_async
+
+        def slow(*args, **kwargs):
+            time.sleep(self._latency)
+            return attr(*args, **kwargs)
+        return slow
+
+
+class _BlockingProvider(MongoDBProvider):
+    """Reproduce el proveedor anterior: pymongo llamado dentro de la corrutina"""
+
+    async def save_invoice(self, invoice: Invoice) -> str:
+        invoice_dict = invoice.model_dump()
+        invoice_dict["_id"] = invoice.invoice_number
+        self._save_document(invoice_dict)
+        return invoice.invoice_number
+
+
+def _invoice(index: int) -> Invoice:
+    return Invoice(
+        invoice_number=f"BENCH-{index:06d}",
+        date=datetime(2024, 2, 17),
+        vendor_name="Proveedor de prueba",
+        total_amount=119.0,
+        tax_amount=19.0,
+        items=[InvoiceItem(description="Servicio", quantity=1, unit_price=100.0, total=100.0)],
+    )
+
+
+def _build_provider(mode: str, connection_string: str, latency: float):
+    """Crea el proveedor del modo indicado, real o sobre mongomock con latencia simulada"""
+    database_name = f"bench_{mode.replace('+', '_')}_{os.getpid()}"
+    if mode == "motor":
+        from providers.storage import motor_provider
+        client_class = motor_provider.AsyncIOMotorClient
+        if not connection_string:
+            import mongomock_motor
+            client_class = mongomock_motor.AsyncMongoMockClient
+        with patch.object(motor_provider, "AsyncIOMotorClient", client_class):
+            provider = motor_provider.MotorMongoDBProvider(connection_string or "mongodb://bench", database_name)
+    else:
+        from providers.storage import mongodb_provider
+        client_class = mongodb_provider.MongoClient
+        if not connection_string:
+            import mongomock
+            client_class = mongomock.MongoClient
+        provider_class = _BlockingProvider if mode == "bloqueante" else MongoDBProvider
+        with patch.object(mongodb_provider, "MongoClient", client_class):
+            provider = provider_class(connection_string or "mongodb://bench", database_name)
+
+    if not connection_string:
+        provider._collection = _SlowCollection(provider._collection, latency, asynchronous=mode == "motor")
+    return provider
+
+
+async def _measure(provider, operations: int, interval: float = 0.001) -> dict:
+    """Ejecuta los guardados concurrentes midiendo el retraso del event loop"""
+    lags = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    ticker = asyncio.create_task(heartbeat())
+    await asyncio.sleep(interval * 5)
+    start = time.perf_counter()
+    await asyncio.gather(*(provider.save_invoice(_invoice(i)) for i in range(operations)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticker
+
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "max_lag": lags[-1] if lags else 0.0,
+        "p99_lag": lags[int(len(lags) * 0.99) - 1] if lags else 0.0,
+        "stalled": sum(lag for lag in lags if lag > 0.01),
+    }
+
+
+async def _run(args) -> None:
+    latency = args.latency_ms / 1000
+    source = args.connection_string or f"mongomock + {args.latency_ms} ms simulados"
+    print(f"{args.operations} guardados concurrentes ({source})")
+    print(f"{'modo':<14} {'total (ms)':>11} {'lag máx (ms)':>13} {'lag p99 (ms)':>13} {'bloqueo (ms)':>13}")
+    for mode in ("bloqueante", "pymongo+hilos", "motor"):
+        try:
+            provider = _build_provider(mode, args.connection_string, latency)
+        except ImportError as e:
+            print(f"{mode:<14} omitido: {e}")
+            continue
+        try:
+            result = await _measure(provider, args.operations)
+        finally:
+            if args.connection_string and mode == "motor":
+                await provider.client.drop_database(provider.database_name)
+            elif args.connection_string:
+                await asyncio.to_thread(provider.client.drop_database, provider.database_name)
+            await provider.close()
+        print(
+            f"{mode:<14} {result['elapsed'] * 1e3:>11.1f} {result['max_lag'] * 1e3:>13.1f} "
+            f"{result['p99_lag'] * 1e3:>13.1f} {result['stalled'] * 1e3:>13.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operations", type=int, default=200, help="Guardados concurrentes")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Latencia simulada por operación (sin servidor)")
+    parser.add_argument("--connection-string", default="", help="Servidor MongoDB real (opcional)")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
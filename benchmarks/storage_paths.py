@@ -0,0 +1,143 @@
+"""
+Guardado de facturas: storage_agent frente a la etapa determinista InvoicePersister.
+
+- agente: storage_agent.run() con la factura en el prompt. El modelo decide
+  llamar a la herramienta store_invoice y después devuelve el StorageResult:
+  dos viajes al modelo por factura
+- directo: InvoicePersister.persist() llama a StorageProvider.save_invoice
+  con reintentos, sin modelo
+
+Muestra la latencia p50/p95 por factura, las llamadas al modelo y la fracción
+de facturas guardadas exactamente como se recibieron (leídas de vuelta).
+
+Sin --model, el modelo del agente se simula con un FunctionModel que hace
+exactamente esas dos llamadas, cada una con --llm-latency-ms de latencia, y
+copia la factura sin errores: es la cota optimista del agente. Con
+--model openai:gpt-4 se mide el modelo real (necesita OPENAI_API_KEY), incluida
+la fidelidad con que copia la factura a los argumentos de la herramienta.
+El almacenamiento es MongoDBProvider sobre mongomock.
+
+Uso:
+    python -m benchmarks.storage_paths [--invoices 50] [--llm-latency-ms 1000] [--model openai:gpt-4]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mongomock
+from pydantic_ai.messages import ModelResponse, ToolCallPart, ToolReturnPart, UserPromptPart
+from pydantic_ai.models.function import FunctionModel
+
+from agents.storage_agent import storage_agent
+from app.persistence import InvoicePersister
+from models.dependencies import StorageAgentDependencies
+from models.invoice import Invoice, InvoiceItem
+from providers.stats import percentile
+from providers.storage import mongodb_provider
+
+
+def _invoice(index: int) -> Invoice:
+    return Invoice(
+        invoice_number=f"BENCH-{index:06d}",
+        date=datetime(2024, 2, 17),
+        vendor_name="Proveedor de prueba",
+        vendor_tax_id="900123456",
+        total_amount=119.0 + index,
+        tax_amount=19.0,
+        items=[
+            InvoiceItem(description="Servicio", quantity=1, unit_price=100.0 + index, total=100.0 + index),
+        ],
+    )
+
+
+def _simulated_model(latency: float) -> FunctionModel:
+    """Modelo que llama a store_invoice con la factura del prompt y devuelve su resultado"""
+
+    async def respond(messages, info):
+        await asyncio.sleep(latency)
+        for part in messages[-1].parts:
+            if isinstance(part, ToolReturnPart) and part.tool_name == "store_invoice":
+                return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, part.content.model_dump())])
+        prompt = next(part.content for part in messages[-1].parts if isinstance(part, UserPromptPart))
+        # Con un único argumento de tipo modelo, pydantic-ai usa su esquema como argumentos de la herramienta
+        invoice = json.loads(prompt[prompt.index("{"):])
+        return ModelResponse(parts=[ToolCallPart("store_invoice", invoice)])
+
+    return FunctionModel(respond)
+
+
+async def _run_agent(storage, invoice: Invoice) -> int:
+    result = await storage_agent.run(
+        f"Guarda esta factura: {invoice.model_dump_json()}",
+        deps=StorageAgentDependencies(storage_provider=storage)
+    )
+    return result.usage().requests if result.data.success else -1
+
+
+async def _run_direct(persister: InvoicePersister, invoice: Invoice) -> int:
+    result = await persister.persist(invoice)
+    return 0 if result.success else -1
+
+
+async def measure(path: str, invoices: list, model) -> dict:
+    """Guarda las facturas por un camino y comprueba lo guardado"""
+    with patch.object(mongodb_provider, "MongoClient", mongomock.MongoClient):
+        storage = mongodb_provider.MongoDBProvider("mongodb://bench", f"bench_{path}_{os.getpid()}")
+    persister = InvoicePersister(storage)
+
+    latencies, calls, failures = [], 0, 0
+    with storage_agent.override(model=model):
+        for invoice in invoices:
+            start = time.perf_counter()
+            try:
+                requests = await (_run_agent(storage, invoice) if path == "agente" else _run_direct(persister, invoice))
+            except Exception as e:
+                requests = -1
+                print(f"  [{path}] {invoice.invoice_number}: {e.__class__.__name__}: {str(e)[:120]}")
+            latencies.append(time.perf_counter() - start)
+            if requests < 0:
+                failures += 1
+            else:
+                calls += requests
+
+    exact = 0
+    for invoice in invoices:
+        exact += await storage.get_invoice(invoice.invoice_number) == invoice
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "calls": calls / len(invoices),
+        "exact": exact / len(invoices),
+        "failures": failures,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=1000, help="Latencia simulada de cada llamada al modelo")
+    parser.add_argument("--model", default=None, help="Modelo real del agente, ej: openai:gpt-4")
+    args = parser.parse_args()
+
+    model = args.model or _simulated_model(args.llm_latency_ms / 1000)
+    source = args.model or f"modelo simulado, {args.llm_latency_ms:.0f} ms por llamada"
+    invoices = [_invoice(index) for index in range(args.invoices)]
+    print(f"{args.invoices} facturas ({source}, mongomock)")
+    print(f"{'camino':<8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'llamadas LLM':>13} {'exactas':>8} {'fallos':>7}")
+    for path in ("agente", "directo"):
+        result = await measure(path, invoices, model)
+        print(
+            f"{path:<8} {result['p50'] * 1000:>9.1f} {result['p95'] * 1000:>9.1f} "
+            f"{result['calls']:>13.1f} {result['exact']:>8.0%} {result['failures']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+"""
+Microbenchmark del parseo de payloads del webhook de WhatsApp.
+
+Compara el camino anterior (decodificar a str, json.loads, json.dumps con
+indentación para el log y recorrido manual de diccionarios) con el actual:
+atajo sin parseo para payloads de solo estados y validación tipada en una sola
+pasada desde los bytes con WebhookPayload.model_validate_json.
+
+Uso:
+    python -m benchmarks.webhook_parsing [--number 5000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.webhook import WebhookPayload
+from app.status_events import classify_payload, STATUSES
+
+
+def _message(index: int, message_type: str = "text") -> dict:
+    message = {
+        "from": f"57300111{index:04d}",
+        "id": f"wamid.HBgMNTczMDAxMTEyMjMzFQIAEhggQ0{index:04d}",
+        "timestamp": "1700000000",
+        "type": message_type,
+    }
+    if message_type == "image":
+        message["image"] = {
+            "caption": "factura",
+            "mime_type": "image/jpeg",
+            "sha256": "l4c8uY7mYf3kP9bXq2wq6QmWcN1rJ8sD0tZ5vH7xK2A=",
+            "id": f"10{index:014d}",
+        }
+    else:
+        message["text"] = {"body": "Hola, adjunto la factura del mes"}
+    return message
+
+
+def _change(messages=None, statuses=None) -> dict:
+    value = {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550001234", "phone_number_id": "106540352242922"},
+        "contacts": [{"profile": {"name": "Cliente"}, "wa_id": "573001112233"}],
+    }
+    if messages:
+        value["messages"] = messages
+    if statuses:
+        value["statuses"] = statuses
+    return {"field": "messages", "value": value}
+
+
+def _status(index: int, status: str) -> dict:
+    return {
+        "id": f"wamid.HBgMNTczMDAxMTEyMjMzFQIAERgSOUM{index:04d}",
+        "status": status,
+        "timestamp": "1700000005",
+        "recipient_id": "573001112233",
+        "conversation": {"id": "c1", "origin": {"type": "service"}},
+        "pricing": {"billable": True, "pricing_model": "CBP", "category": "service"},
+    }
+
+
+def build_payloads() -> dict:
+    """Payloads representativos de lo que recibe el webhook"""
+    def wrap(*entries):
+        return json.dumps({"object": "whatsapp_business_account", "entry": list(entries)}).encode()
+
+    return {
+        "text": wrap({"id": "1", "changes": [_change(messages=[_message(1)])]}),
+        "image": wrap({"id": "1", "changes": [_change(messages=[_message(1, "image")])]}),
+        "status": wrap({"id": "1", "changes": [_change(statuses=[_status(1, "delivered")])]}),
+        "batch": wrap(*[
+            {"id": str(entry), "changes": [
+                _change(messages=[_message(entry * 10 + i, "image" if i % 2 else "text") for i in range(3)]),
+                _change(statuses=[_status(entry * 10 + i, "read") for i in range(3)]),
+            ]}
+            for entry in range(3)
+        ]),
+    }
+
+
+def legacy_parse(raw: bytes) -> list:
+    """Reproduce el camino anterior del handler del webhook"""
+    body_text = raw.decode('utf-8')
+    _ = f'Raw request body: {body_text}'
+    body = json.loads(body_text)
+    _ = f"Received webhook data: {json.dumps(body, indent=2)}"
+    messages = []
+    if (
+        "entry" in body
+        and body["entry"]
+        and "changes" in body["entry"][0]
+        and body["entry"][0]["changes"]
+        and "value" in body["entry"][0]["changes"][0]
+    ):
+        value = body["entry"][0]["changes"][0]["value"]
+        if "messages" in value and value["messages"] and len(value["messages"]) > 0:
+            messages.extend(value["messages"])
+    return messages
+
+
+def typed_parse(raw: bytes) -> list:
+    """Camino actual: atajo para estados y validación tipada desde los bytes"""
+    if classify_payload(raw) == STATUSES:
+        return []
+    payload = WebhookPayload.model_validate_json(raw)
+    return [message.to_payload() for message in payload.iter_messages()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=5000, help="Iteraciones por medición")
+    args = parser.parse_args()
+
+    print(f"{'payload':<8} {'bytes':>6} {'anterior (µs)':>14} {'tipado (µs)':>12} {'ahorro':>8}")
+    for name, raw in build_payloads().items():
+        legacy = min(timeit.repeat(lambda: legacy_parse(raw), number=args.number, repeat=5)) / args.number
+        typed = min(timeit.repeat(lambda: typed_parse(raw), number=args.number, repeat=5)) / args.number
+        saving = (1 - typed / legacy) * 100
+        print(f"{name:<8} {len(raw):>6} {legacy * 1e6:>14.1f} {typed * 1e6:>12.1f} {saving:>7.0f}%")
+
+
+if __name__ == "__main__":
+    main()
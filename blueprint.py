@@ -1,13 +1,23 @@
 import logging
 import json
-import os
 from utils import send_whatsapp_message
 from agents.vision_agent import vision_agent
-from agents.data_extraction_agent import extraction_agent
-from agents.storage_agent import storage_agent
-from models.dependencies import VisionAgentDependencies, ExtractorAgentDependencies, StorageAgentDependencies
-from providers.vision.openai_provider import OpenAIVisionProvider
-from providers.storage.mongodb_provider import MongoDBProvider
+from agents.validation import repair_invoice
+from models.invoice import Invoice
+from app.config import settings
+from app.dependencies import (
+    get_extractor_deps,
+    get_invoice_persister,
+    get_message_deduplicator,
+    get_rule_extractor,
+    get_tiered_extractor,
+    get_vision_deps,
+    get_vision_provider,
+    startup_providers
+)
+from app.fanout import run_grouped
+from models.webhook import WebhookPayload
+from app.status_events import DeliveryMetrics, classify_payload, STATUSES
 
 # Definición de clases para la API independiente de Azure
 class HttpResponse:
@@ -67,6 +77,24 @@ class func:
 
 bp = func.Blueprint()
 
+# Métricas de notificaciones de estado compartidas entre invocaciones
+delivery_metrics = DeliveryMetrics()
+
+# Los proveedores (almacenamiento, visión, deduplicación, extracción) son los mismos que usa la
+# aplicación FastAPI: se construyen desde Settings con las fábricas de app.dependencies
+_providers_ready = False
+
+async def ensure_providers() -> None:
+    """Inicializa una sola vez por proceso los registros compartidos y los índices de almacenamiento"""
+    global _providers_ready
+    if not _providers_ready:
+        _providers_ready = True
+        try:
+            await startup_providers()
+        except BaseException:
+            _providers_ready = False
+            raise
+
 # Crea una asyn for llamar a get_image_from_whatsapp para mantener la compatibilidad
 async def get_image_from_whatsapp(message):
     # Implementación para obtener la imagen de WhatsApp
@@ -99,9 +127,7 @@ def handle_verification(req: func.HttpRequest) -> func.HttpResponse:
     token = req.params.get("hub.verify_token")
     challenge = req.params.get("hub.challenge")
     
-    verify_token = os.environ.get("WHATSAPP_VERIFY_TOKEN_WEBHOOK")
-    
-    if mode == "subscribe" and token == verify_token:
+    if mode == "subscribe" and token == settings.WHATSAPP_VERIFY_TOKEN_WEBHOOK:
         if not challenge:
             return func.HttpResponse(
                 "Missing challenge parameter.",
@@ -118,116 +144,139 @@ def handle_verification(req: func.HttpRequest) -> func.HttpResponse:
             status_code=403
         )
 
+async def handle_message(message: dict) -> None:
+    """Procesa un mensaje individual del webhook"""
+    await ensure_providers()
+    # Descartar reentregas antes de descargar la imagen
+    deduplicator = get_message_deduplicator()
+    if not await deduplicator.claim(message.get("id")):
+        logging.info(f"Mensaje duplicado descartado: {message.get('id')}")
+        return
+    try:
+        await process_message(message)
+    except BaseException:
+        # Si la invocación falla o se cancela, la reentrega de Meta puede procesarlo
+        await deduplicator.release(message.get("id"))
+        raise
+    await deduplicator.complete(message.get("id"))
+
+async def process_message(message: dict) -> None:
+    """Procesa un mensaje ya reclamado según su tipo"""
+    # Asegurarse de que el número esté en formato E.164
+    from_number = message.get("from")
+    if from_number and not from_number.startswith("+"):
+        from_number = "+" + from_number
+    logging.info(f"Número formateado: {from_number}")
+    message_type = message.get("type")
+
+    logging.info("Message details:")
+    logging.info(f"- From: {from_number}")
+    logging.info(f"- Type: {message_type}")
+    logging.info(f"- Timestamp: {message.get('timestamp')}")
+
+    if message_type == 'image':
+        try:
+            # 1. Configurar dependencias
+            vision_deps = get_vision_deps(get_vision_provider())
+
+            # 2. Obtener la imagen
+            image_data = await get_image_from_whatsapp(message)
+
+            if vision_deps.pipeline_mode == "direct":
+                # 3-4. Imagen a Invoice en una sola llamada con salidas estructuradas
+                invoice, _ = repair_invoice((await vision_deps.structured_provider.extract_structured(
+                    image_data,
+                    vision_deps.model_name,
+                    vision_deps.api_key,
+                    Invoice
+                ))["data"])
+            else:
+                # 3. Procesar la imagen con Vision Agent
+                vision_result = await vision_agent.run(
+                    "Extract text from this invoice",
+                    deps=vision_deps,
+                    files={"image": image_data}
+                )
+
+                # 4. Extraer datos estructurados, con las plantillas antes que con el agente
+                rule_extractor = get_rule_extractor()
+                invoice = rule_extractor.extract(vision_result.data.extracted_text) if rule_extractor else None
+                if invoice is None:
+                    invoice = await get_tiered_extractor().run(
+                        vision_result.data.extracted_text,
+                        get_extractor_deps()
+                    )
+
+            # 5. Almacenar en base de datos directamente, sin un LLM que decida llamar a save_invoice
+            storage_result = await get_invoice_persister().persist(invoice)
+
+            # 6. Preparar respuesta
+            if storage_result.success:
+                response_message = (
+                    f"✅ Factura procesada correctamente\n"
+                    f"📝 Número: {invoice.invoice_number}\n"
+                    f"💰 Total: {invoice.total_amount} {invoice.currency}\n"
+                    f"🏢 Vendedor: {invoice.vendor_name}"
+                )
+            else:
+                response_message = "❌ Error al procesar la factura. Por favor, intenta nuevamente."
+
+            await send_whatsapp_message(from_number, response_message)
+
+        except Exception as e:
+            logging.error(f"Error processing invoice: {str(e)}")
+            await send_whatsapp_message(
+                from_number,
+                "❌ Error al procesar la imagen. Por favor, asegúrate de enviar una imagen clara de una factura."
+            )
+
+    elif message_type == 'text':
+        message_body = message.get('text', {}).get('body', '')
+        logging.info(f'- Body: {message_body}')
+        response_message = "Recibí tu mensaje. Por favor, envía una imagen de una factura para procesarla."
+        await send_whatsapp_message(from_number, response_message)
+    else:
+        logging.info(f'- Full message content: {message}')
+        await send_whatsapp_message(
+            from_number,
+            "❌ Tipo de mensaje no soportado. Por favor, envía una imagen de una factura."
+        )
+
 async def handle_messages(req: func.HttpRequest) -> func.HttpResponse:
     """Maneja los mensajes entrantes"""
     try:
-        body_text = req.get_body().decode('utf-8')
-        logging.info(f'Raw request body: {body_text}')
-        body = json.loads(body_text)
-        logging.info(f"Received webhook data: {json.dumps(body, indent=2)}")
+        body = req.get_body()
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f'Raw request body: {body!r}')
         
-        if body.get("object"):
-            if (
-                "entry" in body
-                and body["entry"]
-                and "changes" in body["entry"][0]
-                and body["entry"][0]["changes"]
-                and "value" in body["entry"][0]["changes"][0]
-            ):
-                value = body["entry"][0]["changes"][0]["value"]
-                
-                if (
-                    "messages" in value
-                    and value["messages"]
-                    and len(value["messages"]) > 0
-                ):
-                    for message in value["messages"]:
-                        # Asegurarse de que el número esté en formato E.164
-                        from_number = message.get("from")
-                        if from_number and not from_number.startswith("+"):
-                            from_number = "+" + from_number
-                        logging.info(f"Número formateado: {from_number}")
-                        message_type = message.get("type")
-                        
-                        logging.info("Message details:")
-                        logging.info(f"- From: {from_number}")
-                        logging.info(f"- Type: {message_type}")
-                        logging.info(f"- Timestamp: {message.get('timestamp')}")
-                        
-                        if message_type == 'image':
-                            try:
-                                # 1. Configurar dependencias
-                                vision_deps = VisionAgentDependencies(
-                                    vision_provider=OpenAIVisionProvider(),
-                                    model_name="gpt-4-vision-preview",
-                                    api_key=os.environ["OPENAI_API_KEY"]
-                                )
-                                
-                                storage_deps = StorageAgentDependencies(
-                                    storage_provider=MongoDBProvider(
-                                        connection_string=os.environ["MONGO_CONNECTION_STRING"]
-                                    )
-                                )
-                                
-                                # 2. Obtener la imagen
-                                image_data = await get_image_from_whatsapp(message)
-                                
-                                # 3. Procesar la imagen con Vision Agent
-                                vision_result = await vision_agent.run(
-                                    "Extract text from this invoice",
-                                    deps=vision_deps,
-                                    files={"image": image_data}
-                                )
-                                
-                                # 4. Extraer datos estructurados
-                                extraction_result = await extraction_agent.run(
-                                    vision_result.data.extracted_text,
-                                    deps=ExtractorAgentDependencies()
-                                )
-                                
-                                # 5. Almacenar en base de datos
-                                storage_result = await storage_agent.run(
-                                    "store_invoice",
-                                    deps=storage_deps,
-                                    invoice=extraction_result.data
-                                )
-                                
-                                # 6. Preparar respuesta
-                                if storage_result.data.success:
-                                    response_message = (
-                                        f"✅ Factura procesada correctamente\n"
-                                        f"📝 Número: {extraction_result.data.invoice_number}\n"
-                                        f"💰 Total: {extraction_result.data.total_amount} {extraction_result.data.currency}\n"
-                                        f"🏢 Vendedor: {extraction_result.data.vendor_name}"
-                                    )
-                                else:
-                                    response_message = "❌ Error al procesar la factura. Por favor, intenta nuevamente."
-                                
-                                await send_whatsapp_message(from_number, response_message)
-                                
-                            except Exception as e:
-                                logging.error(f"Error processing invoice: {str(e)}")
-                                await send_whatsapp_message(
-                                    from_number,
-                                    "❌ Error al procesar la imagen. Por favor, asegúrate de enviar una imagen clara de una factura."
-                                )
-                        
-                        elif message_type == 'text':
-                            message_body = message.get('text', {}).get('body', '')
-                            logging.info(f'- Body: {message_body}')
-                            response_message = "Recibí tu mensaje. Por favor, envía una imagen de una factura para procesarla."
-                            await send_whatsapp_message(from_number, response_message)
-                        else:
-                            logging.info(f'- Full message content: {json.dumps(message, indent=2)}')
-                            await send_whatsapp_message(
-                                from_number,
-                                "❌ Tipo de mensaje no soportado. Por favor, envía una imagen de una factura."
-                            )
-                            
-                    return func.HttpResponse(
-                        "Event received",
-                        status_code=200
-                    )
+        # Atajo para payloads que solo traen estados (sent/delivered/read)
+        if classify_payload(body) == STATUSES:
+            if settings.WEBHOOK_STATUS_METRICS:
+                delivery_metrics.record_payload(body)
+            return func.HttpResponse(
+                "Event received",
+                status_code=200
+            )
+        
+        # Validar el payload en una sola pasada directamente desde los bytes
+        payload = WebhookPayload.model_validate_json(body)
+        
+        if payload.object:
+            # Recorrer todas las entradas y cambios; los mensajes se procesan en
+            # paralelo con un límite global, en orden dentro de cada remitente
+            messages = [message.to_payload() for message in payload.iter_messages()]
+            if messages:
+                logging.info(f"Webhook recibido: {len(messages)} mensajes")
+                await run_grouped(
+                    messages,
+                    key=lambda message: message.get("from"),
+                    handler=handle_message,
+                    max_concurrency=settings.WEBHOOK_MAX_CONCURRENCY
+                )
+                return func.HttpResponse(
+                    "Event received",
+                    status_code=200
+                )
             
         return func.HttpResponse(
             "Invalid message format",
@@ -235,6 +284,7 @@ async def handle_messages(req: func.HttpRequest) -> func.HttpResponse:
         )
                 
     except ValueError as e:
+        # Incluye los errores de validación de pydantic
         logging.error(f"Error parsing JSON: {str(e)}")
         return func.HttpResponse(
             "Invalid JSON payload",
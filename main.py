@@ -16,14 +16,73 @@ else:
 
 from app.routers import webhook
 from app.config import settings
+from app.worker_pool import WorkerPool
+from app.job_queue import DurableJobQueue, JobDispatcher
+from app.pipeline import process_queued_message, message_ordering_key
+from app.dependencies import (
+    get_message_deduplicator,
+    get_delivery_metrics,
+    get_invoice_persister,
+    get_storage_provider,
+    get_image_preprocessor,
+    get_vision_provider,
+    get_near_duplicate_index,
+    get_rule_extractor,
+    get_tiered_extractor,
+    get_vision_router,
+    get_vision_backends,
+    get_vision_tiler,
+    get_vision_stream_metrics,
+    startup_providers,
+    shutdown_providers
+)
+from providers.http import get_http_clients
+from providers.resilience import get_resilience
+from providers.vision.cache import CachingVisionProvider
+from providers.rate_limit import get_rate_limits
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Inicialización de recursos necesarios
     print(f"Iniciando aplicación en ambiente: {settings.ENVIRONMENT}")
+    # Proveedores compartidos por todas las solicitudes y trabajos (un pool de conexiones por proceso)
+    await startup_providers()
+    app.state.worker_pool = WorkerPool(
+        concurrency=settings.WORKER_CONCURRENCY,
+        max_queue_size=settings.WORKER_QUEUE_MAX_SIZE,
+        name="webhook"
+    )
+    await app.state.worker_pool.start()
+    
+    # Cola persistente: los trabajos pendientes de una ejecución anterior se retoman aquí
+    app.state.job_queue = DurableJobQueue(
+        settings.JOB_QUEUE_PATH,
+        visibility_timeout=settings.JOB_QUEUE_VISIBILITY_TIMEOUT,
+        max_attempts=settings.JOB_QUEUE_MAX_ATTEMPTS,
+        max_pending=settings.JOB_QUEUE_MAX_PENDING
+    )
+    app.state.job_queue.open()
+    await app.state.job_queue.purge(settings.JOB_QUEUE_RETENTION_HOURS * 3600)
+    app.state.job_dispatcher = JobDispatcher(
+        app.state.job_queue,
+        app.state.worker_pool,
+        process_queued_message,
+        batch_size=settings.JOB_QUEUE_BATCH_SIZE,
+        poll_interval=settings.JOB_QUEUE_POLL_INTERVAL,
+        key_func=message_ordering_key
+    )
+    await app.state.job_dispatcher.start()
     yield
-    # Limpieza al cerrar la aplicación
+    # Limpieza al cerrar la aplicación: terminar los trabajos en curso antes de salir.
+    # Los que no terminen a tiempo se retoman al reiniciar cuando expire su lease.
     print("Cerrando la aplicación")
+    await app.state.job_dispatcher.stop()
+    drained = await app.state.worker_pool.drain(timeout=settings.WORKER_DRAIN_TIMEOUT)
+    if not drained:
+        print("ADVERTENCIA: algunos trabajos no terminaron antes del cierre")
+    await app.state.job_dispatcher.close()
+    app.state.job_queue.close()
+    await shutdown_providers()
 
 # Crear la aplicación FastAPI
 app = FastAPI(
@@ -42,6 +101,30 @@ app.include_router(webhook.router, prefix="/api")
 async def health_check():
     return {"status": "ok", "environment": settings.ENVIRONMENT}
 
+# Métricas de los subsistemas internos
+@app.get("/metrics")
+async def metrics():
+    return {
+        "worker_pool": app.state.worker_pool.stats(),
+        "job_queue": await app.state.job_queue.stats(),
+        "message_dedup": get_message_deduplicator().stats(),
+        "delivery": get_delivery_metrics().stats(),
+        "http": get_http_clients().stats(),
+        "resilience": get_resilience().stats(),
+        "rate_limits": get_rate_limits().stats() if get_rate_limits() else None,
+        "storage": getattr(get_storage_provider(), "stats", dict)(),
+        "persistence": get_invoice_persister().stats(),
+        "image_preprocessing": get_image_preprocessor().stats() if get_image_preprocessor() else None,
+        "vision_cache": get_vision_provider().stats() if isinstance(get_vision_provider(), CachingVisionProvider) else None,
+        "vision_routing": get_vision_router().stats() if get_vision_router() else None,
+        "vision_tiling": get_vision_tiler().stats() if get_vision_tiler() else None,
+        "vision_backends": get_vision_backends().stats() if get_vision_backends() else None,
+        "extraction_tiers": get_tiered_extractor().stats(),
+        "rule_extraction": get_rule_extractor().stats() if get_rule_extractor() else None,
+        "near_duplicates": get_near_duplicate_index().stats() if get_near_duplicate_index() else None,
+        "vision_streaming": get_vision_stream_metrics().stats()
+    }
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app", 
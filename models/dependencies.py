@@ -9,6 +9,10 @@ class VisionAgentDependencies:
     model_name: str
     api_key: str
     image_data: bytes = None  # Campo para almacenar la imagen a procesar
+    streaming: bool = False  # Leer la respuesta del modelo de visión a medida que se genera
+    stream_progress_chars: int = 0  # Caracteres recibidos tras los que se notifica el progreso (0 = nunca)
+    pipeline_mode: str = "agents"  # "agents" (visión + extracción) o "direct" (imagen a Invoice en una llamada)
+    structured_provider: VisionProvider = None  # Proveedor con salidas estructuradas para el modo "direct"
 
 @dataclass
 class StorageAgentDependencies:
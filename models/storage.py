@@ -0,0 +1,7 @@
+from pydantic import BaseModel, Field
+
+class StorageResult(BaseModel):
+    """Resultado de la operación de almacenamiento"""
+    invoice_id: str = Field(description="ID de la factura almacenada")
+    success: bool = Field(description="Indica si la operación fue exitosa")
+    message: str = Field(description="Mensaje descriptivo del resultado")
@@ -0,0 +1,106 @@
+from typing import Any, Dict, Iterator, List, Optional
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class WebhookModel(BaseModel):
+    """Base de los modelos del webhook: los campos desconocidos se ignoran sin validarlos"""
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
+
+class Media(WebhookModel):
+    """Adjunto multimedia de un mensaje (imagen, documento, audio...)"""
+    id: str = Field(description="ID del archivo en la Graph API")
+    mime_type: Optional[str] = Field(None, description="Tipo MIME declarado por WhatsApp")
+    sha256: Optional[str] = Field(None, description="Hash SHA-256 del archivo")
+    caption: Optional[str] = Field(None, description="Texto que acompaña al archivo")
+
+
+class Text(WebhookModel):
+    """Contenido de un mensaje de texto"""
+    body: str = Field("", description="Texto del mensaje")
+
+
+class Message(WebhookModel):
+    """Mensaje entrante de un usuario"""
+    id: Optional[str] = Field(None, description="ID del mensaje (wamid)")
+    from_: Optional[str] = Field(None, alias="from", description="Número del remitente sin '+'")
+    timestamp: Optional[str] = Field(None, description="Marca de tiempo Unix como texto")
+    type: Optional[str] = Field(None, description="Tipo de mensaje: text, image, document...")
+    text: Optional[Text] = None
+    image: Optional[Media] = None
+    document: Optional[Media] = None
+
+    @property
+    def sender(self) -> Optional[str]:
+        """Número del remitente en formato E.164"""
+        if self.from_ and not self.from_.startswith("+"):
+            return "+" + self.from_
+        return self.from_
+
+    def to_payload(self) -> Dict[str, Any]:
+        """Devuelve el mensaje como diccionario con los nombres de campo de WhatsApp"""
+        return self.model_dump(by_alias=True, exclude_none=True)
+
+
+class StatusError(WebhookModel):
+    """Error reportado en una notificación de estado fallida"""
+    code: Optional[int] = None
+    title: Optional[str] = None
+
+
+class Status(WebhookModel):
+    """Notificación de estado de un mensaje enviado (sent, delivered, read, failed)"""
+    id: Optional[str] = Field(None, description="ID del mensaje enviado")
+    status: Optional[str] = Field(None, description="Estado del mensaje")
+    timestamp: Optional[str] = None
+    recipient_id: Optional[str] = None
+    errors: List[StatusError] = Field(default_factory=list)
+
+
+class Metadata(WebhookModel):
+    """Metadatos del número de WhatsApp Business que recibe el evento"""
+    display_phone_number: Optional[str] = None
+    phone_number_id: Optional[str] = None
+
+
+class ChangeValue(WebhookModel):
+    """Contenido de un cambio notificado por el webhook"""
+    messaging_product: Optional[str] = None
+    metadata: Optional[Metadata] = None
+    messages: List[Message] = Field(default_factory=list)
+    statuses: List[Status] = Field(default_factory=list)
+
+
+class Change(WebhookModel):
+    """Cambio individual dentro de una entrada"""
+    field: Optional[str] = None
+    value: ChangeValue = Field(default_factory=ChangeValue)
+
+
+class Entry(WebhookModel):
+    """Entrada del webhook correspondiente a una cuenta de WhatsApp Business"""
+    id: Optional[str] = None
+    changes: List[Change] = Field(default_factory=list)
+
+
+class WebhookPayload(WebhookModel):
+    """Payload completo de un POST del webhook de WhatsApp"""
+    object: Optional[str] = Field(None, description="Tipo de objeto, ej: whatsapp_business_account")
+    entry: List[Entry] = Field(default_factory=list)
+
+    def iter_messages(self) -> Iterator[Message]:
+        """
+        Recorre todos los mensajes del payload.
+
+        Meta agrupa varias entradas y cambios en un mismo POST cuando hay carga,
+        así que se recorren todos los `entry` y `changes`, no solo el primero.
+        """
+        for entry in self.entry:
+            for change in entry.changes:
+                yield from change.value.messages
+
+    def iter_statuses(self) -> Iterator[Status]:
+        """Recorre todas las notificaciones de estado del payload"""
+        for entry in self.entry:
+            for change in entry.changes:
+                yield from change.value.statuses
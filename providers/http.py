@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+class HttpClientRegistry:
+    """
+    Sesiones HTTP compartidas con pool de conexiones por host.
+
+    Cada host (api.openai.com, graph.facebook.com...) tiene su propia
+    ClientSession con un TCPConnector que mantiene las conexiones abiertas
+    (keep-alive) y cachea la resolución DNS, de modo que las llamadas sucesivas
+    reutilizan la conexión TLS en lugar de abrir una nueva.
+
+    Las sesiones se crean de forma perezosa en el event loop que las usa y se
+    cierran con close() al terminar la aplicación.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30.0,
+        connect_timeout: float = 10.0,
+        total_timeout: float = 60.0
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._loops: Dict[str, asyncio.AbstractEventLoop] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        """Devuelve esquema y host de una URL (la clave del pool)"""
+        parts = urlsplit(url)
+        if not parts.scheme or not parts.netloc:
+            raise ValueError(f"URL inválida para el cliente HTTP: {url}")
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def session(self, url: str) -> aiohttp.ClientSession:
+        """
+        Devuelve la sesión compartida del host de la URL.
+
+        La sesión no debe cerrarse ni usarse como context manager; su ciclo de
+        vida lo gestiona el registro.
+
+        Args:
+            url: URL (o URL base) a la que se hará la solicitud
+
+        Returns:
+            aiohttp.ClientSession: Sesión con pool de conexiones para ese host
+        """
+        origin = self._origin(url)
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(origin)
+        # Una sesión solo puede usarse en el loop donde se creó
+        if session is None or session.closed or self._loops.get(origin) is not loop:
+            session = self._create_session(origin)
+            self._sessions[origin] = session
+            self._loops[origin] = loop
+        return session
+
+    def _create_session(self, origin: str) -> aiohttp.ClientSession:
+        stats = self._stats.setdefault(origin, {"requests": 0, "connections_created": 0, "connections_reused": 0})
+
+        async def on_request_start(session, context, params):
+            stats["requests"] += 1
+
+        async def on_connection_create_end(session, context, params):
+            stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            stats["connections_reused"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        logging.info(f"HttpClientRegistry: creando sesión para {origin}")
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            trace_configs=[trace_config]
+        )
+
+    async def close(self) -> None:
+        """Cierra todas las sesiones y sus conexiones"""
+        sessions, self._sessions = self._sessions, {}
+        self._loops = {}
+        for session in sessions.values():
+            if not session.closed:
+                await session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve solicitudes y conexiones creadas/reutilizadas por host"""
+        hosts = {}
+        for origin, counters in self._stats.items():
+            session = self._sessions.get(origin)
+            opened = counters["connections_created"] + counters["connections_reused"]
+            hosts[origin] = {
+                **counters,
+                "reuse_ratio": counters["connections_reused"] / opened if opened else 0.0,
+                "open": session is not None and not session.closed,
+            }
+        return {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "hosts": hosts,
+        }
+
+
+# Registro del proceso; la aplicación lo reemplaza con la configuración de Settings al iniciar
+_http_clients: Optional[HttpClientRegistry] = None
+
+
+def get_http_clients() -> HttpClientRegistry:
+    """Devuelve el registro de sesiones HTTP del proceso"""
+    global _http_clients
+    if _http_clients is None:
+        _http_clients = HttpClientRegistry()
+    return _http_clients
+
+
+def set_http_clients(registry: Optional[HttpClientRegistry]) -> None:
+    """Reemplaza el registro de sesiones HTTP del proceso (None para restablecerlo)"""
+    global _http_clients
+    _http_clients = registry
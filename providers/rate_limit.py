@@ -0,0 +1,460 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Mapping, Optional, Tuple
+
+from pydantic_ai.models import Model, ModelRequestParameters, infer_model
+
+# Tokens aproximados por carácter de texto (≈4 caracteres por token en español e inglés)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Estimación rápida de los tokens de un texto, sin tokenizador"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class TokenBucket:
+    """
+    Cubeta de tokens: se llena a `capacity / 60` por segundo hasta `capacity`.
+
+    Representa un límite por minuto de OpenAI (solicitudes o tokens).
+    """
+
+    def __init__(self, capacity: float, now: float):
+        self.capacity = float(capacity)
+        self.level = float(capacity)
+        self.updated_at = now
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60.0
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """Segundos hasta que haya `amount` disponibles (tras llamar a refill)"""
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit: Optional[float], remaining: Optional[float]) -> None:
+        """Corrige la cubeta con el límite y el saldo que informó el servidor"""
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            # El servidor aún no cuenta las solicitudes locales en vuelo: se toma el menor
+            self.level = min(self.level, float(remaining))
+        self.level = min(self.level, self.capacity)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"capacity": self.capacity, "level": self.level, "updated_at": self.updated_at}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, float]) -> "TokenBucket":
+        bucket = cls(data["capacity"], data["updated_at"])
+        bucket.level = data["level"]
+        return bucket
+
+
+@dataclass
+class Reservation:
+    """Capacidad reservada para una llamada; se corrige con el uso real al terminar"""
+    tokens: int
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """
+    Limitador del lado del cliente para los límites RPM y TPM de un modelo de OpenAI.
+
+    Cada llamada reserva una solicitud y una estimación de tokens (imagen, prompt
+    y tokens máximos de respuesta, que OpenAI también cuenta) y espera en cola
+    local hasta que ambas cubetas tienen saldo, en lugar de salir y volver con
+    un 429. Al terminar, la reserva se corrige con el `usage` real y las cubetas
+    con las cabeceras `x-ratelimit-*` de la respuesta. Las esperas se atienden
+    en orden de llegada.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Any] = asyncio.sleep
+    ):
+        self._clock = clock
+        self._sleep = sleep
+        now = clock()
+        self._requests = TokenBucket(requests_per_minute, now)
+        self._tokens = TokenBucket(tokens_per_minute, now)
+        self._lock: Optional[asyncio.Lock] = None
+        self._waiting = 0
+        self._acquired = 0
+        self._delayed = 0
+        self._wait_seconds = 0.0
+        self._estimated_tokens = 0
+        self._actual_tokens = 0
+        self._header_syncs = 0
+
+    async def _try_take(self, tokens: int) -> float:
+        """Reserva si hay saldo y devuelve 0; si no, devuelve los segundos a esperar"""
+        now = self._clock()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        wait = max(self._requests.time_until(1), self._tokens.time_until(tokens))
+        if wait <= 0:
+            self._requests.take(1)
+            self._tokens.take(tokens)
+        return wait
+
+    async def _adjust_tokens(self, delta: int) -> None:
+        """Devuelve (delta > 0) o descuenta (delta < 0) tokens de la cubeta"""
+        self._tokens.refill(self._clock())
+        self._tokens.level = min(self._tokens.capacity, self._tokens.level + delta)
+
+    async def _sync(self, limits: Tuple[Optional[float], ...]) -> None:
+        limit_requests, remaining_requests, limit_tokens, remaining_tokens = limits
+        now = self._clock()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        self._requests.sync(limit_requests, remaining_requests)
+        self._tokens.sync(limit_tokens, remaining_tokens)
+
+    async def acquire(self, tokens: int) -> Reservation:
+        """
+        Espera hasta que haya saldo para una solicitud de `tokens` tokens y la reserva.
+
+        Args:
+            tokens: Tokens estimados de la llamada (entrada más salida máxima)
+
+        Returns:
+            Reservation: Reserva a corregir con `reconcile` al terminar
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        self._waiting += 1
+        waited = 0.0
+        try:
+            async with self._lock:
+                while True:
+                    wait = await self._try_take(tokens)
+                    if wait <= 0:
+                        break
+                    waited += wait
+                    await self._sleep(wait)
+        finally:
+            self._waiting -= 1
+        self._acquired += 1
+        self._estimated_tokens += tokens
+        if waited:
+            self._delayed += 1
+            self._wait_seconds += waited
+        return Reservation(tokens=tokens)
+
+    async def reconcile(self, reservation: Reservation, actual_tokens: Optional[int]) -> None:
+        """
+        Corrige una reserva con los tokens realmente usados.
+
+        Args:
+            reservation: Reserva devuelta por `acquire`
+            actual_tokens: `usage.total_tokens` de la respuesta (0 si la llamada falló sin consumir)
+        """
+        if actual_tokens is None:
+            return
+        self._actual_tokens += actual_tokens
+        if actual_tokens != reservation.tokens:
+            await self._adjust_tokens(reservation.tokens - actual_tokens)
+
+    async def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Ajusta las cubetas con las cabeceras `x-ratelimit-*` de una respuesta de OpenAI.
+
+        Args:
+            headers: Cabeceras de la respuesta
+        """
+        limits = tuple(
+            _header_number(headers, f"x-ratelimit-{kind}-{unit}")
+            for unit in ("requests", "tokens")
+            for kind in ("limit", "remaining")
+        )
+        if any(value is not None for value in limits):
+            self._header_syncs += 1
+            await self._sync(limits)
+
+    def _snapshot(self) -> Dict[str, Any]:
+        now = self._clock()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        return {
+            "requests_per_minute": self._requests.capacity,
+            "tokens_per_minute": self._tokens.capacity,
+            "requests_available": round(self._requests.level, 2),
+            "tokens_available": round(self._tokens.level),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve saldo de las cubetas, llamadas en espera y error de estimación"""
+        return {
+            **self._snapshot(),
+            "waiting": self._waiting,
+            "acquired": self._acquired,
+            "delayed": self._delayed,
+            "wait_seconds": round(self._wait_seconds, 3),
+            "estimated_tokens": self._estimated_tokens,
+            "actual_tokens": self._actual_tokens,
+            "header_syncs": self._header_syncs,
+        }
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Limitador cuyas cubetas viven en un archivo SQLite compartido entre procesos.
+
+    Todos los procesos (workers de uvicorn, Azure Functions en la misma máquina)
+    que apunten al mismo archivo reparten el mismo presupuesto RPM/TPM. Cada
+    operación es una transacción `BEGIN IMMEDIATE`, ejecutada en un hilo con
+    asyncio.to_thread para no bloquear el event loop. Usa el reloj de pared
+    porque el monotónico no es comparable entre procesos.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        key: str,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        sleep: Callable[[float], Any] = asyncio.sleep
+    ):
+        super().__init__(requests_per_minute, tokens_per_minute, clock=time.time, sleep=sleep)
+        self.path = path
+        self.key = key
+        self._conn: Optional[sqlite3.Connection] = None
+        self._thread_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, state TEXT NOT NULL)"
+            )
+        return self._conn
+
+    def _transaction(self, operation: Callable[[TokenBucket, TokenBucket], Any]) -> Any:
+        """Carga las cubetas, aplica la operación y las guarda en una sola transacción"""
+        with self._thread_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT state FROM rate_limits WHERE key = ?", (self.key,)).fetchone()
+                if row is not None:
+                    state = json.loads(row[0])
+                    self._requests = TokenBucket.from_dict(state["requests"])
+                    self._tokens = TokenBucket.from_dict(state["tokens"])
+                now = self._clock()
+                self._requests.refill(now)
+                self._tokens.refill(now)
+                result = operation(self._requests, self._tokens)
+                state = {"requests": self._requests.to_dict(), "tokens": self._tokens.to_dict()}
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, state) VALUES (?, ?)",
+                    (self.key, json.dumps(state))
+                )
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    async def _try_take(self, tokens: int) -> float:
+        def take(requests: TokenBucket, token_bucket: TokenBucket) -> float:
+            wait = max(requests.time_until(1), token_bucket.time_until(tokens))
+            if wait <= 0:
+                requests.take(1)
+                token_bucket.take(tokens)
+            return wait
+
+        return await asyncio.to_thread(self._transaction, take)
+
+    async def _adjust_tokens(self, delta: int) -> None:
+        def adjust(requests: TokenBucket, token_bucket: TokenBucket) -> None:
+            token_bucket.level = min(token_bucket.capacity, token_bucket.level + delta)
+
+        await asyncio.to_thread(self._transaction, adjust)
+
+    async def _sync(self, limits: Tuple[Optional[float], ...]) -> None:
+        limit_requests, remaining_requests, limit_tokens, remaining_tokens = limits
+
+        def sync(requests: TokenBucket, token_bucket: TokenBucket) -> None:
+            requests.sync(limit_requests, remaining_requests)
+            token_bucket.sync(limit_tokens, remaining_tokens)
+
+        await asyncio.to_thread(self._transaction, sync)
+
+    def _snapshot(self) -> Dict[str, Any]:
+        # Último estado leído de la base; no se consulta SQLite desde /metrics
+        return {**super()._snapshot(), "shared_path": self.path}
+
+    def close(self) -> None:
+        with self._thread_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RateLimitRegistry:
+    """
+    Limitadores por modelo: OpenAI aplica los límites RPM/TPM a cada modelo por separado.
+
+    Todos parten de los mismos límites configurados; las cabeceras
+    `x-ratelimit-limit-*` de las respuestas los ajustan a los reales de la cuenta.
+    Con `shared_path` los limitadores se comparten entre procesos a través de SQLite.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 30000,
+        shared_path: Optional[str] = None
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.shared_path = shared_path
+        self._limiters: Dict[str, RateLimiter] = {}
+
+    def limiter(self, model_name: str) -> RateLimiter:
+        """Limitador del modelo (se crea en el primer uso)"""
+        limiter = self._limiters.get(model_name)
+        if limiter is None:
+            if self.shared_path:
+                limiter = SharedRateLimiter(
+                    self.shared_path, model_name, self.requests_per_minute, self.tokens_per_minute
+                )
+            else:
+                limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+            self._limiters[model_name] = limiter
+        return limiter
+
+    def close(self) -> None:
+        for limiter in self._limiters.values():
+            if isinstance(limiter, SharedRateLimiter):
+                limiter.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve el estado del limitador de cada modelo"""
+        return {
+            "shared": bool(self.shared_path),
+            "models": {name: limiter.stats() for name, limiter in self._limiters.items()},
+        }
+
+
+# Registro del proceso; la aplicación lo crea con la configuración de Settings al iniciar.
+# Sin registro las llamadas no se limitan.
+_rate_limits: Optional[RateLimitRegistry] = None
+
+
+def get_rate_limits() -> Optional[RateLimitRegistry]:
+    """Devuelve el registro de limitadores del proceso, o None si no hay límite"""
+    return _rate_limits
+
+
+def set_rate_limits(registry: Optional[RateLimitRegistry]) -> None:
+    """Reemplaza el registro de limitadores del proceso (None para desactivarlo)"""
+    global _rate_limits
+    _rate_limits = registry
+
+
+def _estimate_messages_tokens(messages: list, model_settings: Optional[dict], parameters: ModelRequestParameters) -> int:
+    """Tokens estimados de una llamada de pydantic_ai: mensajes, herramientas y salida máxima"""
+    chars = 0
+    for message in messages:
+        for part in message.parts:
+            content = getattr(part, "content", None)
+            if content is None:
+                content = getattr(part, "args", None)
+            chars += len(content if isinstance(content, str) else json.dumps(content, default=str))
+    for tool in [*parameters.function_tools, *parameters.result_tools]:
+        chars += len(tool.name) + len(tool.description or "") + len(json.dumps(tool.parameters_json_schema))
+    max_tokens = (model_settings or {}).get("max_tokens") or 1000
+    return chars // CHARS_PER_TOKEN + 1 + max_tokens
+
+
+class RateLimitedModel(Model):
+    """
+    Modelo de pydantic_ai que pasa cada llamada por el limitador del proceso.
+
+    Envuelve otro modelo (o su nombre, ej: "openai:gpt-4o"). Si la aplicación no
+    configuró limitadores se comporta igual que el modelo envuelto.
+    """
+
+    def __init__(self, model: Any):
+        self.wrapped = infer_model(model)
+
+    @property
+    def model_name(self) -> str:
+        return self.wrapped.model_name
+
+    @property
+    def system(self) -> Optional[str]:
+        return self.wrapped.system
+
+    def _limiter(self) -> Optional[RateLimiter]:
+        registry = get_rate_limits()
+        return registry.limiter(self.model_name) if registry is not None else None
+
+    async def request(self, messages, model_settings, model_request_parameters):
+        limiter = self._limiter()
+        if limiter is None:
+            return await self.wrapped.request(messages, model_settings, model_request_parameters)
+        reservation = await limiter.acquire(
+            _estimate_messages_tokens(messages, model_settings, model_request_parameters)
+        )
+        try:
+            response, usage = await self.wrapped.request(messages, model_settings, model_request_parameters)
+        except BaseException:
+            await limiter.reconcile(reservation, 0)
+            raise
+        await limiter.reconcile(reservation, usage.total_tokens or reservation.tokens)
+        return response, usage
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters) -> AsyncIterator:
+        limiter = self._limiter()
+        if limiter is None:
+            async with self.wrapped.request_stream(messages, model_settings, model_request_parameters) as response:
+                yield response
+            return
+        reservation = await limiter.acquire(
+            _estimate_messages_tokens(messages, model_settings, model_request_parameters)
+        )
+        response = None
+        try:
+            async with self.wrapped.request_stream(messages, model_settings, model_request_parameters) as response:
+                yield response
+        finally:
+            # Si el stream no llegó a abrirse no se consumieron tokens
+            used = (response.usage().total_tokens or reservation.tokens) if response is not None else 0
+            await limiter.reconcile(reservation, used)
+
@@ -0,0 +1,438 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, TypeVar
+from urllib.parse import urlsplit
+
+import aiohttp
+
+T = TypeVar("T")
+
+
+class ProviderError(Exception):
+    """
+    Error de un proveedor externo (OpenAI, Graph API de WhatsApp...).
+
+    `retryable` indica si tiene sentido repetir la llamada; `retry_after` son los
+    segundos que el servidor pidió esperar (cabecera Retry-After), si los indicó.
+    """
+    retryable = False
+
+    def __init__(
+        self,
+        message: str,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        origin: Optional[str] = None
+    ):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.origin = origin
+
+
+class ProviderRequestError(ProviderError):
+    """La solicitud no es válida (4xx): repetirla daría el mismo resultado"""
+
+
+class ProviderAuthError(ProviderRequestError):
+    """Credenciales rechazadas (401/403)"""
+
+
+class RateLimitError(ProviderError):
+    """Límite de solicitudes o de tokens excedido (429)"""
+    retryable = True
+
+
+class UpstreamServerError(ProviderError):
+    """Error del servidor del proveedor (5xx)"""
+    retryable = True
+
+
+class ProviderTimeoutError(ProviderError):
+    """El proveedor no respondió a tiempo"""
+    retryable = True
+
+
+class ProviderConnectionError(ProviderError):
+    """No se pudo conectar con el proveedor o la conexión se cortó"""
+    retryable = True
+
+
+class CircuitOpenError(ProviderError):
+    """El circuito del host está abierto: se falla de inmediato sin llamar al proveedor"""
+
+
+def origin_of(url: str) -> str:
+    """Esquema y host de una URL; es la clave de los circuitos"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Segundos de espera indicados por el servidor.
+
+    Admite `Retry-After` en segundos o como fecha HTTP, y `retry-after-ms`, que
+    usa la API de OpenAI con más precisión.
+
+    Args:
+        headers: Cabeceras de la respuesta
+
+    Returns:
+        Optional[float]: Segundos a esperar, o None si no se indicaron
+    """
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def error_from_status(
+    status: int,
+    body: str = "",
+    headers: Optional[Mapping[str, str]] = None,
+    origin: Optional[str] = None
+) -> ProviderError:
+    """
+    Error tipado para una respuesta HTTP con estado de error.
+
+    Args:
+        status: Código de estado HTTP
+        body: Cuerpo de la respuesta (se incluye en el mensaje)
+        headers: Cabeceras de la respuesta (para Retry-After)
+        origin: Host que respondió
+
+    Returns:
+        ProviderError: Error del tipo correspondiente al estado
+    """
+    retry_after = parse_retry_after(headers or {})
+    message = f"HTTP {status} de {origin or 'proveedor'}: {body[:500]}"
+    if status == 429:
+        error_class = RateLimitError
+    elif status >= 500:
+        error_class = UpstreamServerError
+    elif status in (401, 403):
+        error_class = ProviderAuthError
+    elif status == 408:
+        error_class = ProviderTimeoutError
+    else:
+        error_class = ProviderRequestError
+    return error_class(message, status=status, retry_after=retry_after, origin=origin)
+
+
+def error_from_exception(error: BaseException, origin: Optional[str] = None) -> ProviderError:
+    """
+    Convierte las excepciones de aiohttp y asyncio en errores tipados.
+
+    Args:
+        error: Excepción original
+        origin: Host de la llamada
+
+    Returns:
+        ProviderError: Error equivalente (la excepción original queda en __cause__)
+    """
+    if isinstance(error, ProviderError):
+        return error
+    if isinstance(error, aiohttp.ClientResponseError):
+        converted = error_from_status(error.status, error.message, error.headers or {}, origin)
+    elif isinstance(error, (asyncio.TimeoutError, aiohttp.ServerTimeoutError)):
+        converted = ProviderTimeoutError(f"Tiempo de espera agotado con {origin or 'proveedor'}", origin=origin)
+    elif isinstance(error, aiohttp.ClientError):
+        converted = ProviderConnectionError(f"Error de conexión con {origin or 'proveedor'}: {error}", origin=origin)
+    else:
+        return error
+    converted.__cause__ = error
+    return converted
+
+
+# Fallos en los que la solicitud no llegó a enviarse (en aiohttp < 3.10 el timeout de
+# conexión no se distingue del de lectura y no se incluye)
+CONNECT_ERRORS = (aiohttp.ClientConnectorError, getattr(aiohttp, "ConnectionTimeoutError", ()))
+
+
+def request_not_processed(error: ProviderError) -> bool:
+    """
+    Indica si el proveedor con seguridad no procesó la solicitud.
+
+    Es el caso de un 429 o de un fallo al conectar. Tras un timeout o un 5xx la
+    solicitud puede haberse procesado, así que repetir una operación no
+    idempotente (como enviar un mensaje) podría duplicarla.
+
+    Args:
+        error: Error tipado del intento
+
+    Returns:
+        bool: True si repetir la solicitud no puede duplicar su efecto
+    """
+    return isinstance(error, RateLimitError) or isinstance(error.__cause__, CONNECT_ERRORS)
+
+
+async def raise_for_response(response: aiohttp.ClientResponse) -> None:
+    """
+    Lanza el error tipado de una respuesta HTTP con estado de error.
+
+    Args:
+        response: Respuesta de aiohttp (el cuerpo se lee solo si hay error)
+    """
+    if response.status < 400:
+        return
+    body = await response.text()
+    raise error_from_status(response.status, body, response.headers, origin_of(str(response.url)))
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Reintentos con backoff exponencial y jitter completo.
+
+    El intento n espera un tiempo aleatorio entre 0 y min(max_delay, base_delay·2ⁿ⁻¹),
+    lo que evita que muchos trabajos reintenten a la vez. Si el servidor indica
+    Retry-After se respeta; si pide esperar más de `max_retry_after`, no se reintenta.
+    """
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    max_retry_after: float = 60.0
+
+    def delay(self, attempt: int, error: ProviderError) -> Optional[float]:
+        """
+        Espera antes del siguiente intento.
+
+        Args:
+            attempt: Número del intento que falló (desde 1)
+            error: Error del intento
+
+        Returns:
+            Optional[float]: Segundos a esperar, o None si no se debe reintentar
+        """
+        if not error.retryable or attempt >= self.max_attempts:
+            return None
+        if error.retry_after is not None:
+            if error.retry_after > self.max_retry_after:
+                return None
+            # Un poco de jitter sobre la espera pedida para no volver todos a la vez
+            return error.retry_after + random.uniform(0, self.base_delay)
+        return self.backoff(attempt)
+
+    def backoff(self, attempt: int) -> float:
+        """Backoff exponencial con jitter completo tras el intento `attempt` (desde 1)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Circuito de un host: tras `failure_threshold` fallos seguidos se abre y las
+    llamadas fallan de inmediato durante `reset_timeout` segundos. Después deja
+    pasar una sola llamada de prueba (semiabierto): si funciona se cierra y si
+    falla vuelve a abrirse.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        """Indica si se puede hacer una llamada ahora"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self.times_opened += 1
+            self._state = self.OPEN
+            self._opened_at = self._clock()
+
+    def release(self) -> None:
+        """Libera la llamada de prueba cuando terminó sin decir nada de la salud del host"""
+        self._probe_in_flight = False
+
+    @property
+    def retry_in(self) -> float:
+        """Segundos hasta que se permita la llamada de prueba"""
+        return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+
+class ResilienceRegistry:
+    """
+    Reintentos y circuitos por host para las llamadas a proveedores externos.
+
+    Cada host tiene su propio circuito, así que una caída de la API de OpenAI
+    no bloquea los envíos a la Graph API de WhatsApp. Solo los errores que
+    indican problemas del proveedor (5xx, timeouts, conexión) cuentan para el
+    circuito; un 4xx o un 429 significan que el host está respondiendo.
+    """
+
+    def __init__(
+        self,
+        retry_policy: Optional[RetryPolicy] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._sleep = sleep
+        self._clock = clock
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """Circuito del host de la URL"""
+        origin = origin_of(url)
+        breaker = self._breakers.get(origin)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout, self._clock)
+            self._breakers[origin] = breaker
+        return breaker
+
+    async def call(self, url: str, operation: Callable[[], Awaitable[T]], idempotent: bool = True) -> T:
+        """
+        Ejecuta una llamada con reintentos y circuito del host.
+
+        Args:
+            url: URL (o URL base) del proveedor
+            operation: Función sin argumentos que hace un intento completo de la llamada
+            idempotent: Si es False, solo se reintentan los 429 y los fallos al conectar,
+                en los que la solicitud seguro no se procesó
+
+        Returns:
+            T: Resultado de la operación
+
+        Raises:
+            CircuitOpenError: Si el circuito del host está abierto
+            ProviderError: Error tipado del último intento
+        """
+        origin = origin_of(url)
+        breaker = self.breaker(url)
+        stats = self._stats.setdefault(
+            origin, {"calls": 0, "attempts": 0, "retries": 0, "failures": 0, "rejected": 0}
+        )
+        stats["calls"] += 1
+        attempt = 0
+        error: Optional[ProviderError] = None
+        while True:
+            if not breaker.allow():
+                if error is not None:
+                    # El circuito se abrió durante los reintentos: se informa el error real
+                    stats["failures"] += 1
+                    raise error
+                stats["rejected"] += 1
+                raise CircuitOpenError(
+                    f"Circuito abierto para {origin}; reintento en {breaker.retry_in:.0f}s",
+                    retry_after=breaker.retry_in,
+                    origin=origin
+                )
+            attempt += 1
+            stats["attempts"] += 1
+            try:
+                result = await operation()
+            except (ProviderError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = error_from_exception(e, origin)
+            except BaseException:
+                breaker.release()
+                raise
+            else:
+                breaker.record_success()
+                return result
+
+            if isinstance(error, (UpstreamServerError, ProviderTimeoutError, ProviderConnectionError)):
+                breaker.record_failure()
+            else:
+                # El host respondió: no es un problema de disponibilidad
+                breaker.record_success()
+            delay = self.retry_policy.delay(attempt, error) if idempotent or request_not_processed(error) else None
+            if delay is None:
+                stats["failures"] += 1
+                raise error
+            stats["retries"] += 1
+            logging.warning(
+                f"ResilienceRegistry: {error.__class__.__name__} en {origin} "
+                f"(intento {attempt}); reintento en {delay:.2f}s"
+            )
+            await self._sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve intentos, reintentos, fallos y estado del circuito por host"""
+        return {
+            "max_attempts": self.retry_policy.max_attempts,
+            "hosts": {
+                origin: {
+                    **counters,
+                    "circuit": self._breakers[origin].state,
+                    "times_opened": self._breakers[origin].times_opened,
+                }
+                for origin, counters in self._stats.items()
+            },
+        }
+
+
+# Registro del proceso; la aplicación lo reemplaza con la configuración de Settings al iniciar
+_resilience: Optional[ResilienceRegistry] = None
+
+
+def get_resilience() -> ResilienceRegistry:
+    """Devuelve el registro de reintentos y circuitos del proceso"""
+    global _resilience
+    if _resilience is None:
+        _resilience = ResilienceRegistry()
+    return _resilience
+
+
+def set_resilience(registry: Optional[ResilienceRegistry]) -> None:
+    """Reemplaza el registro de reintentos y circuitos del proceso (None para restablecerlo)"""
+    global _resilience
+    _resilience = registry
@@ -0,0 +1,18 @@
+from typing import Iterable, Optional
+
+
+def percentile(values: Iterable[float], fraction: float) -> Optional[float]:
+    """
+    Calcula un percentil por el método del rango más cercano, sin interpolar.
+
+    Args:
+        values: Muestras, en cualquier orden
+        fraction: Percentil como fracción entre 0 y 1 (ej: 0.95)
+
+    Returns:
+        Optional[float]: Valor del percentil, o None si no hay muestras
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
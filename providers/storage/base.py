@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Union
 from models.invoice import Invoice
 
 class StorageProvider(ABC):
@@ -18,6 +18,27 @@ class StorageProvider(ABC):
         """
         pass
     
+    async def save_invoices(self, invoices: List[Invoice]) -> List[Union[str, Exception]]:
+        """
+        Guarda varias facturas. Un fallo en una factura no impide guardar las demás.
+        
+        Los proveedores con escrituras en lote deben sobrescribir este método; por
+        defecto se guardan de una en una.
+        
+        Args:
+            invoices: Facturas a guardar
+            
+        Returns:
+            List[Union[str, Exception]]: ID guardado o excepción de cada factura, en el mismo orden
+        """
+        results: List[Union[str, Exception]] = []
+        for invoice in invoices:
+            try:
+                results.append(await self.save_invoice(invoice))
+            except Exception as e:
+                results.append(e)
+        return results
+    
     @abstractmethod
     async def get_invoice(self, invoice_id: str) -> Optional[Invoice]:
         """
@@ -63,3 +84,40 @@ class StorageProvider(ABC):
             bool: True si se eliminó correctamente
         """
         pass
+    
+    async def mark_message_seen(self, message_id: str, lease_seconds: Optional[float] = None) -> bool:
+        """
+        Registra el ID de un mensaje de WhatsApp como visto.
+        
+        Con `lease_seconds` el mensaje queda en proceso: si quien lo reclamó no
+        lo completa con `complete_message_seen` antes de que venza el lease (el
+        worker murió), otro puede reclamarlo. Sin lease queda como procesado.
+        Los proveedores sin soporte de persistencia consideran todos los
+        mensajes como nuevos.
+        
+        Args:
+            message_id: ID del mensaje de WhatsApp
+            lease_seconds: Segundos que dura el reclamo de un mensaje en proceso
+            
+        Returns:
+            bool: True si el mensaje no se había visto antes o su lease había vencido
+        """
+        return True
+    
+    async def complete_message_seen(self, message_id: str) -> None:
+        """
+        Marca como procesado un mensaje reclamado con lease.
+        
+        Args:
+            message_id: ID del mensaje de WhatsApp
+        """
+        pass
+    
+    async def forget_message_seen(self, message_id: str) -> None:
+        """
+        Elimina el registro de un mensaje para permitir reprocesarlo.
+        
+        Args:
+            message_id: ID del mensaje de WhatsApp
+        """
+        pass
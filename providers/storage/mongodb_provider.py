@@ -1,26 +1,125 @@
-from typing import Optional, List
-import os
-from pymongo import MongoClient
+from typing import Any, Dict, Optional, List, Tuple, Union
+from datetime import datetime, timedelta, timezone
+import asyncio
+from pymongo import MongoClient, ReplaceOne
 from pymongo.collection import Collection
 from pymongo.database import Database
 import pymongo
 from models.invoice import Invoice
 from .base import StorageProvider
 
+def build_invoice_query(
+    vendor_name: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+) -> Dict[str, Any]:
+    """Construye el filtro de MongoDB para listar facturas"""
+    query: Dict[str, Any] = {}
+    
+    if vendor_name:
+        query["vendor_name"] = vendor_name
+        
+    if date_from or date_to:
+        query["date"] = {}
+        if date_from:
+            query["date"]["$gte"] = date_from
+        if date_to:
+            query["date"]["$lte"] = date_to
+    
+    return query
+
+def invoice_from_document(document: Dict[str, Any]) -> Invoice:
+    """Convierte un documento de MongoDB en Invoice"""
+    # Eliminar el _id para convertir a Invoice
+    document.pop("_id", None)
+    return Invoice(**document)
+
+def invoice_upserts(invoices: List[Invoice]) -> List[ReplaceOne]:
+    """Construye las operaciones de upsert de un lote de facturas"""
+    operations = []
+    for invoice in invoices:
+        invoice_dict = invoice.model_dump()
+        invoice_dict["_id"] = invoice.invoice_number
+        operations.append(ReplaceOne({"_id": invoice.invoice_number}, invoice_dict, upsert=True))
+    return operations
+
+def bulk_write_results(
+    invoices: List[Invoice],
+    error: pymongo.errors.BulkWriteError
+) -> List[Union[str, Exception]]:
+    """Asigna los errores de un bulk_write no ordenado a cada factura del lote"""
+    results: List[Union[str, Exception]] = [invoice.invoice_number for invoice in invoices]
+    for write_error in error.details.get("writeErrors", []):
+        results[write_error["index"]] = pymongo.errors.WriteError(
+            write_error.get("errmsg", "Error de escritura"), write_error.get("code"), write_error
+        )
+    return results
+
+def seen_message_claim(
+    message_id: str,
+    lease_seconds: Optional[float]
+) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """
+    Construye el registro de un mensaje visto y la actualización que retoma su
+    reclamo cuando venció el lease. Los registros sin `lease_until` están procesados.
+
+    Returns:
+        Tuple: Documento a insertar, filtro y actualización para retomar el reclamo
+    """
+    now = datetime.now(timezone.utc)
+    record = {"_id": message_id, "seen_at": now}
+    if lease_seconds is not None:
+        record["lease_until"] = now + timedelta(seconds=lease_seconds)
+    takeover = {"_id": message_id, "lease_until": {"$lte": now}}
+    return record, takeover, {"$set": {k: v for k, v in record.items() if k != "_id"}}
+
 class MongoDBProvider(StorageProvider):
-    """Implementación del proveedor de almacenamiento usando MongoDB"""
+    """
+    Implementación del proveedor de almacenamiento usando MongoDB con pymongo.
+    
+    pymongo es síncrono: cada operación se ejecuta en un hilo con asyncio.to_thread
+    para no bloquear el event loop. Es la alternativa cuando motor no está instalado
+    (ver MotorMongoDBProvider).
+    """
     
-    def __init__(self, connection_string: str, database_name: str = "invoices_db"):
-        self.client = MongoClient(connection_string)
+    def __init__(
+        self,
+        connection_string: str,
+        database_name: str = "invoices_db",
+        seen_messages_ttl: int = 7 * 24 * 3600,
+        **client_options
+    ):
+        """
+        Crea el cliente de MongoDB. No abre conexiones ni crea índices.
+        
+        El cliente mantiene su propio pool de conexiones, por lo que debe crearse una
+        sola vez por proceso y compartirse; los índices se crean con ensure_indexes().
+        
+        Args:
+            connection_string: Cadena de conexión de MongoDB
+            database_name: Nombre de la base de datos
+            seen_messages_ttl: Segundos que se conservan los IDs de mensajes vistos
+            client_options: Opciones de MongoClient (ej: maxPoolSize, serverSelectionTimeoutMS)
+        """
+        self.client = MongoClient(connection_string, **client_options)
         self.database_name = database_name
         self.collection_name = "invoices"
+        self.seen_messages_ttl = seen_messages_ttl
         self._db = self.client[database_name]
         self._collection = self._db[self.collection_name]
-        
+        self._seen_messages = self._db["seen_messages"]
+    
+    async def ensure_indexes(self) -> None:
+        """Crea los índices de las colecciones. Debe llamarse una vez al iniciar la aplicación"""
+        await asyncio.to_thread(self._create_indexes)
+    
+    def _create_indexes(self) -> None:
         # Crear índices para mejorar las consultas
         self._collection.create_index("invoice_number", unique=True)
         self._collection.create_index("vendor_name")
         self._collection.create_index("date")
+        # Los mensajes vistos expiran solos; Meta no reentrega después de unos días
+        self._seen_messages.create_index("seen_at", expireAfterSeconds=self.seen_messages_ttl)
     
     async def save_invoice(self, invoice: Invoice) -> str:
         """
@@ -36,14 +135,30 @@ class MongoDBProvider(StorageProvider):
         invoice_dict = invoice.model_dump()
         invoice_dict["_id"] = invoice.invoice_number
         
-        # Guardar en MongoDB
+        # Upsert: crea o reemplaza la factura en un solo viaje al servidor
+        await asyncio.to_thread(self._save_document, invoice_dict)
+        return invoice.invoice_number
+    
+    def _save_document(self, invoice_dict: Dict[str, Any]) -> None:
+        self._collection.replace_one({"_id": invoice_dict["_id"]}, invoice_dict, upsert=True)
+    
+    async def save_invoices(self, invoices: List[Invoice]) -> List[Union[str, Exception]]:
+        """
+        Guarda varias facturas con un único bulk_write no ordenado de upserts.
+        
+        Args:
+            invoices: Facturas a guardar
+            
+        Returns:
+            List[Union[str, Exception]]: ID guardado o excepción de cada factura, en el mismo orden
+        """
+        if not invoices:
+            return []
         try:
-            self._collection.insert_one(invoice_dict)
-            return invoice.invoice_number
-        except pymongo.errors.DuplicateKeyError:
-            # Si ya existe, actualizar
-            self._collection.replace_one({"_id": invoice.invoice_number}, invoice_dict)
-            return invoice.invoice_number
+            await asyncio.to_thread(self._collection.bulk_write, invoice_upserts(invoices), ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            return bulk_write_results(invoices, e)
+        return [invoice.invoice_number for invoice in invoices]
     
     async def get_invoice(self, invoice_id: str) -> Optional[Invoice]:
         """
@@ -55,11 +170,9 @@ class MongoDBProvider(StorageProvider):
         Returns:
             Optional[Invoice]: La factura si existe
         """
-        result = self._collection.find_one({"_id": invoice_id})
+        result = await asyncio.to_thread(self._collection.find_one, {"_id": invoice_id})
         if result:
-            # Eliminar el _id para convertir a Invoice
-            result.pop("_id", None)
-            return Invoice(**result)
+            return invoice_from_document(result)
         return None
     
     async def list_invoices(
@@ -79,27 +192,11 @@ class MongoDBProvider(StorageProvider):
         Returns:
             List[Invoice]: Lista de facturas
         """
-        # Construir la consulta
-        query = {}
+        query = build_invoice_query(vendor_name, date_from, date_to)
         
-        if vendor_name:
-            query["vendor_name"] = vendor_name
-            
-        if date_from or date_to:
-            query["date"] = {}
-            if date_from:
-                query["date"]["$gte"] = date_from
-            if date_to:
-                query["date"]["$lte"] = date_to
-        
-        # Ejecutar la consulta
-        results = []
-        for doc in self._collection.find(query):
-            # Eliminar el _id para convertir a Invoice
-            doc.pop("_id", None)
-            results.append(Invoice(**doc))
-            
-        return results
+        # Ejecutar la consulta (el cursor se consume completo en el hilo)
+        documents = await asyncio.to_thread(lambda: list(self._collection.find(query)))
+        return [invoice_from_document(doc) for doc in documents]
     
     async def delete_invoice(self, invoice_id: str) -> bool:
         """
@@ -111,9 +208,51 @@ class MongoDBProvider(StorageProvider):
         Returns:
             bool: True si se eliminó correctamente
         """
-        result = self._collection.delete_one({"_id": invoice_id})
+        result = await asyncio.to_thread(self._collection.delete_one, {"_id": invoice_id})
         return result.deleted_count > 0
             
+    async def mark_message_seen(self, message_id: str, lease_seconds: Optional[float] = None) -> bool:
+        """
+        Registra el ID de un mensaje de WhatsApp como visto (en proceso si se indica un lease).
+        
+        Args:
+            message_id: ID del mensaje de WhatsApp
+            lease_seconds: Segundos que dura el reclamo de un mensaje en proceso
+            
+        Returns:
+            bool: True si el mensaje no se había visto antes o su lease había vencido
+        """
+        record, takeover, update = seen_message_claim(message_id, lease_seconds)
+        try:
+            await asyncio.to_thread(self._seen_messages.insert_one, record)
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            if lease_seconds is None:
+                return False
+        # Quien lo reclamó murió sin completarlo ni liberarlo
+        result = await asyncio.to_thread(self._seen_messages.update_one, takeover, update)
+        return result.modified_count > 0
+    
+    async def complete_message_seen(self, message_id: str) -> None:
+        """
+        Marca como procesado un mensaje reclamado con lease.
+        
+        Args:
+            message_id: ID del mensaje de WhatsApp
+        """
+        await asyncio.to_thread(
+            self._seen_messages.update_one, {"_id": message_id}, {"$unset": {"lease_until": ""}}
+        )
+    
+    async def forget_message_seen(self, message_id: str) -> None:
+        """
+        Elimina el registro de un mensaje para permitir reprocesarlo.
+        
+        Args:
+            message_id: ID del mensaje de WhatsApp
+        """
+        await asyncio.to_thread(self._seen_messages.delete_one, {"_id": message_id})
+            
     async def close(self):
         """Cierra la conexión con MongoDB"""
         if self.client:
@@ -0,0 +1,179 @@
+from typing import Any, Dict, Optional, List, Union
+from motor.motor_asyncio import AsyncIOMotorClient
+import pymongo
+from models.invoice import Invoice
+from .base import StorageProvider
+from .mongodb_provider import (
+    build_invoice_query,
+    bulk_write_results,
+    invoice_from_document,
+    invoice_upserts,
+    seen_message_claim
+)
+
+class MotorMongoDBProvider(StorageProvider):
+    """
+    Implementación asíncrona del proveedor de almacenamiento usando motor.
+
+    Las operaciones se esperan en el event loop sin bloquearlo ni ocupar hilos
+    del executor. Es el proveedor por defecto (STORAGE_BACKEND=motor).
+    """
+
+    def __init__(
+        self,
+        connection_string: str,
+        database_name: str = "invoices_db",
+        seen_messages_ttl: int = 7 * 24 * 3600,
+        **client_options
+    ):
+        """
+        Crea el cliente de MongoDB. No abre conexiones ni crea índices.
+
+        Args:
+            connection_string: Cadena de conexión de MongoDB
+            database_name: Nombre de la base de datos
+            seen_messages_ttl: Segundos que se conservan los IDs de mensajes vistos
+            client_options: Opciones del cliente (ej: maxPoolSize, serverSelectionTimeoutMS)
+        """
+        self.client = AsyncIOMotorClient(connection_string, **client_options)
+        self.database_name = database_name
+        self.collection_name = "invoices"
+        self.seen_messages_ttl = seen_messages_ttl
+        self._db = self.client[database_name]
+        self._collection = self._db[self.collection_name]
+        self._seen_messages = self._db["seen_messages"]
+
+    async def ensure_indexes(self) -> None:
+        """Crea los índices de las colecciones. Debe llamarse una vez al iniciar la aplicación"""
+        await self._collection.create_index("invoice_number", unique=True)
+        await self._collection.create_index("vendor_name")
+        await self._collection.create_index("date")
+        await self._seen_messages.create_index("seen_at", expireAfterSeconds=self.seen_messages_ttl)
+
+    async def save_invoice(self, invoice: Invoice) -> str:
+        """
+        Guarda una factura en MongoDB.
+
+        Args:
+            invoice: Objeto Invoice a guardar
+
+        Returns:
+            str: ID de la factura guardada
+        """
+        invoice_dict = invoice.model_dump()
+        invoice_dict["_id"] = invoice.invoice_number
+
+        # Upsert: crea o reemplaza la factura en un solo viaje al servidor
+        await self._collection.replace_one({"_id": invoice.invoice_number}, invoice_dict, upsert=True)
+        return invoice.invoice_number
+
+    async def save_invoices(self, invoices: List[Invoice]) -> List[Union[str, Exception]]:
+        """
+        Guarda varias facturas con un único bulk_write no ordenado de upserts.
+
+        Args:
+            invoices: Facturas a guardar
+
+        Returns:
+            List[Union[str, Exception]]: ID guardado o excepción de cada factura, en el mismo orden
+        """
+        if not invoices:
+            return []
+        try:
+            await self._collection.bulk_write(invoice_upserts(invoices), ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            return bulk_write_results(invoices, e)
+        return [invoice.invoice_number for invoice in invoices]
+
+    async def get_invoice(self, invoice_id: str) -> Optional[Invoice]:
+        """
+        Recupera una factura por su ID.
+
+        Args:
+            invoice_id: ID de la factura
+
+        Returns:
+            Optional[Invoice]: La factura si existe
+        """
+        result = await self._collection.find_one({"_id": invoice_id})
+        if result:
+            return invoice_from_document(result)
+        return None
+
+    async def list_invoices(
+        self,
+        vendor_name: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None
+    ) -> List[Invoice]:
+        """
+        Lista facturas con filtros opcionales.
+
+        Args:
+            vendor_name: Filtrar por vendedor
+            date_from: Fecha inicial
+            date_to: Fecha final
+
+        Returns:
+            List[Invoice]: Lista de facturas
+        """
+        query = build_invoice_query(vendor_name, date_from, date_to)
+        return [invoice_from_document(doc) async for doc in self._collection.find(query)]
+
+    async def delete_invoice(self, invoice_id: str) -> bool:
+        """
+        Elimina una factura por su ID.
+
+        Args:
+            invoice_id: ID de la factura
+
+        Returns:
+            bool: True si se eliminó correctamente
+        """
+        result = await self._collection.delete_one({"_id": invoice_id})
+        return result.deleted_count > 0
+
+    async def mark_message_seen(self, message_id: str, lease_seconds: Optional[float] = None) -> bool:
+        """
+        Registra el ID de un mensaje de WhatsApp como visto (en proceso si se indica un lease).
+
+        Args:
+            message_id: ID del mensaje de WhatsApp
+            lease_seconds: Segundos que dura el reclamo de un mensaje en proceso
+
+        Returns:
+            bool: True si el mensaje no se había visto antes o su lease había vencido
+        """
+        record, takeover, update = seen_message_claim(message_id, lease_seconds)
+        try:
+            await self._seen_messages.insert_one(record)
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            if lease_seconds is None:
+                return False
+        # Quien lo reclamó murió sin completarlo ni liberarlo
+        result = await self._seen_messages.update_one(takeover, update)
+        return result.modified_count > 0
+
+    async def complete_message_seen(self, message_id: str) -> None:
+        """
+        Marca como procesado un mensaje reclamado con lease.
+
+        Args:
+            message_id: ID del mensaje de WhatsApp
+        """
+        await self._seen_messages.update_one({"_id": message_id}, {"$unset": {"lease_until": ""}})
+
+    async def forget_message_seen(self, message_id: str) -> None:
+        """
+        Elimina el registro de un mensaje para permitir reprocesarlo.
+
+        Args:
+            message_id: ID del mensaje de WhatsApp
+        """
+        await self._seen_messages.delete_one({"_id": message_id})
+
+    async def close(self):
+        """Cierra la conexión con MongoDB"""
+        if self.client:
+            self.client.close()
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from models.invoice import Invoice
+from .base import StorageProvider
+
+# Callback por factura: recibe el número de factura y la excepción (None si se guardó)
+SaveCallback = Callable[[str, Optional[Exception]], None]
+
+
+class WriteBehindStorageProvider(StorageProvider):
+    """
+    Proveedor que acumula las facturas en memoria y las escribe en lote.
+
+    Envuelve otro proveedor y agrupa los guardados en llamadas a save_invoices()
+    (un bulk_write no ordenado en MongoDB). El lote se escribe al llegar a
+    `max_batch_size` facturas o `flush_interval` segundos después de la primera,
+    lo que ocurra antes, y siempre al cerrar el proveedor.
+
+    Si la misma factura se guarda varias veces antes de escribirse, solo se
+    escribe la última versión. Las lecturas ven las facturas pendientes.
+    """
+
+    def __init__(
+        self,
+        storage_provider: StorageProvider,
+        max_batch_size: int = 100,
+        flush_interval: float = 0.5
+    ):
+        if max_batch_size < 1:
+            raise ValueError("El tamaño del lote debe ser al menos 1")
+        self.storage_provider = storage_provider
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, Tuple[Invoice, List[Tuple[asyncio.Future, Optional[SaveCallback]]]]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+        self._closed = False
+        self._flushes = 0
+        self._written = 0
+        self._failed = 0
+        self._largest_batch = 0
+
+    def submit(self, invoice: Invoice, callback: Optional[SaveCallback] = None) -> asyncio.Future:
+        """
+        Añade una factura al lote sin esperar a que se escriba.
+
+        Args:
+            invoice: Factura a guardar
+            callback: Función llamada con (número de factura, excepción o None) tras escribirla
+
+        Returns:
+            asyncio.Future: Se resuelve con el ID guardado o con la excepción de escritura
+
+        Raises:
+            RuntimeError: Si el proveedor ya se cerró
+        """
+        if self._closed:
+            raise RuntimeError("WriteBehindStorageProvider cerrado")
+        future = asyncio.get_running_loop().create_future()
+        _, waiters = self._pending.pop(invoice.invoice_number, (None, []))
+        waiters.append((future, callback))
+        # Se reinserta al final para conservar el orden de llegada de la última versión
+        self._pending[invoice.invoice_number] = (invoice, waiters)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._spawn(self.flush())
+        elif self._timer is None:
+            self._timer = self._spawn(self._flush_later())
+        return future
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Escribe todas las facturas pendientes"""
+        async with self._flush_lock:
+            # Se toma el lote dentro del lock para que los lotes se escriban en orden
+            batch, self._pending = self._pending, {}
+            while batch:
+                numbers = list(batch)[:self.max_batch_size]
+                chunk = [batch.pop(number) for number in numbers]
+                await self._write(chunk)
+
+    async def _write(self, chunk: List[Tuple[Invoice, List[Tuple[asyncio.Future, Optional[SaveCallback]]]]]) -> None:
+        invoices = [invoice for invoice, _ in chunk]
+        try:
+            results: List[Union[str, Exception]] = await self.storage_provider.save_invoices(invoices)
+        except Exception as e:
+            results = [e] * len(invoices)
+
+        self._flushes += 1
+        self._largest_batch = max(self._largest_batch, len(invoices))
+        for (invoice, waiters), result in zip(chunk, results):
+            error = result if isinstance(result, Exception) else None
+            if error is None:
+                self._written += 1
+            else:
+                self._failed += 1
+                logging.error(f"WriteBehindStorageProvider: error guardando factura {invoice.invoice_number}: {str(error)}")
+            for future, callback in waiters:
+                if not future.done():
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+                        # El error ya se registró; evita el aviso si nadie espera el future
+                        future.exception()
+                if callback is not None:
+                    try:
+                        callback(invoice.invoice_number, error)
+                    except Exception as e:
+                        logging.error(f"WriteBehindStorageProvider: error en callback: {str(e)}")
+
+    async def save_invoice(self, invoice: Invoice) -> str:
+        """
+        Guarda una factura en el siguiente lote y espera a que se escriba.
+
+        Args:
+            invoice: Objeto Invoice a guardar
+
+        Returns:
+            str: ID de la factura guardada
+        """
+        return await self.submit(invoice)
+
+    async def save_invoices(self, invoices: List[Invoice]) -> List[Union[str, Exception]]:
+        """
+        Añade varias facturas al lote y espera a que se escriban.
+
+        Args:
+            invoices: Facturas a guardar
+
+        Returns:
+            List[Union[str, Exception]]: ID guardado o excepción de cada factura, en el mismo orden
+        """
+        futures = [self.submit(invoice) for invoice in invoices]
+        return list(await asyncio.gather(*futures, return_exceptions=True))
+
+    async def get_invoice(self, invoice_id: str) -> Optional[Invoice]:
+        """Recupera una factura, incluidas las pendientes de escribir"""
+        pending = self._pending.get(invoice_id)
+        if pending is not None:
+            return pending[0]
+        return await self.storage_provider.get_invoice(invoice_id)
+
+    async def list_invoices(
+        self,
+        vendor_name: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None
+    ) -> List[Invoice]:
+        """Lista facturas tras escribir las pendientes"""
+        await self.flush()
+        return await self.storage_provider.list_invoices(vendor_name, date_from, date_to)
+
+    async def delete_invoice(self, invoice_id: str) -> bool:
+        """Elimina una factura tras escribir las pendientes"""
+        await self.flush()
+        return await self.storage_provider.delete_invoice(invoice_id)
+
+    async def mark_message_seen(self, message_id: str, lease_seconds: Optional[float] = None) -> bool:
+        return await self.storage_provider.mark_message_seen(message_id, lease_seconds)
+
+    async def complete_message_seen(self, message_id: str) -> None:
+        await self.storage_provider.complete_message_seen(message_id)
+
+    async def forget_message_seen(self, message_id: str) -> None:
+        await self.storage_provider.forget_message_seen(message_id)
+
+    async def ensure_indexes(self) -> None:
+        """Crea los índices del proveedor envuelto, si los tiene"""
+        ensure_indexes = getattr(self.storage_provider, "ensure_indexes", None)
+        if ensure_indexes is not None:
+            await ensure_indexes()
+
+    async def close(self) -> None:
+        """Escribe las facturas pendientes y cierra el proveedor envuelto"""
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        close = getattr(self.storage_provider, "close", None)
+        if close is not None:
+            await close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve contadores de lotes y facturas escritas"""
+        return {
+            "buffered": len(self._pending),
+            "flushes": self._flushes,
+            "written": self._written,
+            "failed": self._failed,
+            "largest_batch": self._largest_batch,
+            "average_batch": (self._written + self._failed) / self._flushes if self._flushes else 0.0,
+        }
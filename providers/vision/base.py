@@ -1,5 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, Type
+
+from pydantic import BaseModel
+
+from .streaming import VisionStream
 
 class VisionProvider(ABC):
     """Interfaz base para proveedores de servicios de visión por computadora"""
@@ -26,6 +30,65 @@ class VisionProvider(ABC):
         """
         pass
     
+    def stream_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> VisionStream:
+        """
+        Procesa una imagen entregando el texto a medida que se genera.
+        
+        La implementación por defecto espera el resultado completo de
+        `process_image` y lo entrega en un solo fragmento.
+        
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Nombre del modelo a utilizar
+            api_key: Clave API del proveedor
+            kwargs: Argumentos adicionales específicos del proveedor
+            
+        Returns:
+            VisionStream: Stream de texto; se recorre con `async for`
+        """
+        stream = VisionStream(model=model_name, provider=self.__class__.__name__)
+        
+        async def source():
+            result = await self.process_image(image_data, model_name, api_key, **kwargs)
+            stream.details.update(
+                {key: value for key, value in result.items() if key != "extracted_text"}
+            )
+            yield result.get("extracted_text", "")
+        
+        stream.source = source()
+        return stream
+    
+    async def extract_structured(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        output_type: Type[BaseModel],
+        **kwargs: Dict[str, Any]
+    ) -> dict:
+        """
+        Extrae datos de una imagen directamente a un modelo de pydantic, sin pasar por texto.
+        
+        Solo lo implementan los proveedores con salidas estructuradas.
+        
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Nombre del modelo a utilizar
+            api_key: Clave API del proveedor
+            output_type: Modelo de pydantic de la respuesta
+            kwargs: Argumentos adicionales específicos del proveedor
+            
+        Returns:
+            dict: "data" con la instancia de `output_type` y metadatos adicionales
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} no admite extracción estructurada")
+    
     @abstractmethod
     async def validate_api_key(self, api_key: str) -> bool:
         """
@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from providers.cache import LRUTTLCache
+from .base import VisionProvider
+from .streaming import VisionStream
+
+
+class SqliteResultCache:
+    """
+    Caché persistente de resultados en un archivo SQLite.
+
+    Sobrevive a reinicios del proceso. Como la cola de trabajos, todo el acceso a
+    SQLite se hace en un hilo con asyncio.to_thread para no bloquear el event loop.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None):
+        self.path = path
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        """Abre la base de datos y crea la tabla si no existe"""
+        if self._conn is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            )
+            """
+        )
+
+    def close(self) -> None:
+        """Cierra la base de datos"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM results WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, key: str, value: Dict[str, Any]) -> None:
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+
+    def _purge(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM results WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            )
+        return cursor.rowcount
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Devuelve el resultado guardado o None si no existe o expiró"""
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Guarda un resultado serializable en JSON"""
+        await asyncio.to_thread(self._set, key, value)
+
+    async def purge(self) -> int:
+        """Elimina los resultados expirados y devuelve cuántos se borraron"""
+        return await asyncio.to_thread(self._purge)
+
+
+class CachingVisionProvider(VisionProvider):
+    """
+    Caché direccionada por contenido delante de un proveedor de visión.
+
+    La clave es el SHA-256 de los bytes de la imagen más el modelo y la versión
+    del prompt, así que reenvíos y reenvíos de WhatsApp con la misma imagen no
+    vuelven a llamar al modelo. Tiene un nivel en memoria (LRU con TTL) y un nivel
+    opcional en disco que sobrevive a reinicios. Las solicitudes simultáneas de la
+    misma imagen comparten una sola llamada. Los resultados con error no se guardan.
+    """
+
+    def __init__(
+        self,
+        vision_provider: VisionProvider,
+        max_size: int = 1000,
+        ttl: Optional[float] = 7 * 24 * 3600,
+        disk_cache: Optional[SqliteResultCache] = None
+    ):
+        self.vision_provider = vision_provider
+        self.disk_cache = disk_cache
+        self._memory = LRUTTLCache(max_size=max_size, ttl=ttl)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._shared = 0
+        self._misses = 0
+        self._bytes_saved = 0
+        self._tokens_saved = 0
+
+    def cache_key(self, image_data: bytes, model_name: str, **kwargs: Any) -> str:
+        """
+        Clave de caché de una imagen.
+
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Nombre del modelo
+            kwargs: Argumentos adicionales que cambian el resultado
+
+        Returns:
+            str: Clave con modelo, versión del prompt y hash del contenido
+        """
+        prompt_version = getattr(self.vision_provider, "prompt_version", "1")
+        digest = hashlib.sha256(image_data)
+        if kwargs:
+            digest.update(json.dumps(kwargs, sort_keys=True, default=str).encode())
+        return f"{model_name}:{prompt_version}:{digest.hexdigest()}"
+
+    async def process_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> dict:
+        """
+        Procesa una imagen, devolviendo el resultado guardado si la imagen ya se procesó.
+
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Nombre del modelo
+            api_key: Clave API del proveedor (no forma parte de la clave)
+            kwargs: Argumentos adicionales para el proveedor
+
+        Returns:
+            dict: Resultado del proveedor, con "cached": True si vino de la caché
+        """
+        key = self.cache_key(image_data, model_name, **kwargs)
+
+        result = self._memory.get(key)
+        if result is not None:
+            self._memory_hits += 1
+            return self._hit(result, len(image_data))
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self._shared += 1
+            return self._hit(await asyncio.shield(in_flight), len(image_data))
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._load(key, image_data, model_name, api_key, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Evita el aviso de excepción no recuperada si nadie más esperaba
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def stream_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> VisionStream:
+        """
+        Procesa una imagen en streaming. Un acierto se entrega en un solo
+        fragmento; un fallo transmite la respuesta del proveedor y la guarda al terminar.
+        
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Nombre del modelo
+            api_key: Clave API del proveedor (no forma parte de la clave)
+            kwargs: Argumentos adicionales para el proveedor
+            
+        Returns:
+            VisionStream: Stream de texto, con "cached": True en `details` si vino de la caché
+        """
+        key = self.cache_key(image_data, model_name, **kwargs)
+        stream = VisionStream(model=model_name, provider=self.vision_provider.__class__.__name__)
+        stream.source = self._stream(stream, key, image_data, model_name, api_key, **kwargs)
+        return stream
+    
+    async def _stream(
+        self,
+        stream: VisionStream,
+        key: str,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Any
+    ):
+        result = self._memory.get(key)
+        if result is not None:
+            self._memory_hits += 1
+        elif self.disk_cache is not None:
+            try:
+                result = await self.disk_cache.get(key)
+            except Exception as e:
+                logging.error(f"CachingVisionProvider: error leyendo la caché en disco: {str(e)}")
+            if result is not None:
+                self._disk_hits += 1
+                self._memory.set(key, result)
+        if result is not None:
+            hit = self._hit(result, len(image_data))
+            stream.details.update({k: v for k, v in hit.items() if k != "extracted_text"})
+            yield hit["extracted_text"]
+            return
+        
+        self._misses += 1
+        inner = self.vision_provider.stream_image(image_data, model_name, api_key, **kwargs)
+        async for chunk in inner:
+            yield chunk
+        stream.provider = inner.provider
+        stream.details.update(inner.details)
+        result = {k: v for k, v in inner.result().items() if k != "timings"}
+        if not result.get("error"):
+            self._memory.set(key, result)
+            if self.disk_cache is not None:
+                try:
+                    await self.disk_cache.set(key, result)
+                except Exception as e:
+                    logging.error(f"CachingVisionProvider: error escribiendo la caché en disco: {str(e)}")
+    
+    async def _load(self, key: str, image_data: bytes, model_name: str, api_key: str, **kwargs: Any) -> dict:
+        if self.disk_cache is not None:
+            try:
+                result = await self.disk_cache.get(key)
+            except Exception as e:
+                logging.error(f"CachingVisionProvider: error leyendo la caché en disco: {str(e)}")
+                result = None
+            if result is not None:
+                self._disk_hits += 1
+                self._memory.set(key, result)
+                return self._hit(result, len(image_data))
+
+        self._misses += 1
+        result = await self.vision_provider.process_image(
+            image_data=image_data,
+            model_name=model_name,
+            api_key=api_key,
+            **kwargs
+        )
+        if not result.get("error"):
+            self._memory.set(key, result)
+            if self.disk_cache is not None:
+                try:
+                    await self.disk_cache.set(key, result)
+                except Exception as e:
+                    logging.error(f"CachingVisionProvider: error escribiendo la caché en disco: {str(e)}")
+        return result
+
+    def _hit(self, result: dict, image_bytes: int) -> dict:
+        self._bytes_saved += image_bytes
+        self._tokens_saved += result.get("usage", {}).get("total_tokens", 0)
+        return {**result, "cached": True}
+
+    async def validate_api_key(self, api_key: str) -> bool:
+        return await self.vision_provider.validate_api_key(api_key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve aciertos por nivel, ratio de aciertos y bytes/tokens ahorrados"""
+        hits = self._memory_hits + self._disk_hits + self._shared
+        total = hits + self._misses
+        return {
+            "hits": hits,
+            "memory_hits": self._memory_hits,
+            "disk_hits": self._disk_hits,
+            "shared_in_flight": self._shared,
+            "misses": self._misses,
+            "hit_ratio": hits / total if total else 0.0,
+            "bytes_saved": self._bytes_saved,
+            "tokens_saved": self._tokens_saved,
+            "cached_results": len(self._memory),
+        }
@@ -0,0 +1,166 @@
+import math
+from dataclasses import dataclass
+from typing import Dict, Tuple, Type
+
+# Modelo de costo de imágenes de OpenAI. En detail="high" la imagen se ajusta a
+# 2048x2048, luego su lado corto a 768 px, y se cuenta en teselas de 512 px.
+# En detail="low" el modelo ve una versión de 512x512 por un costo fijo.
+BASE_TOKENS = 85
+TOKENS_PER_TILE = 170
+TILE_SIZE = 512
+MAX_DIMENSION = 2048
+SHORT_SIDE = 768
+LOW_DETAIL_SIZE = 512
+
+DETAIL_LEVELS = ("high", "low")
+
+
+def scaled_dimensions(width: int, height: int) -> Tuple[int, int]:
+    """
+    Dimensiones con las que el modelo ve la imagen en detalle alto.
+
+    Args:
+        width: Ancho original en píxeles
+        height: Alto original en píxeles
+
+    Returns:
+        Tuple[int, int]: Ancho y alto tras el reescalado de la API
+    """
+    if width <= 0 or height <= 0:
+        raise ValueError("Las dimensiones de la imagen deben ser positivas")
+    scale = min(1.0, MAX_DIMENSION / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, SHORT_SIDE / min(width, height))
+    return int(width * scale), int(height * scale)
+
+
+def tile_grid(width: int, height: int) -> Tuple[int, int]:
+    """Columnas y filas de teselas de 512 px que cubren la imagen en detalle alto"""
+    width, height = scaled_dimensions(width, height)
+    return math.ceil(width / TILE_SIZE), math.ceil(height / TILE_SIZE)
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """
+    Estima los tokens de entrada de una imagen.
+
+    Args:
+        width: Ancho en píxeles
+        height: Alto en píxeles
+        detail: Nivel de detalle solicitado a la API ("high" o "low")
+
+    Returns:
+        int: Tokens estimados
+    """
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(f"Nivel de detalle no válido: {detail}")
+    if detail == "low":
+        return BASE_TOKENS
+    columns, rows = tile_grid(width, height)
+    return BASE_TOKENS + TOKENS_PER_TILE * columns * rows
+
+
+@dataclass(frozen=True)
+class SizingPlan:
+    """Dimensiones y nivel de detalle con los que se enviará una imagen"""
+    width: int
+    height: int
+    detail: str = "high"
+
+    @property
+    def tokens(self) -> int:
+        return estimate_image_tokens(self.width, self.height, self.detail)
+
+
+@dataclass(frozen=True)
+class ImageSizingPolicy:
+    """
+    Política de tamaño de las imágenes enviadas al modelo de visión.
+
+    La política base no cambia el tamaño: la API reescala la imagen por su cuenta.
+    """
+    name = "none"
+
+    def plan(self, width: int, height: int) -> SizingPlan:
+        """
+        Decide las dimensiones y el detalle de una imagen.
+
+        Args:
+            width: Ancho actual en píxeles
+            height: Alto actual en píxeles
+
+        Returns:
+            SizingPlan: Dimensiones (nunca mayores que las actuales) y detalle
+        """
+        return SizingPlan(width, height)
+
+
+@dataclass(frozen=True)
+class FitSizingPolicy(ImageSizingPolicy):
+    """Reduce la imagen a la resolución que el modelo ve en detalle alto: mismos tokens, menos bytes"""
+    name = "fit"
+
+    def plan(self, width: int, height: int) -> SizingPlan:
+        return SizingPlan(*scaled_dimensions(width, height))
+
+
+@dataclass(frozen=True)
+class MinTilesSizingPolicy(ImageSizingPolicy):
+    """
+    Reduce la imagen hasta el menor número de teselas que mantiene el texto legible.
+
+    Parte de la resolución que ve el modelo y elige la rejilla de teselas más
+    pequeña en la que cabe sin que el lado corto baje de `min_short_side` píxeles.
+    """
+    name = "min_tiles"
+    min_short_side: int = 512
+
+    def plan(self, width: int, height: int) -> SizingPlan:
+        width, height = scaled_dimensions(width, height)
+        best = SizingPlan(width, height)
+        best_tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+        # Para cada rejilla de teselas menor, la mayor escala que cabe en ella
+        for columns in range(1, math.ceil(width / TILE_SIZE) + 1):
+            for rows in range(1, math.ceil(height / TILE_SIZE) + 1):
+                scale = min(1.0, TILE_SIZE * columns / width, TILE_SIZE * rows / height)
+                candidate = SizingPlan(int(width * scale), int(height * scale))
+                if min(candidate.width, candidate.height) < self.min_short_side:
+                    continue
+                tiles = columns * rows
+                if tiles < best_tiles or (tiles == best_tiles and candidate.width > best.width):
+                    best, best_tiles = candidate, tiles
+        return best
+
+
+@dataclass(frozen=True)
+class LowDetailSizingPolicy(ImageSizingPolicy):
+    """Envía la imagen en detail="low" (costo fijo); solo para textos grandes o imágenes pequeñas"""
+    name = "low"
+
+    def plan(self, width: int, height: int) -> SizingPlan:
+        scale = min(1.0, LOW_DETAIL_SIZE / max(width, height))
+        return SizingPlan(max(1, int(width * scale)), max(1, int(height * scale)), "low")
+
+
+SIZING_POLICIES: Dict[str, Type[ImageSizingPolicy]] = {
+    policy.name: policy
+    for policy in (ImageSizingPolicy, FitSizingPolicy, MinTilesSizingPolicy, LowDetailSizingPolicy)
+}
+
+
+def get_sizing_policy(name: str, **options) -> ImageSizingPolicy:
+    """
+    Crea una política de tamaño por nombre.
+
+    Args:
+        name: "none", "fit", "min_tiles" o "low"
+        options: Opciones de la política (ej: min_short_side para "min_tiles")
+
+    Returns:
+        ImageSizingPolicy: Política configurada
+    """
+    if name not in SIZING_POLICIES:
+        raise ValueError(f"Política de tamaño no válida: {name}")
+    policy_class = SIZING_POLICIES[name]
+    fields = getattr(policy_class, "__dataclass_fields__", {})
+    return policy_class(**{key: value for key, value in options.items() if key in fields})
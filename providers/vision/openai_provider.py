@@ -1,13 +1,121 @@
+import asyncio
 import base64
-from typing import Dict, Any
+import json
+from typing import Dict, Any, AsyncIterator, Optional, Type
 import aiohttp
+from pydantic import BaseModel
 from .base import VisionProvider
+from .image_tokens import estimate_image_tokens
+from .preprocessing import ImagePreprocessor, PreprocessedImage, detect_image_format
+from .streaming import VisionStream
+from providers.http import HttpClientRegistry, get_http_clients
+from providers.rate_limit import RateLimiter, RateLimitRegistry, estimate_text_tokens, get_rate_limits
+from providers.resilience import (
+    ProviderError,
+    ResilienceRegistry,
+    error_from_exception,
+    get_resilience,
+    origin_of,
+    raise_for_response
+)
+
+TEXT_EXTRACTION_PROMPT = (
+    "Esta es una imagen de una factura. Por favor, extrae toda la información relevante incluyendo: "
+    "número de factura, fecha, vendedor, items, montos y cualquier otro dato importante. "
+    "Devuelve la información en un formato estructurado."
+)
+
+STRUCTURED_EXTRACTION_PROMPT = (
+    "Esta es una imagen de una factura. Extrae sus datos con el esquema indicado: número de factura, "
+    "fecha, vendedor y su identificación fiscal, ítems con cantidad, precio unitario y total, impuestos, "
+    "monto total y moneda (código ISO 4217). Usa exactamente los valores impresos, sin inventar datos."
+)
+
+# Palabras clave de JSON Schema que el modo estricto de OpenAI no admite
+_UNSUPPORTED_SCHEMA_KEYS = ("default", "title", "example", "examples")
+
+
+def strict_json_schema(model: Type[BaseModel]) -> dict:
+    """
+    Convierte el esquema de un modelo de pydantic al subconjunto del modo estricto de OpenAI.
+
+    En modo estricto todas las propiedades son obligatorias (los campos
+    opcionales ya admiten null en el esquema de pydantic) y ningún objeto admite
+    propiedades adicionales.
+
+    Args:
+        model: Modelo de pydantic
+
+    Returns:
+        dict: Esquema JSON para `response_format`
+    """
+    def convert(node):
+        if isinstance(node, list):
+            return [convert(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+        converted = {
+            key: (value if key == "properties" else convert(value))
+            for key, value in node.items()
+            if key not in _UNSUPPORTED_SCHEMA_KEYS
+        }
+        if "properties" in converted:
+            converted["properties"] = {name: convert(value) for name, value in node["properties"].items()}
+            converted["required"] = list(converted["properties"])
+            converted["additionalProperties"] = False
+        return converted
+
+    return convert(model.model_json_schema())
+
 
 class OpenAIVisionProvider(VisionProvider):
     """Implementación del proveedor de visión usando OpenAI"""
     
-    def __init__(self):
-        self.api_base = "https://api.openai.com/v1"
+    # Cambiar al modificar el prompt: invalida los resultados guardados en caché
+    prompt_version = "1"
+    
+    def __init__(
+        self,
+        http_clients: Optional[HttpClientRegistry] = None,
+        preprocessor: Optional[ImagePreprocessor] = None,
+        resilience: Optional[ResilienceRegistry] = None,
+        rate_limits: Optional[RateLimitRegistry] = None,
+        api_base: str = "https://api.openai.com/v1"
+    ):
+        """
+        Args:
+            http_clients: Registro de sesiones HTTP; por defecto el compartido del proceso
+            preprocessor: Etapa de preprocesamiento de la imagen; sin ella se envían los bytes originales
+            resilience: Reintentos y circuitos por host; por defecto el registro del proceso
+            rate_limits: Limitadores RPM/TPM por modelo; por defecto el registro del proceso (si existe)
+            api_base: URL base de la API compatible con OpenAI
+        """
+        self.api_base = api_base
+        self.http_clients = http_clients
+        self.preprocessor = preprocessor
+        self.resilience = resilience
+        self.rate_limits = rate_limits
+    
+    def _session(self) -> aiohttp.ClientSession:
+        """Sesión con keep-alive hacia la API de OpenAI"""
+        return (self.http_clients or get_http_clients()).session(self.api_base)
+    
+    def _resilience(self) -> ResilienceRegistry:
+        return self.resilience or get_resilience()
+    
+    def _rate_limiter(self, model_name: str) -> Optional[RateLimiter]:
+        registry = self.rate_limits or get_rate_limits()
+        return registry.limiter(model_name) if registry is not None else None
+    
+    @staticmethod
+    def _estimate_tokens(image: PreprocessedImage, messages: list, max_tokens: int) -> int:
+        """Tokens que OpenAI cargará a la llamada: imagen, texto del prompt y salida máxima"""
+        # Sin dimensiones conocidas se asume el peor caso habitual (6 teselas)
+        image_tokens = image.tokens_after or estimate_image_tokens(2048, 1024)
+        text = "".join(
+            part.get("text", "") for message in messages for part in message["content"]
+        )
+        return image_tokens + estimate_text_tokens(text) + max_tokens
         
     async def process_image(
         self,
@@ -27,34 +135,15 @@ class OpenAIVisionProvider(VisionProvider):
             
         Returns:
             dict: Resultado del procesamiento de la imagen
+            
+        Raises:
+            ProviderError: Si la API falla tras los reintentos o el circuito de OpenAI está abierto
         """
-        # Codificar la imagen en base64
-        base64_image = base64.b64encode(image_data).decode('utf-8')
+        # Corregir orientación, reducir y recomprimir antes de codificar
+        image = await self._preprocess(image_data)
         
-        # Preparar el mensaje para la API
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "Esta es una imagen de una factura. Por favor, extrae toda la información relevante incluyendo: número de factura, fecha, vendedor, items, montos y cualquier otro dato importante. Devuelve la información en un formato estructurado."
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }
-                    }
-                ]
-            }
-        ]
-        
-        # Preparar la solicitud a la API
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
+        messages = self._build_messages(image)
+        headers = self._headers(api_key)
         
         # Imprimir información detallada para depuración
         print(f"OpenAIVisionProvider: Procesando con modelo: {model_name}")
@@ -64,8 +153,12 @@ class OpenAIVisionProvider(VisionProvider):
         import uuid
         request_id = str(uuid.uuid4())[:8]
         print(f"OpenAIVisionProvider [{request_id}]: Iniciando petición con modelo {model_name}")
-        print(f"OpenAIVisionProvider [{request_id}]: Tamaño de imagen: {len(base64_image)//1024}KB")
-        print(f"OpenAIVisionProvider [{request_id}]: Tokens estimados para imagen: ~{len(base64_image)//100} tokens")
+        print(
+            f"OpenAIVisionProvider [{request_id}]: Imagen {image.mime_type}: "
+            f"{image.original_bytes//1024}KB -> {image.processed_bytes//1024}KB, "
+            f"tokens estimados: {image.tokens_before} -> {image.tokens_after} (detail={image.detail}) "
+            f"({', '.join(image.operations) or 'sin cambios'})"
+        )
         
         # Guardar info de tiempo para detectar timeouts o loops
         import time
@@ -77,64 +170,314 @@ class OpenAIVisionProvider(VisionProvider):
             "max_tokens": 1000
         }
         
-        # Configurar timeout para evitar peticiones que se queden colgadas
+        # Configurar timeout para evitar peticiones que se queden colgadas (reemplaza el de la sesión)
         timeout = aiohttp.ClientTimeout(total=30)  # 30 segundos máximo
         
         try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                try:
-                    async with session.post(
-                        f"{self.api_base}/chat/completions",
-                        headers=headers,
-                        json=payload
-                    ) as response:
-                        # Medir tiempo de respuesta
-                        response_time = time.time() - start_time
-                        print(f"OpenAIVisionProvider [{request_id}]: Respuesta recibida en {response_time:.2f} segundos")
-                        
-                        # Procesar respuesta o error
-                        if response.status != 200:
-                            error_text = await response.text()
-                            print(f"OpenAIVisionProvider [{request_id}]: ERROR - Status {response.status}, Respuesta: {error_text}")
-                            raise Exception(f"Error en la API de OpenAI: {error_text}")
-                        
-                        result = await response.json()
-                        
-                        # Logs de uso para monitorear tokens y costos
-                        if "usage" in result:
-                            tokens_in = result["usage"].get("prompt_tokens", 0)
-                            tokens_out = result["usage"].get("completion_tokens", 0)
-                            total_tokens = result["usage"].get("total_tokens", 0)
-                            print(f"OpenAIVisionProvider [{request_id}]: Uso de tokens - Entrada: {tokens_in}, Salida: {tokens_out}, Total: {total_tokens}")
-                        
-                        # Extracto de la respuesta para verificar que es válida
-                        text_response = result["choices"][0]["message"]["content"]
-                        print(f"OpenAIVisionProvider [{request_id}]: Respuesta exitosa, longitud: {len(text_response)} caracteres")
-                        print(f"OpenAIVisionProvider [{request_id}]: Primeros 100 caracteres: {text_response[:100]}...")
-                        
-                        return {
-                            "extracted_text": text_response,
-                            "model": model_name,
-                            "provider": "openai",
-                            "usage": result.get("usage", {})
+            result = await self._complete(payload, headers, image, timeout, request_id)
+        except ProviderError as e:
+            # Se lanza en lugar de devolver el texto del error: así no llega al agente de extracción
+            print(f"OpenAIVisionProvider [{request_id}]: ERROR - {e.__class__.__name__}: {str(e)}")
+            raise
+        print(f"OpenAIVisionProvider [{request_id}]: Respuesta en {time.time() - start_time:.2f} segundos")
+        
+        # Logs de uso para monitorear tokens y costos
+        if "usage" in result:
+            tokens_in = result["usage"].get("prompt_tokens", 0)
+            tokens_out = result["usage"].get("completion_tokens", 0)
+            total_tokens = result["usage"].get("total_tokens", 0)
+            print(f"OpenAIVisionProvider [{request_id}]: Uso de tokens - Entrada: {tokens_in}, Salida: {tokens_out}, Total: {total_tokens}")
+        
+        # Extracto de la respuesta para verificar que es válida
+        text_response = result["choices"][0]["message"]["content"]
+        print(f"OpenAIVisionProvider [{request_id}]: Respuesta exitosa, longitud: {len(text_response)} caracteres")
+        print(f"OpenAIVisionProvider [{request_id}]: Primeros 100 caracteres: {text_response[:100]}...")
+        
+        return {
+            "extracted_text": text_response,
+            "model": model_name,
+            "provider": "openai",
+            "usage": result.get("usage", {}),
+            "preprocessing": image.report()
+        }
+    
+    async def extract_structured(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        output_type: Type[BaseModel],
+        **kwargs: Dict[str, Any]
+    ) -> dict:
+        """
+        Extrae datos de una imagen directamente a un modelo de pydantic en una sola llamada.
+        
+        Usa salidas estructuradas (`response_format` con esquema JSON estricto), así
+        que la respuesta del modelo se ajusta al esquema y se valida con pydantic.
+        
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Nombre del modelo (debe admitir salidas estructuradas, ej: "gpt-4o")
+            api_key: Clave API de OpenAI
+            output_type: Modelo de pydantic de la respuesta
+            kwargs: Argumentos adicionales
+            
+        Returns:
+            dict: "data" con la instancia de `output_type`, más "model", "provider", "usage" y "preprocessing"
+            
+        Raises:
+            ProviderError: Si la API falla tras los reintentos o el modelo se niega a responder
+            pydantic.ValidationError: Si la respuesta no cumple las validaciones del modelo
+        """
+        import time
+        import uuid
+        request_id = str(uuid.uuid4())[:8]
+        start_time = time.time()
+        
+        image = await self._preprocess(image_data)
+        payload = {
+            "model": model_name,
+            "messages": self._build_messages(image, STRUCTURED_EXTRACTION_PROMPT),
+            "max_tokens": 2000,
+            "temperature": 0,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": output_type.__name__,
+                    "schema": strict_json_schema(output_type),
+                    "strict": True
+                }
+            }
+        }
+        print(f"OpenAIVisionProvider [{request_id}]: Extracción estructurada ({output_type.__name__}) con modelo {model_name}")
+        
+        try:
+            result = await self._complete(
+                payload,
+                self._headers(api_key),
+                image,
+                aiohttp.ClientTimeout(total=60),
+                request_id
+            )
+        except ProviderError as e:
+            print(f"OpenAIVisionProvider [{request_id}]: ERROR - {e.__class__.__name__}: {str(e)}")
+            raise
+        
+        message = result["choices"][0]["message"]
+        if message.get("refusal"):
+            raise ProviderError(f"El modelo se negó a extraer los datos: {message['refusal']}", origin=origin_of(self.api_base))
+        data = output_type.model_validate_json(message["content"])
+        print(
+            f"OpenAIVisionProvider [{request_id}]: Extracción estructurada en {time.time() - start_time:.2f} segundos, "
+            f"tokens: {result.get('usage', {}).get('total_tokens', 0)}"
+        )
+        
+        return {
+            "data": data,
+            "model": model_name,
+            "provider": "openai",
+            "usage": result.get("usage", {}),
+            "preprocessing": image.report()
+        }
+    
+    def stream_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> VisionStream:
+        """
+        Procesa una imagen con `stream=True`, entregando el texto a medida que llega.
+        
+        Los errores se lanzan como ProviderError al recorrer el stream; solo se
+        reintenta mientras no haya llegado texto.
+        
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Nombre del modelo
+            api_key: Clave API de OpenAI
+            kwargs: Argumentos adicionales
+            
+        Returns:
+            VisionStream: Stream de texto con TTFT y tiempo total medidos
+        """
+        stream = VisionStream(model=model_name, provider="openai")
+        stream.source = self._stream_completion(stream, image_data, model_name, api_key)
+        return stream
+    
+    async def _stream_completion(
+        self,
+        stream: VisionStream,
+        image_data: bytes,
+        model_name: str,
+        api_key: str
+    ) -> AsyncIterator[str]:
+        """Lee los eventos server-sent de la API y entrega el contenido de cada delta"""
+        image = await self._preprocess(image_data)
+        stream.details["preprocessing"] = image.report()
+        payload = {
+            "model": model_name,
+            "messages": self._build_messages(image),
+            "max_tokens": 1000,
+            "stream": True,
+            # El último evento trae el uso de tokens
+            "stream_options": {"include_usage": True}
+        }
+        # sock_read limita la espera entre fragmentos, no la duración total de la respuesta
+        timeout = aiohttp.ClientTimeout(total=60, sock_read=30)
+        
+        limiter = self._rate_limiter(model_name)
+        estimated_tokens = self._estimate_tokens(image, payload["messages"], payload["max_tokens"])
+        reservation = None
+        
+        async def connect() -> aiohttp.ClientResponse:
+            nonlocal reservation
+            reservation = await limiter.acquire(estimated_tokens) if limiter else None
+            try:
+                response = await self._session().post(
+                    f"{self.api_base}/chat/completions",
+                    headers=self._headers(api_key),
+                    json=payload,
+                    timeout=timeout
+                )
+            except BaseException:
+                if reservation:
+                    await limiter.reconcile(reservation, 0)
+                raise
+            try:
+                if limiter:
+                    await limiter.update_from_headers(response.headers)
+                await raise_for_response(response)
+            except BaseException:
+                response.release()
+                if reservation:
+                    await limiter.reconcile(reservation, 0)
+                raise
+            return response
+        
+        # Solo se reintenta el establecimiento de la respuesta: una vez que llega
+        # texto, repetir la llamada duplicaría lo ya entregado
+        response = await self._resilience().call(self.api_base, connect)
+        try:
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                event = json.loads(data)
+                if event.get("usage"):
+                    stream.details["usage"] = event["usage"]
+                for choice in event.get("choices", []):
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        yield content
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise error_from_exception(e, origin_of(self.api_base))
+        finally:
+            response.release()
+            if reservation:
+                await limiter.reconcile(reservation, stream.details.get("usage", {}).get("total_tokens"))
+        
+        print(
+            f"OpenAIVisionProvider: Stream terminado con modelo {model_name}, "
+            f"primer token en {stream.time_to_first_token or 0:.2f}s, "
+            f"tokens: {stream.details.get('usage', {}).get('total_tokens', 0)}"
+        )
+    
+    async def _complete(
+        self,
+        payload: dict,
+        headers: dict,
+        image: PreprocessedImage,
+        timeout: aiohttp.ClientTimeout,
+        request_id: str
+    ) -> dict:
+        """
+        Envía una solicitud de chat completions con reintentos, circuito por host y limitador RPM/TPM.
+        
+        Returns:
+            dict: Respuesta JSON de la API
+            
+        Raises:
+            ProviderError: Si la API falla tras los reintentos o el circuito de OpenAI está abierto
+        """
+        # Cada intento espera turno en el limitador RPM/TPM del modelo en lugar de provocar un 429
+        limiter = self._rate_limiter(payload["model"])
+        estimated_tokens = self._estimate_tokens(image, payload["messages"], payload["max_tokens"])
+        
+        async def attempt() -> dict:
+            reservation = await limiter.acquire(estimated_tokens) if limiter else None
+            try:
+                async with self._session().post(
+                    f"{self.api_base}/chat/completions",
+                    headers=headers,
+                    json=payload,
+                    timeout=timeout
+                ) as response:
+                    print(f"OpenAIVisionProvider [{request_id}]: Respuesta {response.status}")
+                    if limiter:
+                        await limiter.update_from_headers(response.headers)
+                    # 429 y 5xx se reintentan con backoff; el resto de errores se lanza tipado
+                    await raise_for_response(response)
+                    result = await response.json()
+            except BaseException:
+                if reservation:
+                    await limiter.reconcile(reservation, 0)
+                raise
+            if reservation:
+                await limiter.reconcile(reservation, result.get("usage", {}).get("total_tokens"))
+            return result
+        
+        return await self._resilience().call(self.api_base, attempt)
+    
+    def _build_messages(self, image: PreprocessedImage, prompt: str = TEXT_EXTRACTION_PROMPT) -> list:
+        """Mensajes de chat con el prompt y la imagen codificada en base64"""
+        # Codificar la imagen en base64
+        base64_image = base64.b64encode(image.data).decode('utf-8')
+        
+        # Preparar el mensaje para la API
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{image.mime_type};base64,{base64_image}",
+                            "detail": image.detail
                         }
-                        
-                except aiohttp.ClientError as e:
-                    error_msg = f"Error de conexión con OpenAI: {str(e)}"
-                    print(f"OpenAIVisionProvider [{request_id}]: ERROR - {error_msg}")
-                    raise Exception(error_msg)
-                    
-        except Exception as e:
-            # Capturar cualquier excepción para evitar loops infinitos
-            print(f"OpenAIVisionProvider [{request_id}]: ERROR FATAL - {str(e)}")
-            # Devolver un resultado de error para evitar que el sistema se cuelgue
-            return {
-                "extracted_text": f"Error procesando la imagen: {str(e)}",
-                "model": model_name,
-                "provider": "openai",
-                "usage": {},
-                "error": True
+                    }
+                ]
             }
+        ]
+        
+        return messages
+    
+    def _headers(self, api_key: str) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+    
+    async def _preprocess(self, image_data: bytes) -> PreprocessedImage:
+        """Preprocesa la imagen; ante cualquier fallo se envían los bytes originales"""
+        if self.preprocessor is not None:
+            try:
+                return await self.preprocessor.process(image_data)
+            except Exception as e:
+                print(f"OpenAIVisionProvider: error preprocesando la imagen, se envía la original: {str(e)}")
+        return PreprocessedImage(
+            data=image_data,
+            mime_type=detect_image_format(image_data) or "image/jpeg",
+            original_bytes=len(image_data)
+        )
     
     async def validate_api_key(self, api_key: str) -> bool:
         """
@@ -150,9 +493,8 @@ class OpenAIVisionProvider(VisionProvider):
             "Authorization": f"Bearer {api_key}"
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.api_base}/models",
-                headers=headers
-            ) as response:
-                return response.status == 200
+        async with self._session().get(
+            f"{self.api_base}/models",
+            headers=headers
+        ) as response:
+            return response.status == 200
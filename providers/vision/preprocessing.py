@@ -0,0 +1,332 @@
+import asyncio
+import hashlib
+import io
+import logging
+from collections import OrderedDict
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from .image_tokens import ImageSizingPolicy, estimate_image_tokens
+
+try:
+    from PIL import Image, ImageOps, ImageStat
+except ImportError:  # Pillow es opcional: sin él las imágenes se envían sin cambios
+    Image = None
+
+# Firmas de los formatos que puede enviar WhatsApp
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+GRAYSCALE_MODES = ("auto", "always", "never")
+
+# Lado de la rejilla del dHash: 16 da un hash de 256 bits. Con 8 (64 bits) las
+# facturas de una misma plantilla quedan demasiado cerca entre sí
+# (ver benchmarks/near_duplicates.py)
+DHASH_SIZE = 16
+
+
+def detect_image_format(data: bytes) -> Optional[str]:
+    """
+    Detecta el tipo MIME real de una imagen por sus bytes iniciales.
+
+    Args:
+        data: Datos binarios de la imagen
+
+    Returns:
+        Optional[str]: Tipo MIME, o None si el formato no se reconoce
+    """
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image/heic"
+    return None
+
+
+def dhash(image, hash_size: int = DHASH_SIZE) -> int:
+    """
+    Hash perceptual por diferencias (dHash) de una imagen de Pillow.
+
+    Compara el brillo de píxeles vecinos en una miniatura en grises de
+    (hash_size + 1) x hash_size; es estable ante recompresión, cambios de tamaño
+    y pequeños cambios de brillo, como los que introduce un reenvío de WhatsApp.
+
+    Args:
+        image: Imagen de Pillow (ya orientada)
+        hash_size: Lado de la rejilla; el hash tiene hash_size² bits
+
+    Returns:
+        int: Hash de hash_size² bits
+    """
+    pixels = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            offset = row * (hash_size + 1) + column
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def image_dhash(data: bytes) -> Optional[int]:
+    """
+    Calcula el dHash de una imagen a partir de sus bytes. Es síncrono.
+
+    Args:
+        data: Datos binarios de la imagen
+
+    Returns:
+        Optional[int]: Hash de DHASH_SIZE² bits, o None si Pillow no está instalado o la imagen no se puede abrir
+    """
+    if Image is None:
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+        # En JPEG decodifica directamente a baja resolución: mucho más rápido
+        image.draft("L", (DHASH_SIZE * 8, DHASH_SIZE * 8))
+        return dhash(ImageOps.exif_transpose(image))
+    except Exception as e:
+        logging.warning(f"image_dhash: no se pudo calcular el hash: {str(e)}")
+        return None
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Número de bits distintos entre dos hashes"""
+    return bin(a ^ b).count("1")
+
+
+@dataclass
+class PreprocessedImage:
+    """Imagen lista para enviar al modelo de visión y métricas del preprocesamiento"""
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    original_size: Optional[Tuple[int, int]] = None
+    size: Optional[Tuple[int, int]] = None
+    detail: str = "high"
+    dhash: Optional[int] = None
+    operations: List[str] = field(default_factory=list)
+
+    @property
+    def processed_bytes(self) -> int:
+        return len(self.data)
+
+    @property
+    def tokens_before(self) -> Optional[int]:
+        """Tokens que costaría la imagen original en detalle alto"""
+        return estimate_image_tokens(*self.original_size) if self.original_size else None
+
+    @property
+    def tokens_after(self) -> Optional[int]:
+        """Tokens que costará la imagen enviada con su nivel de detalle"""
+        return estimate_image_tokens(*self.size, self.detail) if self.size else None
+
+    def report(self) -> Dict[str, Any]:
+        """Resumen para logs y para el resultado del proveedor"""
+        return {
+            "mime_type": self.mime_type,
+            "bytes_before": self.original_bytes,
+            "bytes_after": self.processed_bytes,
+            "size_before": self.original_size,
+            "size_after": self.size,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "detail": self.detail,
+            "dhash": f"{self.dhash:0{DHASH_SIZE * DHASH_SIZE // 4}x}" if self.dhash is not None else None,
+            "operations": self.operations,
+        }
+
+
+def _is_colorless(image, threshold: float) -> bool:
+    """Indica si la imagen es casi monocroma (saturación media baja), como un documento"""
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((256, 256))
+    saturation = ImageStat.Stat(thumbnail.convert("HSV").getchannel("S")).mean[0]
+    return saturation < threshold
+
+
+def preprocess_image(
+    data: bytes,
+    max_long_edge: int = 2048,
+    quality: int = 85,
+    grayscale: str = "auto",
+    saturation_threshold: float = 40.0,
+    sizing_policy: Optional[ImageSizingPolicy] = None
+) -> PreprocessedImage:
+    """
+    Corrige la orientación, reduce y recomprime una imagen. Es CPU intensivo y síncrono.
+
+    Si Pillow no está instalado o no puede abrir la imagen, se devuelve sin cambios
+    con el tipo MIME detectado.
+
+    Args:
+        data: Datos binarios de la imagen
+        max_long_edge: Longitud máxima del lado largo en píxeles (nunca se amplía)
+        quality: Calidad JPEG de la recompresión (1-95)
+        grayscale: "auto" (solo si la imagen casi no tiene color), "always" o "never"
+        saturation_threshold: Saturación media (0-255) por debajo de la cual "auto" convierte a grises
+        sizing_policy: Política que elige dimensiones y detalle según el costo en teselas
+
+    Returns:
+        PreprocessedImage: Imagen procesada y métricas
+    """
+    mime_type = detect_image_format(data) or "image/jpeg"
+    result = PreprocessedImage(data=data, mime_type=mime_type, original_bytes=len(data))
+    if Image is None:
+        return result
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception as e:
+        logging.warning(f"preprocess_image: no se pudo abrir la imagen ({mime_type}): {str(e)}")
+        return result
+
+    result.original_size = result.size = image.size
+    changed = False
+
+    # Las fotos del teléfono suelen venir rotadas con la orientación en EXIF
+    if image.getexif().get(0x0112, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+        result.operations.append("orientation")
+        changed = True
+
+    # Huella perceptual para detectar la misma factura fotografiada o reenviada de nuevo
+    result.dhash = dhash(image)
+
+    if grayscale == "always" or (grayscale == "auto" and _is_colorless(image, saturation_threshold)):
+        image = image.convert("L")
+        result.operations.append("grayscale")
+        changed = True
+    elif image.mode not in ("RGB", "L"):
+        # JPEG no admite transparencia: se aplana sobre blanco
+        background = Image.new("RGB", image.size, "white")
+        rgba = image.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        image = background
+
+    target = image.size
+    if max(target) > max_long_edge:
+        scale = max_long_edge / max(target)
+        target = (max(1, int(target[0] * scale)), max(1, int(target[1] * scale)))
+    if sizing_policy is not None:
+        plan = sizing_policy.plan(*target)
+        target = (min(target[0], plan.width), min(target[1], plan.height))
+        result.detail = plan.detail
+    if target != image.size:
+        image = image.resize(target, Image.LANCZOS)
+        result.operations.append("resize")
+        changed = True
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    encoded = output.getvalue()
+
+    # Recomprimir una imagen ya pequeña puede agrandarla; solo se usa si ayuda
+    if changed or len(encoded) < len(data):
+        result.operations.append("recompress")
+        result.data = encoded
+        result.mime_type = "image/jpeg"
+        result.size = image.size
+    return result
+
+
+class ImagePreprocessor:
+    """
+    Etapa de preprocesamiento de imágenes antes de enviarlas al modelo de visión.
+
+    El trabajo de Pillow se ejecuta fuera del event loop: en el executor por
+    defecto (hilos) o en el que se indique, por ejemplo un ProcessPoolExecutor.
+    Los resultados más recientes se guardan por contenido, así que el pipeline
+    (que necesita el dHash antes de llamar al modelo) y el proveedor de visión
+    comparten una sola decodificación de cada imagen.
+    """
+
+    def __init__(
+        self,
+        max_long_edge: int = 2048,
+        quality: int = 85,
+        grayscale: str = "auto",
+        sizing_policy: Optional[ImageSizingPolicy] = None,
+        executor: Optional[Executor] = None,
+        recent: int = 32
+    ):
+        if grayscale not in GRAYSCALE_MODES:
+            raise ValueError(f"Modo de escala de grises no válido: {grayscale}")
+        if not 1 <= quality <= 95:
+            raise ValueError("La calidad JPEG debe estar entre 1 y 95")
+        self.max_long_edge = max_long_edge
+        self.quality = quality
+        self.grayscale = grayscale
+        self.sizing_policy = sizing_policy
+        self.executor = executor
+        self.recent = recent
+        self._recent: "OrderedDict[bytes, PreprocessedImage]" = OrderedDict()
+        self._reused = 0
+        self._images = 0
+        self._bytes_before = 0
+        self._bytes_after = 0
+        self._tokens_before = 0
+        self._tokens_after = 0
+        if Image is None:
+            logging.warning("Pillow no está instalado; las imágenes se enviarán sin preprocesar")
+
+    async def process(self, data: bytes) -> PreprocessedImage:
+        """
+        Preprocesa una imagen sin bloquear el event loop.
+
+        Si la misma imagen se procesó hace poco, devuelve ese resultado.
+
+        Args:
+            data: Datos binarios de la imagen
+
+        Returns:
+            PreprocessedImage: Imagen procesada y métricas
+        """
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            self._reused += 1
+            return self._recent[key]
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, partial(
+            preprocess_image,
+            data,
+            max_long_edge=self.max_long_edge,
+            quality=self.quality,
+            grayscale=self.grayscale,
+            sizing_policy=self.sizing_policy
+        ))
+        self._images += 1
+        self._bytes_before += result.original_bytes
+        self._bytes_after += result.processed_bytes
+        if result.tokens_before is not None:
+            self._tokens_before += result.tokens_before
+            self._tokens_after += result.tokens_after
+        if self.recent:
+            self._recent[key] = result
+            if len(self._recent) > self.recent:
+                self._recent.popitem(last=False)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve bytes y tokens estimados antes y después del preprocesamiento"""
+        return {
+            "sizing_policy": self.sizing_policy.name if self.sizing_policy else "none",
+            "images": self._images,
+            # Imágenes que no se decodificaron de nuevo (dHash del pipeline y proveedor)
+            "reused": self._reused,
+            "bytes_before": self._bytes_before,
+            "bytes_after": self._bytes_after,
+            "bytes_saved": self._bytes_before - self._bytes_after,
+            "tokens_before": self._tokens_before,
+            "tokens_after": self._tokens_after,
+            "tokens_saved": self._tokens_before - self._tokens_after,
+        }
@@ -0,0 +1,327 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from providers.resilience import CircuitOpenError, ProviderError
+from providers.stats import percentile
+from .base import VisionProvider
+from .streaming import VisionStream
+
+
+def parse_vision_backends(spec: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    Interpreta la lista de backends de visión (VISION_BACKENDS).
+
+    Args:
+        spec: Entradas separadas por comas con la forma `modelo` o `modelo@url_base`
+
+    Returns:
+        List[Tuple[str, Optional[str]]]: Pares (modelo, url_base o None)
+    """
+    backends = []
+    for entry in spec.split(","):
+        model, _, api_base = entry.strip().partition("@")
+        if model.strip():
+            backends.append((model.strip(), api_base.strip() or None))
+    return backends
+
+
+def _counts_against_backend(error: BaseException) -> bool:
+    """Los errores de la solicitud (4xx) no dicen nada de la salud del backend; los 5xx, timeouts y circuitos abiertos sí"""
+    if isinstance(error, CircuitOpenError):
+        return True
+    return not isinstance(error, ProviderError) or error.retryable
+
+
+class VisionBackend:
+    """
+    Un proveedor de visión con su modelo y sus estadísticas de latencia y errores.
+
+    La latencia y la tasa de errores son medias móviles exponenciales (EWMA), así
+    que reaccionan en pocas solicitudes a una degradación del proveedor; los
+    percentiles se calculan sobre una ventana de latencias recientes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        provider: VisionProvider,
+        model_name: Optional[str] = None,
+        alpha: float = 0.2,
+        window: int = 200
+    ):
+        """
+        Args:
+            name: Nombre del backend en las métricas
+            provider: Proveedor de visión
+            model_name: Modelo a usar; None usa el que pida el llamador
+            alpha: Peso de cada nueva observación en las EWMA
+            window: Latencias recientes guardadas para los percentiles
+        """
+        self.name = name
+        self.provider = provider
+        self.model_name = model_name
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.last_failure_at: Optional[float] = None
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._requests = 0
+        self._failures = 0
+        self._cancelled = 0
+
+    @property
+    def samples(self) -> int:
+        return len(self._latencies)
+
+    def record(self, latency: float, ok: bool, now: float) -> None:
+        """
+        Registra una solicitud terminada.
+
+        Args:
+            latency: Segundos que tardó
+            ok: Si terminó bien; la latencia de los fallos no se usa (un error rápido no hace rápido al backend)
+            now: Instante actual del reloj del router
+        """
+        self._requests += 1
+        self.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.error_rate
+        if ok:
+            self._observe(latency)
+        else:
+            self._failures += 1
+            self.last_failure_at = now
+
+    def record_cancelled(self) -> None:
+        """
+        Registra una solicitud cancelada por perder la carrera. Su tiempo es solo
+        una cota inferior de la latencia real, así que no entra en la ventana ni en la EWMA.
+        """
+        self._cancelled += 1
+
+    def _observe(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        return percentile(self._latencies, fraction)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "requests": self._requests,
+            "failures": self._failures,
+            "cancelled": self._cancelled,
+            "latency_ewma": self.latency,
+            "error_rate_ewma": round(self.error_rate, 4),
+            "latency_p50": self.percentile(0.5),
+            "latency_p95": self.percentile(0.95),
+        }
+
+
+class LatencyRoutingVisionProvider(VisionProvider):
+    """
+    Reparte las imágenes entre varios backends de visión según su latencia.
+
+    Cada solicitud va al backend sano con menor latencia EWMA (los que aún no
+    tienen mediciones se prueban primero). Un backend deja de estar sano cuando
+    su tasa de errores EWMA supera `max_error_rate`, y vuelve a recibir
+    tráfico de prueba pasados `recovery_seconds` desde su último fallo.
+
+    Con `hedging`, si el backend elegido no responde en su percentil
+    `hedge_percentile` de latencia, se lanza la misma solicitud en el
+    siguiente backend y se usa la primera respuesta, cancelando la otra. Así
+    una ralentización del proveedor solo afecta a la cola de latencia durante
+    ese retardo. Si el elegido falla antes, se reintenta una vez en el siguiente.
+    """
+
+    def __init__(
+        self,
+        backends: List[VisionBackend],
+        hedging: bool = False,
+        hedge_percentile: float = 0.95,
+        min_hedge_delay: float = 1.0,
+        min_samples: int = 10,
+        max_error_rate: float = 0.5,
+        recovery_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Args:
+            backends: Backends entre los que repartir, en orden de preferencia inicial
+            hedging: Si se lanzan solicitudes de cobertura
+            hedge_percentile: Percentil de latencia del backend elegido tras el que se lanza la cobertura
+            min_hedge_delay: Retardo mínimo de la cobertura en segundos
+            min_samples: Latencias necesarias antes de lanzar coberturas (sin ellas el percentil no es fiable)
+            max_error_rate: Tasa de errores EWMA a partir de la cual un backend se considera caído
+            recovery_seconds: Segundos tras el último fallo para volver a probar un backend caído
+            clock: Reloj en segundos (inyectable en pruebas)
+        """
+        if not backends:
+            raise ValueError("Se necesita al menos un backend de visión")
+        self.backends = backends
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.recovery_seconds = recovery_seconds
+        self.clock = clock
+        self._requests = 0
+        self._hedges = 0
+        self._hedges_won = 0
+        self._failovers = 0
+
+    @property
+    def prompt_version(self) -> str:
+        # El backend que responde lo eligen la latencia, la cobertura o la conmutación:
+        # el conjunto de backends (y su modelo) forma parte de la clave de caché
+        backends = sorted(
+            f"{backend.name}={backend.model_name or '*'}/{getattr(backend.provider, 'prompt_version', '1')}"
+            for backend in self.backends
+        )
+        return f"routed[{','.join(backends)}]"
+
+    def _healthy(self, backend: VisionBackend, now: float) -> bool:
+        if backend.error_rate < self.max_error_rate:
+            return True
+        return backend.last_failure_at is None or now - backend.last_failure_at >= self.recovery_seconds
+
+    def ranked(self) -> List[VisionBackend]:
+        """Backends en orden de preferencia: sanos primero y, entre ellos, de menor a mayor latencia"""
+        now = self.clock()
+        return sorted(
+            self.backends,
+            key=lambda backend: (not self._healthy(backend, now), backend.latency or 0.0, backend.error_rate)
+        )
+
+    def _hedge_delay(self, backend: VisionBackend) -> Optional[float]:
+        if not self.hedging or backend.samples < self.min_samples:
+            return None
+        return max(self.min_hedge_delay, backend.percentile(self.hedge_percentile))
+
+    async def _call(self, backend: VisionBackend, image_data: bytes, model_name: str, api_key: str, kwargs: dict) -> dict:
+        start = self.clock()
+        try:
+            result = await backend.provider.process_image(image_data, backend.model_name or model_name, api_key, **kwargs)
+        except asyncio.CancelledError:
+            backend.record_cancelled()
+            raise
+        except Exception as e:
+            if _counts_against_backend(e):
+                backend.record(self.clock() - start, ok=False, now=self.clock())
+            raise
+        backend.record(self.clock() - start, ok=True, now=self.clock())
+        return {**result, "backend": backend.name}
+
+    async def process_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> dict:
+        """
+        Procesa la imagen en el backend más rápido, con cobertura y conmutación si hace falta.
+
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Modelo para los backends que no fijan uno propio
+            api_key: Clave API
+            kwargs: Argumentos adicionales
+
+        Returns:
+            dict: Resultado del backend que respondió primero, con "backend"
+
+        Raises:
+            Exception: El último error si ningún backend respondió
+        """
+        self._requests += 1
+        ranked = self.ranked()
+        primary = ranked[0]
+        # Sin un segundo backend distinto no hay cobertura ni conmutación
+        secondary = ranked[1] if len(ranked) > 1 else None
+        delay = self._hedge_delay(primary) if secondary is not None else None
+
+        tasks = {asyncio.create_task(self._call(primary, image_data, model_name, api_key, kwargs))}
+        hedge_task = None
+        second_launched = False
+        last_error: Optional[BaseException] = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks,
+                    timeout=None if second_launched else delay,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # El backend elegido superó su percentil de latencia: cobertura en el siguiente
+                    second_launched = True
+                    self._hedges += 1
+                    hedge_task = asyncio.create_task(self._call(secondary, image_data, model_name, api_key, kwargs))
+                    tasks.add(hedge_task)
+                    continue
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        if task is hedge_task:
+                            self._hedges_won += 1
+                        return task.result()
+                    if not _counts_against_backend(error):
+                        raise error
+                    last_error = error
+                if not tasks and not second_launched and secondary is not None:
+                    second_launched = True
+                    self._failovers += 1
+                    tasks.add(asyncio.create_task(self._call(secondary, image_data, model_name, api_key, kwargs)))
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stream_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> VisionStream:
+        """
+        Transmite la respuesta del backend más rápido. Sin cobertura: duplicar un
+        stream ya iniciado no acorta el tiempo hasta el primer fragmento.
+        """
+        self._requests += 1
+        backend = self.ranked()[0]
+        stream = backend.provider.stream_image(image_data, backend.model_name or model_name, api_key, **kwargs)
+        inner = stream.source
+
+        async def timed():
+            start = self.clock()
+            try:
+                async for chunk in inner:
+                    yield chunk
+            except Exception as e:
+                if _counts_against_backend(e):
+                    backend.record(self.clock() - start, ok=False, now=self.clock())
+                raise
+            backend.record(self.clock() - start, ok=True, now=self.clock())
+            stream.details["backend"] = backend.name
+
+        stream.source = timed()
+        return stream
+
+    async def validate_api_key(self, api_key: str) -> bool:
+        return await self.backends[0].provider.validate_api_key(api_key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve coberturas lanzadas y ganadas, conmutaciones y latencia/errores por backend"""
+        return {
+            "hedging": self.hedging,
+            "requests": self._requests,
+            "hedges": self._hedges,
+            "hedges_won": self._hedges_won,
+            "failovers": self._failovers,
+            "backends": {backend.name: backend.stats() for backend in self.backends},
+        }
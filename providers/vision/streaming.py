@@ -0,0 +1,114 @@
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+from providers.stats import percentile
+
+
+class VisionStream:
+    """
+    Respuesta incremental de un proveedor de visión.
+
+    Se itera con `async for` y entrega el texto a medida que llega; mide por
+    separado el tiempo hasta el primer fragmento de texto (TTFT) y el tiempo
+    total. Al terminar, `result()` devuelve un diccionario con la misma forma
+    que `VisionProvider.process_image` más los tiempos medidos.
+    """
+
+    def __init__(self, model: str, provider: str):
+        self.model = model
+        self.provider = provider
+        # Datos adicionales del resultado (usage, preprocessing, cached...) que completa el proveedor
+        self.details: Dict[str, Any] = {}
+        self.source: Optional[AsyncIterator[str]] = None
+        self.time_to_first_token: Optional[float] = None
+        self.total_time: Optional[float] = None
+        self._parts: List[str] = []
+        self._started_at = time.perf_counter()
+        self._iterated = False
+
+    @property
+    def text(self) -> str:
+        """Texto recibido hasta el momento"""
+        return "".join(self._parts)
+
+    @property
+    def done(self) -> bool:
+        return self.total_time is not None
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        if self._iterated:
+            raise RuntimeError("Un VisionStream solo puede recorrerse una vez")
+        self._iterated = True
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        async for chunk in self.source:
+            if not chunk:
+                continue
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - self._started_at
+            self._parts.append(chunk)
+            yield chunk
+        self.total_time = time.perf_counter() - self._started_at
+
+    async def read(self) -> str:
+        """Consume lo que quede del stream y devuelve el texto completo"""
+        if not self._iterated:
+            async for _ in self:
+                pass
+        return self.text
+
+    def result(self) -> dict:
+        """Resultado completo, con la forma de `VisionProvider.process_image`"""
+        return {
+            "model": self.model,
+            "provider": self.provider,
+            "usage": {},
+            **self.details,
+            "extracted_text": self.text,
+            "timings": {
+                "time_to_first_token": self.time_to_first_token,
+                "total_time": self.total_time,
+            },
+        }
+
+
+class VisionStreamMetrics:
+    """Percentiles de TTFT y tiempo total de las últimas respuestas en streaming"""
+
+    def __init__(self, window: int = 1000):
+        self._time_to_first_token: Deque[float] = deque(maxlen=window)
+        self._total_time: Deque[float] = deque(maxlen=window)
+        self._streams = 0
+        self._cached = 0
+
+    def record(self, stream: VisionStream) -> None:
+        """
+        Registra los tiempos de un stream terminado.
+
+        Args:
+            stream: Stream ya consumido
+        """
+        self._streams += 1
+        if stream.details.get("cached"):
+            # Los aciertos de caché no reflejan la latencia del modelo
+            self._cached += 1
+            return
+        if stream.time_to_first_token is not None:
+            self._time_to_first_token.append(stream.time_to_first_token)
+        if stream.total_time is not None:
+            self._total_time.append(stream.total_time)
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve p50/p95 de TTFT y de tiempo total en segundos"""
+        ttft = list(self._time_to_first_token)
+        total = list(self._total_time)
+        return {
+            "streams": self._streams,
+            "cached": self._cached,
+            "time_to_first_token_p50": percentile(ttft, 0.5),
+            "time_to_first_token_p95": percentile(ttft, 0.95),
+            "total_time_p50": percentile(total, 0.5),
+            "total_time_p95": percentile(total, 0.95),
+        }
@@ -0,0 +1,284 @@
+import asyncio
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .base import VisionProvider
+from .streaming import VisionStream
+
+
+def parse_tesseract_tsv(tsv: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Convierte la salida TSV de Tesseract en texto y confianza por palabra.
+
+    Args:
+        tsv: Salida de `tesseract ... tsv`
+
+    Returns:
+        Tuple[str, List[Dict[str, Any]]]: Texto con un renglón por línea detectada y
+        palabras con su confianza (0-1)
+    """
+    lines: Dict[Tuple[str, str, str, str], List[str]] = {}
+    words = []
+    rows = tsv.splitlines()
+    for row in rows[1:]:
+        columns = row.split("\t")
+        # level, page, block, paragraph, line, word, left, top, width, height, conf, text
+        if len(columns) < 12 or columns[0] != "5":
+            continue
+        text = columns[11].strip()
+        try:
+            confidence = float(columns[10])
+        except ValueError:
+            continue
+        if not text or confidence < 0:
+            continue
+        lines.setdefault(tuple(columns[1:5]), []).append(text)
+        words.append({"text": text, "confidence": round(confidence / 100, 4)})
+    return "\n".join(" ".join(line) for line in lines.values()), words
+
+
+class TesseractVisionProvider(VisionProvider):
+    """
+    Proveedor de visión con OCR local en CPU usando el binario de Tesseract.
+
+    Cada imagen se procesa en un subproceso de `tesseract` (la imagen entra por
+    stdin y el TSV sale por stdout), así que el event loop nunca se bloquea y el
+    OCR usa varios núcleos. Un semáforo limita los subprocesos simultáneos al
+    tamaño del pool. No tiene costo por llamada y devuelve la confianza de cada
+    palabra para decidir si hace falta el modelo de visión.
+    """
+
+    def __init__(
+        self,
+        command: str = "tesseract",
+        languages: str = "spa+eng",
+        page_segmentation_mode: int = 4,
+        max_processes: Optional[int] = None,
+        timeout: float = 30.0
+    ):
+        """
+        Args:
+            command: Ruta o nombre del ejecutable de Tesseract
+            languages: Idiomas de Tesseract (ej: "spa+eng")
+            page_segmentation_mode: Modo --psm; 4 (una columna de texto) funciona bien con recibos
+            max_processes: Subprocesos simultáneos; por defecto el número de CPUs
+            timeout: Segundos máximos por imagen
+        """
+        self.command = command
+        self.languages = languages
+        self.page_segmentation_mode = page_segmentation_mode
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self.timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._images = 0
+        self._failures = 0
+        self._seconds = 0.0
+
+    def available(self) -> bool:
+        """Indica si el ejecutable de Tesseract está instalado"""
+        return shutil.which(self.command) is not None
+
+    async def process_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> dict:
+        """
+        Extrae el texto de una imagen con Tesseract.
+
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Ignorado (el OCR local no usa modelos remotos)
+            api_key: Ignorada
+            kwargs: Argumentos adicionales
+
+        Returns:
+            dict: Texto extraído, confianza media (0-1) y confianza por palabra
+
+        Raises:
+            RuntimeError: Si Tesseract no está instalado, falla o excede el tiempo máximo
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_processes)
+        start = time.perf_counter()
+        async with self._semaphore:
+            try:
+                tsv = await self._run(image_data)
+            except Exception:
+                self._failures += 1
+                raise
+        elapsed = time.perf_counter() - start
+        self._images += 1
+        self._seconds += elapsed
+
+        text, words = parse_tesseract_tsv(tsv)
+        confidence = sum(word["confidence"] for word in words) / len(words) if words else 0.0
+        return {
+            "extracted_text": text,
+            "model": f"tesseract:{self.languages}",
+            "provider": "tesseract",
+            "usage": {},
+            "confidence": round(confidence, 4),
+            "words": words,
+        }
+
+    async def _run(self, image_data: bytes) -> str:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.command, "stdin", "stdout",
+                "-l", self.languages,
+                "--psm", str(self.page_segmentation_mode),
+                "tsv",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise RuntimeError(f"Tesseract no está instalado ({self.command})")
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(image_data), self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise RuntimeError(f"Tesseract excedió {self.timeout:.0f}s")
+        if process.returncode != 0:
+            raise RuntimeError(f"Tesseract falló ({process.returncode}): {stderr.decode(errors='replace')[:300]}")
+        return stdout.decode("utf-8", errors="replace")
+
+    async def validate_api_key(self, api_key: str) -> bool:
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve imágenes procesadas, fallos y tiempo medio de OCR"""
+        return {
+            "images": self._images,
+            "failures": self._failures,
+            "average_seconds": self._seconds / self._images if self._images else None,
+            "max_processes": self.max_processes,
+        }
+
+
+class ConfidenceRoutingVisionProvider(VisionProvider):
+    """
+    Usa primero el OCR local y recurre al modelo de visión solo si no es confiable.
+
+    Si el OCR local falla, su confianza media es menor que `min_confidence` o
+    reconoce menos de `min_words` palabras (foto borrosa, factura manuscrita), la
+    imagen se envía al proveedor de respaldo (GPT-4o). Para recibos impresos y
+    nítidos se evita la llamada al modelo, con su latencia y su costo.
+    """
+
+    def __init__(
+        self,
+        local_provider: VisionProvider,
+        fallback_provider: VisionProvider,
+        min_confidence: float = 0.8,
+        min_words: int = 20
+    ):
+        self.local_provider = local_provider
+        self.fallback_provider = fallback_provider
+        self.min_confidence = min_confidence
+        self.min_words = min_words
+        self._local = 0
+        self._fallback = 0
+        self._local_errors = 0
+        self._confidence_total = 0.0
+
+    @property
+    def prompt_version(self) -> str:
+        # Cambiar el umbral cambia qué resultados se devuelven: forma parte de la clave de caché
+        return f"{getattr(self.fallback_provider, 'prompt_version', '1')}:ocr{self.min_confidence}:{self.min_words}"
+
+    async def process_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> dict:
+        """
+        Procesa la imagen con el OCR local y, si no es confiable, con el proveedor de respaldo.
+
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Modelo del proveedor de respaldo
+            api_key: Clave API del proveedor de respaldo
+            kwargs: Argumentos adicionales
+
+        Returns:
+            dict: Resultado del proveedor elegido, con "routed_to" y "local_confidence"
+        """
+        local_result, local_confidence = await self._try_local(image_data, model_name, api_key, **kwargs)
+        if local_result is not None:
+            return local_result
+        result = await self.fallback_provider.process_image(image_data, model_name, api_key, **kwargs)
+        return {**result, "routed_to": "fallback", "local_confidence": local_confidence}
+
+    def stream_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> VisionStream:
+        """
+        Igual que `process_image`, pero si se recurre al respaldo su respuesta se transmite en streaming.
+        """
+        stream = VisionStream(model=model_name, provider="router")
+
+        async def source():
+            local_result, local_confidence = await self._try_local(image_data, model_name, api_key, **kwargs)
+            if local_result is not None:
+                stream.details.update({k: v for k, v in local_result.items() if k != "extracted_text"})
+                yield local_result["extracted_text"]
+                return
+            fallback = self.fallback_provider.stream_image(image_data, model_name, api_key, **kwargs)
+            async for chunk in fallback:
+                yield chunk
+            stream.provider = fallback.provider
+            stream.details.update({**fallback.details, "routed_to": "fallback", "local_confidence": local_confidence})
+
+        stream.source = source()
+        return stream
+
+    async def _try_local(self, image_data: bytes, model_name: str, api_key: str, **kwargs: Any):
+        """Resultado del OCR local si es confiable (o None) y su confianza"""
+        try:
+            result = await self.local_provider.process_image(image_data, model_name, api_key, **kwargs)
+        except Exception as e:
+            self._local_errors += 1
+            self._fallback += 1
+            print(f"ConfidenceRoutingVisionProvider: OCR local falló, se usa el respaldo: {str(e)}")
+            return None, None
+        local_confidence = result.get("confidence", 0.0)
+        self._confidence_total += local_confidence
+        if (
+            not result.get("error")
+            and local_confidence >= self.min_confidence
+            and len(result.get("words", [])) >= self.min_words
+        ):
+            self._local += 1
+            return {**result, "routed_to": "local", "local_confidence": local_confidence}, local_confidence
+        self._fallback += 1
+        return None, local_confidence
+
+    async def validate_api_key(self, api_key: str) -> bool:
+        return await self.fallback_provider.validate_api_key(api_key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve cuántas imágenes resolvió el OCR local y cuántas fueron al respaldo"""
+        total = self._local + self._fallback
+        scored = total - self._local_errors
+        return {
+            "min_confidence": self.min_confidence,
+            "local": self._local,
+            "fallback": self._fallback,
+            "local_errors": self._local_errors,
+            "local_ratio": self._local / total if total else 0.0,
+            "average_local_confidence": self._confidence_total / scored if scored else None,
+            "local_ocr": getattr(self.local_provider, "stats", dict)(),
+        }
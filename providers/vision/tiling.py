@@ -0,0 +1,293 @@
+import asyncio
+import io
+import logging
+import math
+import re
+from concurrent.futures import Executor
+from difflib import SequenceMatcher
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from .base import VisionProvider
+from .streaming import VisionStream
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow es opcional: sin él las imágenes no se dividen
+    Image = None
+
+# Valores de la etiqueta EXIF Orientation que giran la imagen 90°
+_ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def plan_tiles(
+    width: int,
+    height: int,
+    min_aspect_ratio: float = 2.5,
+    tile_aspect_ratio: float = 2.0,
+    overlap: float = 0.15,
+    max_tiles: int = 8
+) -> List[Tuple[int, int]]:
+    """
+    Calcula las franjas horizontales en que se divide una imagen alta.
+
+    Args:
+        width: Ancho de la imagen en píxeles
+        height: Alto de la imagen en píxeles
+        min_aspect_ratio: Relación alto/ancho a partir de la cual se divide
+        tile_aspect_ratio: Relación alto/ancho de cada franja
+        overlap: Fracción de cada franja que se solapa con la siguiente
+        max_tiles: Máximo de franjas; si no alcanzan, las franjas se hacen más altas
+
+    Returns:
+        List[Tuple[int, int]]: Pares (arriba, abajo) de cada franja; una sola franja si no hay que dividir
+    """
+    if width <= 0 or height / width < min_aspect_ratio:
+        return [(0, height)]
+    tile_height = min(height, int(width * tile_aspect_ratio))
+    step = tile_height * (1 - overlap)
+    count = math.ceil((height - tile_height) / step) + 1
+    if count > max_tiles:
+        count = max_tiles
+        tile_height = math.ceil(height / (1 + (count - 1) * (1 - overlap)))
+        step = tile_height * (1 - overlap)
+    if count <= 1:
+        return [(0, height)]
+    # La última franja se alinea con el borde inferior
+    tops = [min(round(index * step), height - tile_height) for index in range(count)]
+    return [(top, top + tile_height) for top in tops]
+
+
+def split_tall_image(
+    data: bytes,
+    min_aspect_ratio: float = 2.5,
+    tile_aspect_ratio: float = 2.0,
+    overlap: float = 0.15,
+    max_tiles: int = 8,
+    quality: int = 90
+) -> List[bytes]:
+    """
+    Divide una imagen alta en franjas horizontales solapadas. Es CPU intensivo y síncrono.
+
+    Las dimensiones se comprueban antes de decodificar, así que las imágenes que
+    no hay que dividir cuestan solo la lectura de la cabecera.
+
+    Args:
+        data: Datos binarios de la imagen
+        min_aspect_ratio: Relación alto/ancho a partir de la cual se divide
+        tile_aspect_ratio: Relación alto/ancho de cada franja
+        overlap: Fracción de cada franja que se solapa con la siguiente
+        max_tiles: Máximo de franjas
+        quality: Calidad JPEG de las franjas
+
+    Returns:
+        List[bytes]: Franjas en JPEG, de arriba abajo; vacía si la imagen no es alta o no se puede abrir
+    """
+    if Image is None:
+        return []
+    try:
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        if image.getexif().get(0x0112, 1) in _ROTATED_ORIENTATIONS:
+            width, height = height, width
+        if len(plan_tiles(width, height, min_aspect_ratio, tile_aspect_ratio, overlap, max_tiles)) <= 1:
+            return []
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        tiles = []
+        for top, bottom in plan_tiles(width, height, min_aspect_ratio, tile_aspect_ratio, overlap, max_tiles):
+            output = io.BytesIO()
+            image.crop((0, top, width, bottom)).save(output, format="JPEG", quality=quality)
+            tiles.append(output.getvalue())
+        return tiles
+    except Exception as e:
+        logging.warning(f"split_tall_image: no se pudo dividir la imagen: {str(e)}")
+        return []
+
+
+def _normalize_line(line: str) -> Any:
+    normalized = re.sub(r"\W+", "", line.lower())
+    # Las líneas vacías no cuentan como solape: cada una es distinta de todas las demás
+    return normalized or object()
+
+
+def stitch_tile_texts(texts: List[str], window: int = 12, min_overlap_chars: int = 10) -> str:
+    """
+    Une el texto de franjas consecutivas quitando las líneas repetidas del solape.
+
+    Entre las últimas `window` líneas de lo acumulado y las primeras de la
+    franja siguiente se busca el bloque de líneas iguales (sin mayúsculas,
+    espacios ni puntuación) más largo. Se corta ahí: las líneas partidas por el
+    borde de una franja aparecen completas en la otra. Si el bloque es muy
+    corto para ser fiable, las franjas se concatenan sin más; es preferible
+    repetir una línea a perderla.
+
+    Args:
+        texts: Texto de cada franja, de arriba abajo
+        window: Líneas de cada lado en las que buscar el solape
+        min_overlap_chars: Caracteres mínimos del bloque común para aceptarlo
+
+    Returns:
+        str: Texto completo
+    """
+    lines = texts[0].splitlines() if texts else []
+    for text in texts[1:]:
+        following = text.splitlines()
+        tail_start = max(0, len(lines) - window)
+        tail = [_normalize_line(line) for line in lines[tail_start:]]
+        head = [_normalize_line(line) for line in following[:window]]
+        match = SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(0, len(tail), 0, len(head))
+        matched_chars = sum(len(tail[match.a + offset]) for offset in range(match.size))
+        if match.size and matched_chars >= min_overlap_chars:
+            lines = lines[:tail_start + match.a + match.size] + following[match.b + match.size:]
+        else:
+            lines = lines + following
+    return "\n".join(lines)
+
+
+class TilingVisionProvider(VisionProvider):
+    """
+    Divide los recibos largos en franjas y las procesa en paralelo.
+
+    Un recibo de supermercado de 1:6 reducido entero queda ilegible, y a
+    resolución completa es muy caro. Las imágenes más altas que
+    `min_aspect_ratio` se cortan en franjas solapadas que el proveedor procesa
+    concurrentemente, de modo que la latencia es la de la franja más lenta y
+    no crece con la longitud del recibo. El texto se une quitando el solape.
+    """
+
+    def __init__(
+        self,
+        provider: VisionProvider,
+        min_aspect_ratio: float = 2.5,
+        tile_aspect_ratio: float = 2.0,
+        overlap: float = 0.15,
+        max_tiles: int = 8,
+        executor: Optional[Executor] = None
+    ):
+        """
+        Args:
+            provider: Proveedor que procesa cada franja (y las imágenes que no se dividen)
+            min_aspect_ratio: Relación alto/ancho a partir de la cual se divide
+            tile_aspect_ratio: Relación alto/ancho de cada franja
+            overlap: Fracción de cada franja que se solapa con la siguiente
+            max_tiles: Máximo de franjas por imagen
+            executor: Executor para el trabajo de Pillow; por defecto el de hilos del loop
+        """
+        self.provider = provider
+        self.min_aspect_ratio = min_aspect_ratio
+        self.tile_aspect_ratio = tile_aspect_ratio
+        self.overlap = overlap
+        self.max_tiles = max_tiles
+        self.executor = executor
+        self._images = 0
+        self._tiled = 0
+        self._tiles = 0
+
+    @property
+    def prompt_version(self) -> str:
+        # La división cambia el texto devuelto: forma parte de la clave de caché
+        return (
+            f"{getattr(self.provider, 'prompt_version', '1')}:tiles{self.min_aspect_ratio}"
+            f":{self.tile_aspect_ratio}:{self.overlap}:{self.max_tiles}"
+        )
+
+    async def _split(self, image_data: bytes) -> List[bytes]:
+        loop = asyncio.get_running_loop()
+        tiles = await loop.run_in_executor(self.executor, partial(
+            split_tall_image,
+            image_data,
+            min_aspect_ratio=self.min_aspect_ratio,
+            tile_aspect_ratio=self.tile_aspect_ratio,
+            overlap=self.overlap,
+            max_tiles=self.max_tiles
+        ))
+        self._images += 1
+        if tiles:
+            self._tiled += 1
+            self._tiles += len(tiles)
+        return tiles
+
+    async def _process_tiles(self, tiles: List[bytes], model_name: str, api_key: str, **kwargs: Any) -> dict:
+        results = await asyncio.gather(*(
+            self.provider.process_image(tile, model_name, api_key, **kwargs) for tile in tiles
+        ))
+        usage: Dict[str, Any] = {}
+        for result in results:
+            for key, value in (result.get("usage") or {}).items():
+                if isinstance(value, (int, float)):
+                    usage[key] = usage.get(key, 0) + value
+        return {
+            "extracted_text": stitch_tile_texts([result.get("extracted_text", "") for result in results]),
+            "model": results[0].get("model", model_name),
+            "provider": results[0].get("provider"),
+            "usage": usage,
+            "tiles": len(tiles),
+        }
+
+    async def process_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> dict:
+        """
+        Procesa la imagen entera o, si es alta, por franjas en paralelo.
+
+        Args:
+            image_data: Datos binarios de la imagen
+            model_name: Nombre del modelo a utilizar
+            api_key: Clave API
+            kwargs: Argumentos adicionales
+
+        Returns:
+            dict: Resultado del proveedor; con franjas, el texto unido, el uso sumado y "tiles"
+        """
+        tiles = await self._split(image_data)
+        if not tiles:
+            return await self.provider.process_image(image_data, model_name, api_key, **kwargs)
+        return await self._process_tiles(tiles, model_name, api_key, **kwargs)
+
+    def stream_image(
+        self,
+        image_data: bytes,
+        model_name: str,
+        api_key: str,
+        **kwargs: Dict[str, Any]
+    ) -> VisionStream:
+        """
+        Transmite la respuesta del proveedor; las imágenes divididas llegan en un solo
+        fragmento porque el texto solo puede unirse con todas las franjas.
+        """
+        stream = VisionStream(model=model_name, provider="tiling")
+
+        async def source():
+            tiles = await self._split(image_data)
+            if not tiles:
+                inner = self.provider.stream_image(image_data, model_name, api_key, **kwargs)
+                async for chunk in inner:
+                    yield chunk
+                stream.model, stream.provider = inner.model, inner.provider
+                stream.details.update(inner.details)
+                return
+            result = await self._process_tiles(tiles, model_name, api_key, **kwargs)
+            stream.model, stream.provider = result["model"], result["provider"]
+            stream.details.update({k: v for k, v in result.items() if k not in ("extracted_text", "model", "provider")})
+            yield result["extracted_text"]
+
+        stream.source = source()
+        return stream
+
+    async def validate_api_key(self, api_key: str) -> bool:
+        return await self.provider.validate_api_key(api_key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve imágenes recibidas, cuántas se dividieron y el total de franjas"""
+        return {
+            "images": self._images,
+            "tiled": self._tiled,
+            "tiles": self._tiles,
+            "average_tiles": self._tiles / self._tiled if self._tiled else None,
+        }
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+
+from agents.validation import normalize_currency, repair_invoice, validate_invoice
+from models.invoice import Invoice, InvoiceItem
+
+
+def invoice(items, total_amount=119.0, tax_amount=19.0, currency="USD"):
+    return Invoice(
+        invoice_number="INV-001",
+        date=datetime(2024, 2, 17),
+        vendor_name="Test Company",
+        total_amount=total_amount,
+        tax_amount=tax_amount,
+        items=[InvoiceItem(description=f"Item {n}", quantity=q, unit_price=p, total=t) for n, (q, p, t) in enumerate(items)],
+        currency=currency,
+    )
+
+
+@pytest.mark.parametrize("currency, expected", [
+    ("usd", "USD"), ("US$", "USD"), ("Pesos  colombianos", "COP"), ("€", "EUR"), ("cop", "COP"), ("$", "$"),
+])
+def test_currencies_are_normalized_to_iso_codes(currency, expected):
+    assert normalize_currency(currency) == expected
+
+
+def test_consistent_invoices_are_left_untouched():
+    original = invoice([(2, 25.0, 50.0), (1, 50.0, 50.0)])
+
+    repaired, repairs = repair_invoice(original)
+
+    assert repaired is original and repairs == []
+
+
+def test_quantity_slips_are_fixed_when_item_totals_reconcile():
+    repaired, repairs = repair_invoice(invoice([(1, 25.0, 50.0), (1, 50.0, 50.0)]))
+
+    assert repaired.items[0].quantity == 2 and repaired.items[0].total == 50.0
+    assert repairs == ["cantidad"]
+
+
+def test_item_totals_are_recomputed_when_the_invoice_does_not_reconcile():
+    repaired, repairs = repair_invoice(invoice([(2, 25.0, 5.0), (1, 50.0, 50.0)]))
+
+    assert [item.total for item in repaired.items] == [50.0, 50.0]
+    assert repairs == ["total del ítem"]
+
+
+def test_missing_tax_and_misread_totals_are_reconciled():
+    missing_tax, first = repair_invoice(invoice([(1, 100.0, 100.0)], tax_amount=0.0))
+    misread_total, second = repair_invoice(invoice([(1, 100000.0, 100000.0)], total_amount=119.0, tax_amount=19000.0, currency="pesos"))
+    implausible, third = repair_invoice(invoice([(1, 100.0, 100.0)], total_amount=500.0, tax_amount=0.0))
+    # Un 12 % no es una tasa de IVA conocida: puede faltar un ítem y se pide de nuevo
+    missing_item, fourth = repair_invoice(invoice([(1, 100.0, 100.0)], total_amount=112.0, tax_amount=0.0))
+
+    assert missing_tax.tax_amount == 19.0 and first == ["impuesto"]
+    assert misread_total.total_amount == 119000.0 and misread_total.currency == "COP"
+    assert second == ["moneda", "total"]
+    assert implausible.total_amount == 500.0 and third == []
+    assert missing_item.tax_amount == 0.0 and fourth == []
+    assert "los ítems más el impuesto no suman el total" in validate_invoice(missing_item)
@@ -0,0 +1,57 @@
+import os
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from pydantic import ValidationError
+
+# blueprint carga la configuración de la aplicación al importarse
+for name, value in {
+    "WHATSAPP_TOKEN": "token",
+    "WHATSAPP_PHONE_NUMBER_ID": "1",
+    "WHATSAPP_VERIFY_TOKEN_WEBHOOK": "verify",
+    "MONGO_CONNECTION_STRING": "mongodb://localhost:1",
+}.items():
+    os.environ.setdefault(name, value)
+
+import blueprint
+from app import dependencies
+from app.config import Settings
+from app.dedup import MessageDeduplicator
+from tests.unit.mocks.providers import MockStorageProvider
+
+MESSAGE = {"id": "wamid.1", "from": "573001112233", "type": "text", "text": {"body": "hola"}}
+
+
+def test_blueprint_builds_providers_with_the_app_factories():
+    # Las dos entradas (FastAPI y Azure Function) no pueden configurarse de forma distinta
+    assert blueprint.get_vision_provider is dependencies.get_vision_provider
+    assert blueprint.get_message_deduplicator is dependencies.get_message_deduplicator
+    assert blueprint.get_invoice_persister is dependencies.get_invoice_persister
+
+
+@pytest.mark.parametrize("name, value", [("VISION_TILE_OVERLAP", "0.6"), ("TESSERACT_PSM", "14")])
+def test_out_of_range_values_fail_at_startup(monkeypatch, name, value):
+    monkeypatch.setenv(name, value)
+    with pytest.raises(ValidationError):
+        Settings()
+
+
+@pytest.mark.asyncio
+async def test_providers_start_once_and_messages_are_deduplicated(monkeypatch):
+    monkeypatch.setattr(blueprint, "_providers_ready", False)
+    deduplicator = MessageDeduplicator(storage_provider=MockStorageProvider())
+    startup = AsyncMock()
+    sent = AsyncMock()
+
+    with patch.multiple(
+        blueprint,
+        startup_providers=startup,
+        get_message_deduplicator=lambda: deduplicator,
+        send_whatsapp_message=sent
+    ):
+        await blueprint.handle_message(MESSAGE)
+        await blueprint.handle_message(MESSAGE)
+        await blueprint.handle_message({**MESSAGE, "id": "wamid.2"})
+
+    startup.assert_awaited_once()
+    assert sent.await_count == 2
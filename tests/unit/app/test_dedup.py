@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from app.dedup import MessageDeduplicator
+from app.job_queue import DurableJobQueue
+from tests.unit.mocks.providers import MockStorageProvider
+
+# Usar exclusivamente asyncio para pruebas
+pytestmark = pytest.mark.asyncio
+
+
+class FailingStorageProvider(MockStorageProvider):
+    """Proveedor cuyo registro de mensajes vistos siempre falla."""
+
+    async def mark_message_seen(self, message_id: str) -> bool:
+        raise ConnectionError("MongoDB no disponible")
+
+
+async def test_duplicate_is_detected_in_memory():
+    """La segunda entrega del mismo mensaje se descarta desde la caché en memoria."""
+    deduplicator = MessageDeduplicator(storage_provider=MockStorageProvider())
+
+    assert await deduplicator.claim("wamid.1") is True
+    assert await deduplicator.claim("wamid.1") is False
+
+    stats = deduplicator.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+
+
+async def test_duplicate_is_detected_from_persisted_set():
+    """Un proceso nuevo detecta duplicados gracias al conjunto persistido."""
+    storage = MockStorageProvider()
+    await MessageDeduplicator(storage_provider=storage).claim("wamid.1")
+
+    restarted = MessageDeduplicator(storage_provider=storage)
+    assert await restarted.claim("wamid.1") is False
+    assert restarted.stats()["storage_hits"] == 1
+
+
+async def test_completed_messages_stay_duplicates_after_the_lease():
+    """Un mensaje procesado no se vuelve a procesar aunque su lease haya vencido."""
+    storage = MockStorageProvider()
+    deduplicator = MessageDeduplicator(storage_provider=storage, lease=0.01)
+
+    assert await deduplicator.claim("wamid.1") is True
+    await deduplicator.complete("wamid.1")
+    await asyncio.sleep(0.02)
+
+    assert await deduplicator.claim("wamid.1") is False
+    assert await MessageDeduplicator(storage_provider=storage, lease=0.01).claim("wamid.1") is False
+
+
+async def test_job_killed_after_claim_is_processed_again_after_its_lease(tmp_path):
+    """Si el proceso muere tras reclamar el mensaje, el reintento de la cola lo procesa."""
+    path = str(tmp_path / "jobs.sqlite3")
+    storage = MockStorageProvider()
+    queue = DurableJobQueue(path, visibility_timeout=0.1)
+    queue.open()
+    await queue.enqueue("wamid.1", {"message": {"id": "wamid.1"}})
+    assert len(await queue.claim(1)) == 1
+    assert await MessageDeduplicator(storage_provider=storage, lease=0.05).claim("wamid.1") is True
+    queue.close()  # Muere sin completar ni liberar el mensaje
+
+    await asyncio.sleep(0.15)
+    queue = DurableJobQueue(path, visibility_timeout=0.1)
+    queue.open()
+    restarted = MessageDeduplicator(storage_provider=storage, lease=0.05)
+    retry = await queue.claim(1)
+
+    assert [job.job_key for job in retry] == ["wamid.1"] and retry[0].attempts == 2
+    assert await restarted.claim("wamid.1") is True
+    # Mientras el reintento está en curso, las reentregas siguen descartándose
+    assert await MessageDeduplicator(storage_provider=storage, lease=0.05).claim("wamid.1") is False
+    queue.close()
+
+
+async def test_release_allows_reprocessing():
+    """Un mensaje liberado tras un fallo puede volver a procesarse."""
+    storage = MockStorageProvider()
+    deduplicator = MessageDeduplicator(storage_provider=storage)
+
+    await deduplicator.claim("wamid.1")
+    await deduplicator.release("wamid.1")
+
+    assert "wamid.1" not in storage.seen_messages
+    assert await deduplicator.claim("wamid.1") is True
+
+
+async def test_messages_without_id_and_storage_errors_are_processed():
+    """Sin ID o con el almacenamiento caído el mensaje se procesa igualmente."""
+    deduplicator = MessageDeduplicator(storage_provider=FailingStorageProvider())
+
+    assert await deduplicator.claim(None) is True
+    assert await deduplicator.claim("wamid.1") is True
+    assert deduplicator.stats()["storage_errors"] == 1
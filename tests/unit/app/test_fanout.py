@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+
+from app.fanout import run_grouped
+
+
+@pytest.mark.asyncio
+async def test_run_grouped_keeps_sender_order_under_global_cap():
+    """Los mensajes de un remitente se procesan en orden y se respeta el límite global."""
+    messages = [
+        {"from": "a", "seq": 1},
+        {"from": "b", "seq": 1},
+        {"from": "a", "seq": 2},
+        {"from": "c", "seq": 1},
+        {"from": "a", "seq": 3},
+    ]
+    order = []
+    active = 0
+    peak = 0
+
+    async def handler(message):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        order.append((message["from"], message["seq"]))
+        active -= 1
+        return message["seq"]
+
+    results = await run_grouped(messages, key=lambda m: m["from"], handler=handler, max_concurrency=2)
+
+    assert results == [1, 1, 2, 1, 3]
+    assert [seq for sender, seq in order if sender == "a"] == [1, 2, 3]
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_run_grouped_isolates_failures():
+    """Un error en un mensaje no impide procesar los siguientes del mismo remitente."""
+    async def handler(message):
+        if message["seq"] == 1:
+            raise ValueError("boom")
+        return message["seq"]
+
+    results = await run_grouped(
+        [{"from": "a", "seq": 1}, {"from": "a", "seq": 2}],
+        key=lambda m: m["from"],
+        handler=handler,
+        max_concurrency=4
+    )
+
+    assert isinstance(results[0], ValueError)
+    assert results[1] == 2
@@ -0,0 +1,151 @@
+import asyncio
+import pytest
+
+from app.job_queue import DurableJobQueue, JobDispatcher, DEAD, DONE, PENDING
+from app.worker_pool import QueueFullError, WorkerPool
+
+# Usar exclusivamente asyncio para pruebas
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def queue(tmp_path):
+    """Cola persistente sobre un archivo temporal."""
+    job_queue = DurableJobQueue(str(tmp_path / "jobs.sqlite3"), visibility_timeout=30, max_attempts=2)
+    job_queue.open()
+    yield job_queue
+    job_queue.close()
+
+
+async def test_enqueue_ignores_duplicate_keys(queue):
+    """Un mensaje redelivered con la misma clave no crea un segundo trabajo."""
+    assert await queue.enqueue("wamid.1", {"message": {"id": "wamid.1"}}) is True
+    assert await queue.enqueue("wamid.1", {"message": {"id": "wamid.1"}}) is False
+    assert (await queue.stats())[PENDING] == 1
+
+
+async def test_enqueue_rejects_when_max_pending_reached(tmp_path):
+    """La cola rechaza trabajos nuevos al superar el máximo de pendientes."""
+    job_queue = DurableJobQueue(str(tmp_path / "jobs.sqlite3"), max_pending=1)
+    job_queue.open()
+    await job_queue.enqueue("a", {})
+    with pytest.raises(QueueFullError):
+        await job_queue.enqueue("b", {})
+    job_queue.close()
+
+
+async def test_claim_batches_and_survives_restart(tmp_path):
+    """Tras un reinicio solo se retoman los trabajos no terminados cuyo lease expiró."""
+    path = str(tmp_path / "jobs.sqlite3")
+    job_queue = DurableJobQueue(path, visibility_timeout=0.05)
+    job_queue.open()
+    for key in ("a", "b", "c"):
+        await job_queue.enqueue(key, {"key": key})
+
+    claimed = await job_queue.claim(2)
+    assert [job.job_key for job in claimed] == ["a", "b"]
+    await job_queue.complete(claimed[0].id, claimed[0].lease_token)
+    job_queue.close()  # Simula la caída del proceso con "b" en curso
+
+    await asyncio.sleep(0.1)
+    job_queue = DurableJobQueue(path, visibility_timeout=0.05)
+    job_queue.open()
+    reclaimed = await job_queue.claim(10)
+    assert sorted(job.job_key for job in reclaimed) == ["b", "c"]
+    assert next(job for job in reclaimed if job.job_key == "b").attempts == 2
+    assert (await job_queue.stats())[DONE] == 1
+    job_queue.close()
+
+
+async def test_fail_moves_job_to_dead_after_max_attempts(queue):
+    """Un trabajo que agota sus intentos queda como muerto."""
+    await queue.enqueue("a", {})
+    job = (await queue.claim(1))[0]
+    assert await queue.fail(job.id, job.lease_token, "boom") == PENDING
+
+    # Forzar que el trabajo esté disponible sin esperar el backoff
+    queue._execute("UPDATE jobs SET available_at = 0")
+    job = (await queue.claim(1))[0]
+    assert await queue.fail(job.id, job.lease_token, "boom") == DEAD
+    assert await queue.claim(1) == []
+
+
+async def test_dispatcher_runs_jobs_through_pool(queue):
+    """El dispatcher reclama trabajos y los marca como terminados al ejecutarse."""
+    pool = WorkerPool(concurrency=2, max_queue_size=10)
+    await pool.start()
+    processed = []
+
+    async def handler(payload):
+        processed.append(payload["key"])
+
+    dispatcher = JobDispatcher(queue, pool, handler, batch_size=2, poll_interval=0.01)
+    await dispatcher.start()
+    for key in ("a", "b", "c"):
+        await dispatcher.enqueue(key, {"key": key})
+
+    for _ in range(100):
+        if (await queue.stats())[DONE] == 3:
+            break
+        await asyncio.sleep(0.01)
+
+    await dispatcher.stop()
+    await pool.drain(timeout=5)
+    assert sorted(processed) == ["a", "b", "c"]
+    assert (await queue.stats())[DONE] == 3
+
+
+async def test_jobs_of_a_sender_wait_for_an_earlier_retry(queue):
+    """Un trabajo que espera su reintento bloquea los siguientes de su remitente, no los de otros."""
+    await queue.enqueue("a-1", {}, ordering_key="a")
+    await queue.enqueue("a-2", {}, ordering_key="a")
+    await queue.enqueue("b-1", {}, ordering_key="b")
+    await queue.enqueue("sin-orden", {})
+
+    claimed = await queue.claim(10)
+    assert [job.job_key for job in claimed] == ["a-1", "b-1", "sin-orden"]
+    first = claimed[0]
+    assert await queue.fail(first.id, first.lease_token, "503") == PENDING
+
+    # "a-1" espera su backoff y "a-2" no se adelanta
+    assert await queue.claim(10) == []
+
+    queue._execute("UPDATE jobs SET available_at = 0 WHERE job_key = 'a-1'")
+    retry = await queue.claim(10)
+    assert [job.job_key for job in retry] == ["a-1"]
+    await queue.complete(retry[0].id, retry[0].lease_token)
+    assert [job.job_key for job in await queue.claim(10)] == ["a-2"]
+
+
+async def test_queues_created_before_ordering_keys_are_migrated(tmp_path):
+    """Una cola con el esquema anterior gana la columna de orden al abrirse."""
+    import sqlite3
+
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, job_key TEXT NOT NULL UNIQUE, "
+        "payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+        "available_at REAL NOT NULL, lease_until REAL, lease_token TEXT, last_error TEXT, "
+        "created_at REAL NOT NULL, updated_at REAL NOT NULL);"
+        "INSERT INTO jobs (job_key, payload, status, available_at, created_at, updated_at) "
+        "VALUES ('viejo', '{}', 'pending', 0, 0, 0);"
+    )
+    conn.close()
+
+    job_queue = DurableJobQueue(path)
+    job_queue.open()
+    await job_queue.enqueue("nuevo", {}, ordering_key="a")
+    assert [job.job_key for job in await job_queue.claim(10)] == ["viejo", "nuevo"]
+    job_queue.close()
+
+
+async def test_dispatcher_stores_the_ordering_key_of_each_job(queue):
+    """El dispatcher guarda la clave de orden calculada con key_func."""
+    pool = WorkerPool(concurrency=1, max_queue_size=10)
+    dispatcher = JobDispatcher(queue, pool, lambda payload: None, key_func=lambda payload: payload["from"])
+
+    await dispatcher.enqueue_many([("m1", {"from": "573001"}), ("m2", {"from": "573002"})])
+
+    rows = queue._execute("SELECT job_key, ordering_key FROM jobs ORDER BY id").fetchall()
+    assert rows == [("m1", "573001"), ("m2", "573002")]
@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+
+import pytest
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import FunctionModel
+
+from agents.data_extraction_agent import extraction_agent
+from agents.validation import validate_invoice
+from app.model_tiers import ModelTier, TieredExtractor, estimate_cost, parse_model_tiers
+from models.dependencies import ExtractorAgentDependencies
+from models.invoice import Invoice
+
+INVOICE = {
+    "invoice_number": "INV-001",
+    "date": "2024-02-17T00:00:00",
+    "vendor_name": "Test Company",
+    "total_amount": 119.0,
+    "tax_amount": 19.0,
+    "items": [{"description": "Item 1", "quantity": 1, "unit_price": 100.0, "total": 100.0}],
+}
+
+
+def returning(invoice: dict, calls: list) -> FunctionModel:
+    """Modelo que devuelve siempre la factura indicada"""
+
+    def respond(messages, info):
+        calls.append(invoice)
+        return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, invoice)])
+
+    return FunctionModel(respond)
+
+
+def failing(calls: list) -> FunctionModel:
+    def respond(messages, info):
+        calls.append(None)
+        raise RuntimeError("modelo caído")
+
+    return FunctionModel(respond)
+
+
+def test_tiers_end_in_the_final_model():
+    assert parse_model_tiers("gpt-4o-mini", "gpt-4") == ["gpt-4o-mini", "gpt-4"]
+    assert parse_model_tiers("gpt-4, gpt-4o-mini,gpt-4o-mini", "gpt-4") == ["gpt-4o-mini", "gpt-4"]
+    assert parse_model_tiers("", "gpt-4") == ["gpt-4"]
+    assert estimate_cost("gpt-4o-mini", 1_000_000, 1_000_000) == pytest.approx(0.75)
+    assert estimate_cost("modelo-propio", 10, 10) is None
+
+
+def test_local_validation_checks_amounts_fields_and_dates():
+    invoice = Invoice(**INVOICE)
+    now = datetime(2024, 3, 1)
+
+    assert validate_invoice(invoice, now=now) == []
+    assert validate_invoice(invoice.model_copy(update={"total_amount": 200.0}), now=now) == [
+        "los ítems más el impuesto no suman el total"
+    ]
+    assert validate_invoice(invoice.model_copy(update={"vendor_name": " ", "items": []}), now=now) == [
+        "vendor_name vacío", "sin ítems"
+    ]
+    assert validate_invoice(invoice, now=now - timedelta(days=30)) == ["fecha futura"]
+    assert validate_invoice(invoice, now=now + timedelta(days=10 * 365)) == ["fecha demasiado antigua"]
+
+
+@pytest.mark.asyncio
+async def test_valid_results_from_the_cheap_tier_are_accepted():
+    cheap, large = [], []
+    extractor = TieredExtractor(extraction_agent, [
+        ModelTier("gpt-4o-mini", returning(INVOICE, cheap)),
+        ModelTier("gpt-4", returning(INVOICE, large)),
+    ], validate=lambda invoice: validate_invoice(invoice, now=datetime(2024, 3, 1)))
+
+    invoice = await extractor.run("texto", ExtractorAgentDependencies())
+
+    assert invoice.invoice_number == "INV-001"
+    assert (len(cheap), len(large)) == (1, 0)
+    stats = extractor.stats()
+    assert stats["escalation_rate"] == 0.0
+    assert stats["tiers"]["gpt-4o-mini"]["accepted"] == 1
+    assert stats["tiers"]["gpt-4o-mini"]["tokens"] > 0 and stats["tiers"]["gpt-4o-mini"]["cost_usd"] > 0
+
+
+@pytest.mark.asyncio
+async def test_invalid_or_failed_results_escalate_to_the_next_tier():
+    wrong, broken, large = [], [], []
+    validate = lambda invoice: validate_invoice(invoice, now=datetime(2024, 3, 1))
+    inconsistent = TieredExtractor(extraction_agent, [
+        ModelTier("gpt-4o-mini", returning({**INVOICE, "total_amount": 500.0}, wrong)),
+        ModelTier("gpt-4", returning(INVOICE, large)),
+    ], validate=validate)
+    failed = TieredExtractor(extraction_agent, [
+        ModelTier("gpt-4o-mini", failing(broken)),
+        ModelTier("gpt-4", returning(INVOICE, large)),
+    ], validate=validate)
+
+    first = await inconsistent.run("texto", ExtractorAgentDependencies())
+    second = await failed.run("texto", ExtractorAgentDependencies())
+
+    assert first.total_amount == 119.0 and second.total_amount == 119.0
+    assert (len(wrong), len(broken), len(large)) == (1, 1, 2)
+    assert inconsistent.stats()["tiers"]["gpt-4o-mini"]["escalated"] == 1
+    assert failed.stats()["tiers"]["gpt-4o-mini"]["errors"] == 1
+    assert failed.stats()["escalation_rate"] == 1.0
+    assert failed.stats()["tiers"]["gpt-4"]["accepted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_the_last_tier_is_accepted_even_if_invalid():
+    calls = []
+    extractor = TieredExtractor(extraction_agent, [
+        ModelTier("gpt-4", returning({**INVOICE, "total_amount": 500.0}, calls)),
+    ], max_reasks=0)
+
+    invoice = await extractor.run("texto", ExtractorAgentDependencies())
+
+    assert invoice.total_amount == 500.0 and len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_repairable_slips_do_not_need_a_second_call():
+    calls = []
+    slipped = {**INVOICE, "currency": "dólares", "items": [{**INVOICE["items"][0], "total": 10.0}]}
+    extractor = TieredExtractor(extraction_agent, [
+        ModelTier("gpt-4o-mini", returning(slipped, calls)),
+        ModelTier("gpt-4", returning(INVOICE, calls)),
+    ], validate=lambda invoice: validate_invoice(invoice, now=datetime(2024, 3, 1)))
+
+    invoice = await extractor.run("texto", ExtractorAgentDependencies())
+
+    assert len(calls) == 1
+    assert invoice.items[0].total == 100.0 and invoice.currency == "USD"
+    assert extractor.stats()["repairs"] == {"moneda": 1, "total del ítem": 1}
+
+
+@pytest.mark.asyncio
+async def test_unrepairable_fields_are_asked_again_with_a_targeted_prompt():
+    prompts = []
+    answers = [{**INVOICE, "total_amount": 500.0}, INVOICE]
+
+    def respond(messages, info):
+        prompts.append(messages[-1].parts[-1].content)
+        return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, answers.pop(0))])
+
+    extractor = TieredExtractor(
+        extraction_agent,
+        [ModelTier("gpt-4", FunctionModel(respond))],
+        validate=lambda invoice: validate_invoice(invoice, now=datetime(2024, 3, 1))
+    )
+
+    invoice = await extractor.run("TOTAL 119.00", ExtractorAgentDependencies())
+
+    assert invoice.total_amount == 119.0 and len(prompts) == 2
+    assert prompts[0] == "TOTAL 119.00"
+    assert "no suman el total" in prompts[1] and '"total_amount":500.0' in prompts[1]
+    assert extractor.stats()["reasks"] == 1 and extractor.stats()["reasks_resolved"] == 1
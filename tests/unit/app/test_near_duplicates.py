@@ -0,0 +1,80 @@
+import io
+import random
+
+import pytest
+
+from app.near_duplicates import BKTree, NearDuplicateIndex
+from providers.vision.preprocessing import hamming_distance
+
+
+def test_bk_tree_search_matches_brute_force():
+    rng = random.Random(7)
+    hashes = [rng.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for value in hashes:
+        tree.add(value, value)
+
+    query = hashes[10] ^ 0b1011  # 3 bits distintos
+    expected = sorted(h for h in hashes if hamming_distance(h, query) <= 20)
+    found = tree.search(query, 20)
+
+    assert sorted(h for _, h, _ in found) == expected
+    assert found[0][:2] == (3, hashes[10])
+    assert len(tree) == 500
+
+
+def test_index_matches_only_same_sender_within_threshold():
+    index = NearDuplicateIndex(max_distance=4)
+    index.add("+571", 0xFF00FF00FF00FF00, "factura-1")
+
+    match = index.lookup("+571", 0xFF00FF00FF00FF00 ^ 0b111)
+    assert match.value == "factura-1" and match.distance == 3
+    assert index.lookup("+572", 0xFF00FF00FF00FF00) is None
+    assert index.lookup("+571", 0xFF00FF00FF00FF00 ^ 0b11111) is None
+
+    stats = index.stats()
+    assert stats["lookups"] == 3
+    assert stats["matches"] == 1
+    assert stats["matches_by_distance"] == {3: 1}
+
+
+def test_index_evicts_oldest_entries_and_measures_false_positives():
+    index = NearDuplicateIndex(max_distance=0, max_entries_per_sender=2, verify_rate=1.0)
+    for value in (1, 2, 3):
+        index.add("+571", value, f"factura-{value}")
+
+    assert index.lookup("+571", 1) is None
+    assert index.lookup("+571", 3).value == "factura-3"
+
+    assert index.should_verify() is True
+    index.record_verification(True)
+    index.record_verification(False)
+    assert index.stats()["false_positive_rate"] == 0.5
+
+
+def test_dhash_is_stable_under_recompression_and_resizing():
+    Image = pytest.importorskip("PIL.Image")
+    from PIL import ImageDraw
+    from providers.vision.preprocessing import image_dhash
+
+    def render(seed):
+        image = Image.new("L", (1200, 1600), 255)
+        draw = ImageDraw.Draw(image)
+        rng = random.Random(seed)
+        for line in range(14):
+            draw.rectangle((100, 100 + line * 100, rng.randint(300, 1100), 140 + line * 100), fill=0)
+        return image
+
+    def encode(image, quality=90):
+        output = io.BytesIO()
+        image.convert("RGB").save(output, format="JPEG", quality=quality)
+        return output.getvalue()
+
+    invoice = render(1)
+    original = image_dhash(encode(invoice))
+    # Reenvío de WhatsApp: imagen reducida y recomprimida
+    forwarded = image_dhash(encode(invoice.resize((900, 1200)), quality=40))
+    other = image_dhash(encode(render(2)))
+
+    assert hamming_distance(original, forwarded) <= 24
+    assert hamming_distance(original, other) > 24
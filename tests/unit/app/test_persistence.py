@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import pytest
+from pymongo.errors import AutoReconnect, DuplicateKeyError, OperationFailure
+
+from app.persistence import InvoicePersister, is_transient_storage_error
+from models.invoice import Invoice, InvoiceItem
+from providers.resilience import RetryPolicy
+from tests.unit.mocks.providers import MockStorageProvider
+
+pytestmark = pytest.mark.asyncio
+
+
+def invoice():
+    return Invoice(
+        invoice_number="INV-001",
+        date=datetime(2024, 2, 17),
+        vendor_name="Test Company",
+        total_amount=119.0,
+        tax_amount=19.0,
+        items=[InvoiceItem(description="Item 1", quantity=1, unit_price=100.0, total=100.0)],
+    )
+
+
+class FlakyStorageProvider(MockStorageProvider):
+    """Lanza los errores indicados en los primeros guardados"""
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = list(errors)
+        self.attempts = 0
+
+    async def save_invoice(self, invoice):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return await super().save_invoice(invoice)
+
+
+class Sleeps:
+    def __init__(self):
+        self.delays = []
+
+    async def __call__(self, delay):
+        self.delays.append(delay)
+
+
+async def test_invoices_are_saved_with_a_typed_result():
+    storage = FlakyStorageProvider([])
+    persister = InvoicePersister(storage)
+
+    result = await persister.persist(invoice())
+
+    assert result.success and result.invoice_id == "INV-001"
+    assert storage.invoices["INV-001"].vendor_name == "Test Company"
+    assert persister.stats()["saved"] == 1 and persister.stats()["latency_p50"] is not None
+
+
+async def test_transient_errors_are_retried_with_backoff():
+    storage = FlakyStorageProvider([AutoReconnect("primario no disponible"), TimeoutError()])
+    sleeps = Sleeps()
+    persister = InvoicePersister(storage, retry_policy=RetryPolicy(max_attempts=3, base_delay=0.5), sleep=sleeps)
+
+    result = await persister.persist(invoice())
+
+    assert result.success and storage.attempts == 3
+    assert len(sleeps.delays) == 2 and all(0 <= delay <= 1.0 for delay in sleeps.delays)
+    assert persister.stats()["retries"] == 2
+
+
+async def test_permanent_errors_and_exhausted_retries_fail_without_raising():
+    sleeps = Sleeps()
+    permanent = InvoicePersister(FlakyStorageProvider([DuplicateKeyError("duplicado")]), sleep=sleeps)
+    exhausted = InvoicePersister(
+        FlakyStorageProvider([AutoReconnect("caído")] * 5),
+        retry_policy=RetryPolicy(max_attempts=2),
+        sleep=sleeps
+    )
+
+    first = await permanent.persist(invoice())
+    second = await exhausted.persist(invoice())
+
+    assert not first.success and "duplicado" in first.message
+    assert not second.success and exhausted.storage_provider.attempts == 2
+    assert len(sleeps.delays) == 1
+    assert permanent.stats()["failed"] == 1 and exhausted.stats()["failed"] == 1
+
+
+async def test_transient_errors_are_classified():
+    assert is_transient_storage_error(AutoReconnect("x"))
+    assert is_transient_storage_error(ConnectionResetError())
+    assert is_transient_storage_error(OperationFailure("x", details={"errorLabels": ["RetryableWriteError"]}))
+    assert not is_transient_storage_error(OperationFailure("x"))
+    assert not is_transient_storage_error(ValueError("x"))
@@ -0,0 +1,93 @@
+import io
+import os
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+from PIL import ImageDraw
+
+# app.pipeline carga la configuración de la aplicación al importarse
+for name, value in {
+    "WHATSAPP_TOKEN": "token",
+    "WHATSAPP_PHONE_NUMBER_ID": "1",
+    "WHATSAPP_VERIFY_TOKEN_WEBHOOK": "verify",
+    "MONGO_CONNECTION_STRING": "mongodb://localhost:1",
+}.items():
+    os.environ.setdefault(name, value)
+
+from app import pipeline
+from models.dependencies import ExtractorAgentDependencies, VisionAgentDependencies
+from models.invoice import Invoice, InvoiceItem
+from providers.vision.preprocessing import hamming_distance, image_dhash
+from tests.unit.mocks.providers import MockVisionProvider
+
+pytestmark = pytest.mark.asyncio
+
+
+def receipt(number, amounts):
+    """Recibo con la plantilla fija de un mismo vendedor; solo cambian número y montos"""
+    image = Image.new("L", (600, 1200), 255)
+    draw = ImageDraw.Draw(image)
+    draw.text((40, 40), "SUPERMERCADO LA ECONOMIA S.A.S.", fill=0)
+    draw.text((40, 70), "NIT: 900.123.456-7", fill=0)
+    draw.text((40, 100), f"FACTURA No. {number}", fill=0)
+    for line, amount in enumerate(amounts):
+        draw.text((40, 180 + line * 40), f"Producto {line + 1}", fill=0)
+        draw.text((420, 180 + line * 40), f"{amount:>8}", fill=0)
+    draw.text((40, 900), "TOTAL", fill=0)
+    draw.text((420, 900), f"{sum(amounts):>8}", fill=0)
+    output = io.BytesIO()
+    image.convert("RGB").save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+class ReceiptVisionProvider(MockVisionProvider):
+    """Devuelve la factura que corresponde a cada imagen"""
+
+    def __init__(self, invoices):
+        super().__init__()
+        self.invoices = invoices
+        self.calls = 0
+
+    async def extract_structured(self, image_data, model_name, api_key, output_type):
+        self.calls += 1
+        return {"data": self.invoices[image_data]}
+
+
+def invoice(number, total):
+    return Invoice(
+        invoice_number=number,
+        date=datetime(2024, 2, 17),
+        vendor_name="SUPERMERCADO LA ECONOMIA S.A.S.",
+        total_amount=total,
+        tax_amount=0.0,
+        items=[InvoiceItem(description="Producto", quantity=1, unit_price=total, total=total)],
+        currency="COP"
+    )
+
+
+async def test_different_receipts_with_the_same_layout_are_both_extracted():
+    first = receipt("FE-10234", [7000, 12900, 12600])
+    second = receipt("FE-10235", [3500, 12900, 4200])
+    # El dHash no separa recibos de una misma plantilla: con el umbral anterior serían "iguales"
+    assert hamming_distance(image_dhash(first), image_dhash(second)) <= 24
+
+    provider = ReceiptVisionProvider({first: invoice("FE-10234", 32500.0), second: invoice("FE-10235", 20600.0)})
+    vision_deps = VisionAgentDependencies(
+        vision_provider=provider,
+        model_name="gpt-4o",
+        api_key="key",
+        pipeline_mode="direct"
+    )
+    sent = AsyncMock()
+
+    with patch.multiple(pipeline, send_whatsapp_message=sent, get_image_from_whatsapp=AsyncMock(side_effect=[first, second])):
+        for message_id in ("wamid.1", "wamid.2"):
+            message = {"id": message_id, "from": "573001112233", "type": "image", "image": {"id": message_id}}
+            await pipeline.process_image(message, "+573001112233", vision_deps, ExtractorAgentDependencies())
+
+    # Con la configuración por defecto la segunda factura no reutiliza la primera
+    assert provider.calls == 2
+    assert "FE-10235" in sent.await_args_list[-1].args[1]
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import time
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+# app.pipeline carga la configuración de la aplicación al importarse
+for name, value in {
+    "WHATSAPP_TOKEN": "token",
+    "WHATSAPP_PHONE_NUMBER_ID": "1",
+    "WHATSAPP_VERIFY_TOKEN_WEBHOOK": "verify",
+    "MONGO_CONNECTION_STRING": "mongodb://localhost:1",
+}.items():
+    os.environ.setdefault(name, value)
+
+from app import pipeline
+from app.dedup import MessageDeduplicator
+from app.job_queue import DEAD, DONE, PENDING, DurableJobQueue, JobDispatcher
+from app.worker_pool import WorkerPool
+from models.dependencies import ExtractorAgentDependencies, VisionAgentDependencies
+from providers.resilience import ProviderRequestError, UpstreamServerError
+from tests.unit.mocks.providers import MockStorageProvider, MockVisionProvider
+
+pytestmark = pytest.mark.asyncio
+
+MESSAGE = {"id": "wamid.1", "from": "573001112233", "type": "image", "image": {"id": "media-1"}}
+
+
+class FailingVisionProvider(MockVisionProvider):
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+        self.calls = 0
+
+    async def extract_structured(self, image_data, model_name, api_key, output_type):
+        self.calls += 1
+        raise self.error
+
+
+async def run_through_dispatcher(tmp_path, error):
+    """Procesa MESSAGE con la cola persistente y devuelve la cola, el proveedor y los avisos enviados"""
+    provider = FailingVisionProvider(error)
+    vision_deps = VisionAgentDependencies(
+        vision_provider=provider,
+        model_name="gpt-4o",
+        api_key="key",
+        pipeline_mode="direct"
+    )
+    deduplicator = MessageDeduplicator(storage_provider=MockStorageProvider())
+    sent = AsyncMock()
+    queue = DurableJobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=2)
+    queue.open()
+    pool = WorkerPool(concurrency=1, max_queue_size=10)
+    await pool.start()
+    dispatcher = JobDispatcher(queue, pool, pipeline.process_queued_message, poll_interval=0.01)
+
+    with patch.multiple(
+        pipeline,
+        send_whatsapp_message=sent,
+        get_image_from_whatsapp=AsyncMock(return_value=b"imagen"),
+        get_message_deduplicator=lambda: deduplicator,
+        get_vision_provider=lambda: provider,
+        get_vision_deps=lambda _: vision_deps,
+        get_storage_provider=lambda: None,
+        get_storage_deps=lambda _: None,
+        get_extractor_deps=ExtractorAgentDependencies,
+        get_near_duplicate_index=lambda: None,
+    ):
+        await dispatcher.start()
+        await dispatcher.enqueue(MESSAGE["id"], {"message": MESSAGE})
+        for _ in range(200):
+            if provider.calls == 1 and not (await queue.stats())["running"]:
+                break
+            await asyncio.sleep(0.01)
+        row = queue._execute("SELECT status, attempts, available_at, last_error FROM jobs").fetchone()
+        if row[0] == PENDING:
+            # Saltar el backoff para comprobar el siguiente intento
+            queue._execute("UPDATE jobs SET available_at = 0")
+            dispatcher.notify()
+            for _ in range(200):
+                if provider.calls >= 2 and (await queue.stats())[DEAD]:
+                    break
+                await asyncio.sleep(0.01)
+        await dispatcher.stop()
+        await pool.drain(timeout=5)
+    return queue, provider, sent, row
+
+
+async def test_transient_provider_errors_are_retried_by_the_job_queue(tmp_path):
+    before = time.time()
+    queue, provider, sent, first_failure = await run_through_dispatcher(
+        tmp_path, UpstreamServerError("OpenAI devolvió 503", status=503)
+    )
+
+    status, attempts, available_at, last_error = first_failure
+    assert (status, attempts) == (PENDING, 1) and "503" in last_error
+    # Backoff exponencial de la cola: 2 s tras el primer intento
+    assert available_at >= before + 2
+    # El deduplicador liberó el mensaje, así que el reintento llegó al proveedor
+    assert provider.calls == 2
+    assert (await queue.stats())[DEAD] == 1
+    notices = [call.args[1] for call in sent.await_args_list]
+    assert sum("no está disponible" in notice for notice in notices) == 2
+    queue.close()
+
+
+async def test_permanent_errors_are_not_retried(tmp_path):
+    queue, provider, sent, first_failure = await run_through_dispatcher(
+        tmp_path, ProviderRequestError("imagen no válida", status=400)
+    )
+
+    assert first_failure[0] == DONE
+    assert provider.calls == 1
+    assert "asegúrate de enviar una imagen clara" in sent.await_args_list[-1].args[1]
+    queue.close()
+
+
+async def test_cancelled_jobs_release_the_message_for_the_next_run():
+    storage = MockStorageProvider()
+    deduplicator = MessageDeduplicator(storage_provider=storage)
+    started = asyncio.Event()
+
+    async def stuck(*args):
+        started.set()
+        await asyncio.sleep(60)
+
+    with patch.multiple(
+        pipeline,
+        handle_message=stuck,
+        get_message_deduplicator=lambda: deduplicator,
+        get_vision_provider=lambda: None,
+        get_vision_deps=lambda _: None,
+        get_storage_provider=lambda: None,
+        get_storage_deps=lambda _: None,
+        get_extractor_deps=lambda: None,
+    ):
+        # Un drenado que vence cancela el trabajo en curso
+        task = asyncio.create_task(pipeline.process_queued_message({"message": MESSAGE}))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    assert MESSAGE["id"] not in storage.seen_messages
+    assert await deduplicator.claim(MESSAGE["id"]) is True
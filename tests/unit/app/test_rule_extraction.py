@@ -0,0 +1,86 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from app.rule_extraction import RuleBasedExtractor, load_templates, parse_amount
+
+RECEIPT = """SUPERMERCADO LA ECONOMIA S.A.S.
+NIT: 900.123.456-7
+FACTURA DE VENTA No. FE-10234
+Fecha: 17/02/2024 10:35
+Arroz Diana 500g       2 x 3.500      7.000
+Aceite Premier 1L      1   12.900    12.900
+Leche entera 1,5L      3 x 4.200     12.600
+SUBTOTAL                             32.500
+IVA 19%                               6.175
+TOTAL                              $ 38.675
+EFECTIVO                           $ 50.000
+CAMBIO                             $ 11.325
+"""
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("$ 119.000", 119000.0),
+    ("1.234.567,89", 1234567.89),
+    ("1,234.50", 1234.5),
+    ("12,5", 12.5),
+    ("7", 7.0),
+    ("sin monto", None),
+])
+def test_amounts_in_local_formats_are_parsed(text, expected):
+    assert parse_amount(text) == expected
+
+
+def test_known_layout_is_extracted_without_the_llm():
+    extractor = RuleBasedExtractor()
+
+    invoice = extractor.extract(RECEIPT)
+
+    assert invoice.invoice_number == "FE-10234"
+    assert invoice.date == datetime(2024, 2, 17)
+    assert invoice.vendor_name == "SUPERMERCADO LA ECONOMIA S.A.S."
+    assert invoice.vendor_tax_id == "900.123.456-7"
+    assert (invoice.total_amount, invoice.tax_amount, invoice.currency) == (38675.0, 6175.0, "COP")
+    assert [(item.description, item.quantity, item.total) for item in invoice.items] == [
+        ("Arroz Diana 500g", 2, 7000.0),
+        ("Aceite Premier 1L", 1, 12900.0),
+        ("Leche entera 1,5L", 3, 12600.0),
+    ]
+    stats = extractor.stats()
+    assert stats["hits"] == 1 and stats["templates"]["co_nit_iva"]["hit_rate"] == 1.0
+
+
+def test_unknown_layouts_and_inconsistent_amounts_fall_back_to_the_agent():
+    extractor = RuleBasedExtractor()
+
+    assert extractor.extract("Invoice #123\nTotal due: 50.00") is None
+    assert extractor.extract(RECEIPT.replace("$ 38.675", "$ 39.675")) is None
+    assert extractor.extract(RECEIPT.replace("FACTURA DE VENTA No. FE-10234\n", "")) is None
+
+    stats = extractor.stats()
+    assert stats["texts"] == 3 and stats["fallbacks"] == 3
+    assert stats["templates"]["co_nit_iva"] == {
+        "matched": 2, "hits": 0, "incomplete": 1, "inconsistent": 1, "hit_rate": 0.0
+    }
+
+
+def test_templates_are_loaded_from_json(tmp_path):
+    path = tmp_path / "plantillas.json"
+    path.write_text(json.dumps([{
+        "name": "acme",
+        "detect": ["ACME CORP"],
+        "invoice_number": r"Invoice #(\S+)",
+        "date": r"Date: (\S+)",
+        "total": r"^Total: (\S+)$",
+        "tax": r"^Tax: (\S+)$",
+        "item": r"^- (?P<description>.+?) (?P<total>\d+\.\d{2})$",
+        "date_formats": ["%Y-%m-%d"],
+    }]))
+    extractor = RuleBasedExtractor(load_templates(str(path)))
+
+    invoice = extractor.extract("ACME CORP\nInvoice #A-1\nDate: 2024-03-01\n- Widget 10.00\n- Gadget 5.50\nTax: 1.55\nTotal: 17.05\n")
+
+    assert invoice.invoice_number == "A-1" and invoice.currency == "USD"
+    assert [item.unit_price for item in invoice.items] == [10.0, 5.5]
+    assert extractor.stats()["templates"]["acme"]["hits"] == 1
@@ -0,0 +1,45 @@
+import json
+
+from app.status_events import DeliveryMetrics, classify_payload, MESSAGES, STATUSES, UNKNOWN
+
+
+def _payload(value: dict) -> bytes:
+    return json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": value}]}]
+    }).encode()
+
+
+STATUS_ONLY = _payload({
+    "statuses": [
+        {"id": "wamid.1", "status": "delivered", "recipient_id": "573001112233"},
+        {"id": "wamid.2", "status": "failed", "errors": [{"code": 131047, "title": "Re-engagement message"}]}
+    ]
+})
+
+
+def test_status_only_payload_is_detected_despite_field_name():
+    """Todos los cambios llevan "field": "messages"; solo cuenta la clave "messages"."""
+    assert classify_payload(STATUS_ONLY) == STATUSES
+
+
+def test_message_payloads_take_the_full_path():
+    """Un payload con mensajes nunca se clasifica como de solo estados."""
+    text_with_keyword = _payload({
+        "messages": [{"id": "wamid.3", "type": "text", "text": {"body": '{"statuses": []}'}}],
+        "statuses": [{"id": "wamid.1", "status": "read"}]
+    })
+    assert classify_payload(text_with_keyword) == MESSAGES
+    assert classify_payload(_payload({"contacts": []})) == UNKNOWN
+    assert classify_payload(b"not json") == UNKNOWN
+
+
+def test_delivery_metrics_aggregate_statuses_and_errors():
+    """Las notificaciones de estado se agregan en contadores en lugar de descartarse."""
+    metrics = DeliveryMetrics()
+    metrics.record_payload(STATUS_ONLY)
+
+    stats = metrics.stats()
+    assert stats["payloads"] == 1
+    assert stats["by_status"] == {"delivered": 1, "failed": 1}
+    assert stats["errors_by_code"] == {"131047": 1}
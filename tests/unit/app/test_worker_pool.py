@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+
+from app.worker_pool import Job, QueueFullError, WorkerPool
+
+# Usar exclusivamente asyncio para pruebas
+pytestmark = pytest.mark.asyncio
+
+
+async def test_pool_respects_concurrency_limit():
+    """El pool nunca ejecuta más trabajos simultáneos que su concurrencia."""
+    pool = WorkerPool(concurrency=2, max_queue_size=10)
+    await pool.start()
+    active = 0
+    peak = 0
+
+    async def job():
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+
+    for i in range(6):
+        pool.submit(Job(name=f"job-{i}", func=job))
+
+    assert await pool.drain(timeout=5) is True
+    assert peak == 2
+    assert pool.stats()["processed"] == 6
+
+
+async def test_pool_rejects_when_queue_is_full():
+    """Cuando la cola está llena se lanza QueueFullError."""
+    pool = WorkerPool(concurrency=1, max_queue_size=1)
+    await pool.start()
+    release = asyncio.Event()
+
+    pool.submit(Job(name="blocking", func=release.wait))
+    await asyncio.sleep(0)  # El worker toma el primer trabajo
+    pool.submit(Job(name="queued", func=release.wait))
+
+    with pytest.raises(QueueFullError):
+        pool.submit(Job(name="rejected", func=release.wait))
+    assert pool.stats()["rejected"] == 1
+
+    release.set()
+    assert await pool.drain(timeout=5) is True
+
+
+async def test_pool_survives_failing_jobs_and_stops_accepting_after_drain():
+    """Un trabajo que falla no detiene al worker y el pool drenado no acepta más trabajos."""
+    pool = WorkerPool(concurrency=1, max_queue_size=10)
+    await pool.start()
+    done = []
+
+    async def failing():
+        raise ValueError("boom")
+
+    async def ok():
+        done.append(True)
+
+    pool.submit(Job(name="failing", func=failing))
+    pool.submit(Job(name="ok", func=ok))
+    await pool.drain(timeout=5)
+
+    assert done == [True]
+    assert pool.stats()["failed"] == 1
+    with pytest.raises(RuntimeError):
+        pool.submit(Job(name="late", func=ok))
+
+
+async def test_pool_runs_jobs_with_same_key_in_order():
+    """Los trabajos con la misma clave se ejecutan de uno en uno y en orden de llegada."""
+    pool = WorkerPool(concurrency=4, max_queue_size=10)
+    await pool.start()
+    order = []
+    running_per_key = {}
+
+    async def job(key, seq):
+        running_per_key[key] = running_per_key.get(key, 0) + 1
+        assert running_per_key[key] == 1
+        await asyncio.sleep(0.01)
+        order.append((key, seq))
+        running_per_key[key] -= 1
+
+    for seq in range(3):
+        pool.submit(Job(name=f"a-{seq}", func=job, args=("a", seq), key="a"))
+        pool.submit(Job(name=f"b-{seq}", func=job, args=("b", seq), key="b"))
+
+    assert pool.stats()["backlogged"] == 4
+    assert await pool.drain(timeout=5) is True
+    assert [seq for key, seq in order if key == "a"] == [0, 1, 2]
+    assert [seq for key, seq in order if key == "b"] == [0, 1, 2]
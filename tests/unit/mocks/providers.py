@@ -1,5 +1,6 @@
 from typing import Dict, Any, Optional, List
 from datetime import datetime
+import time
 
 from providers.vision.base import VisionProvider
 from providers.storage.base import StorageProvider
@@ -27,6 +28,7 @@ class MockStorageProvider(StorageProvider):
     
     def __init__(self):
         self.invoices = {}
+        self.seen_messages = {}
         self.next_id = "INV-001"
     
     async def save_invoice(self, invoice: Invoice) -> str:
@@ -68,3 +70,22 @@ class MockStorageProvider(StorageProvider):
             del self.invoices[invoice_id]
             return True
         return False
+    
+    async def mark_message_seen(self, message_id: str, lease_seconds: Optional[float] = None) -> bool:
+        """Simula el registro de un mensaje; guarda el fin de su lease (None si está procesado)."""
+        now = time.monotonic()
+        if message_id in self.seen_messages:
+            lease_until = self.seen_messages[message_id]
+            if lease_seconds is None or lease_until is None or lease_until > now:
+                return False
+        self.seen_messages[message_id] = now + lease_seconds if lease_seconds is not None else None
+        return True
+    
+    async def complete_message_seen(self, message_id: str) -> None:
+        """Simula la finalización de un mensaje reclamado con lease."""
+        if message_id in self.seen_messages:
+            self.seen_messages[message_id] = None
+    
+    async def forget_message_seen(self, message_id: str) -> None:
+        """Simula la eliminación del registro de un mensaje."""
+        self.seen_messages.pop(message_id, None)
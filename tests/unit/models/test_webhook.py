@@ -0,0 +1,61 @@
+import pytest
+from pydantic import ValidationError
+
+from models.webhook import WebhookPayload
+
+
+RAW_BATCH = b"""{
+  "object": "whatsapp_business_account",
+  "entry": [
+    {"id": "1", "changes": [
+      {"field": "messages", "value": {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550000000", "phone_number_id": "123"},
+        "contacts": [{"profile": {"name": "Ana"}, "wa_id": "573001112233"}],
+        "messages": [
+          {"from": "573001112233", "id": "wamid.1", "timestamp": "1700000000", "type": "text", "text": {"body": "hola"}},
+          {"from": "573001112233", "id": "wamid.2", "timestamp": "1700000001", "type": "image",
+           "image": {"id": "media-1", "mime_type": "image/jpeg", "sha256": "abc"}}
+        ]
+      }}
+    ]},
+    {"id": "2", "changes": [
+      {"field": "messages", "value": {"statuses": [{"id": "wamid.9", "status": "read", "recipient_id": "573009"}]}},
+      {"field": "messages", "value": {"messages": [{"from": "+573004445566", "id": "wamid.3", "type": "sticker"}]}}
+    ]}
+  ]
+}"""
+
+
+def test_parses_every_message_and_status_from_raw_bytes():
+    """Se validan todas las entradas y cambios del payload directamente desde los bytes."""
+    payload = WebhookPayload.model_validate_json(RAW_BATCH)
+
+    assert [message.id for message in payload.iter_messages()] == ["wamid.1", "wamid.2", "wamid.3"]
+    assert [status.status for status in payload.iter_statuses()] == ["read"]
+
+    image_message = list(payload.iter_messages())[1]
+    assert image_message.image.id == "media-1"
+    assert image_message.sender == "+573001112233"
+
+
+def test_message_payload_keeps_whatsapp_field_names():
+    """El mensaje serializado conserva el campo 'from' y omite los campos vacíos."""
+    payload = WebhookPayload.model_validate_json(RAW_BATCH)
+    message = next(payload.iter_messages())
+
+    assert message.to_payload() == {
+        "id": "wamid.1",
+        "from": "573001112233",
+        "timestamp": "1700000000",
+        "type": "text",
+        "text": {"body": "hola"}
+    }
+    # Los mensajes de tipos no modelados conservan sus campos básicos
+    assert list(payload.iter_messages())[2].to_payload()["type"] == "sticker"
+
+
+def test_invalid_json_raises_validation_error():
+    """Un cuerpo que no es JSON válido produce un error de validación."""
+    with pytest.raises(ValidationError):
+        WebhookPayload.model_validate_json(b"{not json")
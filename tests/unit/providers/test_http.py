@@ -0,0 +1,52 @@
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from providers.http import HttpClientRegistry
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def server():
+    async def ok(request):
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/ok", ok)
+    async with TestServer(app) as test_server:
+        yield test_server
+
+
+async def test_session_is_shared_and_connections_are_reused(server):
+    registry = HttpClientRegistry(limit_per_host=2)
+    url = str(server.make_url("/ok"))
+    try:
+        assert registry.session(url) is registry.session(url)
+        for _ in range(5):
+            async with registry.session(url).get(url) as response:
+                assert (await response.json()) == {"ok": True}
+
+        stats = registry.stats()["hosts"][HttpClientRegistry._origin(url)]
+        assert stats["requests"] == 5
+        assert stats["connections_created"] == 1
+        assert stats["connections_reused"] == 4
+        assert stats["open"] is True
+    finally:
+        await registry.close()
+
+    assert registry.session(url).closed is False
+    await registry.close()
+
+
+async def test_sessions_are_per_host():
+    registry = HttpClientRegistry()
+    try:
+        openai = registry.session("https://api.openai.com/v1/chat/completions")
+        assert registry.session("https://api.openai.com/v1/models") is openai
+        assert registry.session("https://graph.facebook.com/v18.0/123") is not openai
+        with pytest.raises(ValueError):
+            registry.session("/relative/path")
+    finally:
+        await registry.close()
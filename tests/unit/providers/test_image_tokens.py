@@ -0,0 +1,44 @@
+import pytest
+
+from providers.vision.image_tokens import (
+    estimate_image_tokens,
+    get_sizing_policy,
+    scaled_dimensions,
+    tile_grid,
+)
+
+
+def test_estimates_follow_openai_tiling_rules():
+    # Ejemplos de la documentación de OpenAI
+    assert scaled_dimensions(2048, 4096) == (768, 1536)
+    assert estimate_image_tokens(2048, 4096) == 1105
+    assert estimate_image_tokens(1024, 1024) == 765
+    assert estimate_image_tokens(4096, 8192, "low") == 85
+    assert tile_grid(512, 512) == (1, 1)
+    with pytest.raises(ValueError):
+        estimate_image_tokens(0, 100)
+
+
+def test_fit_policy_keeps_tokens_and_never_upscales():
+    assert get_sizing_policy("fit").plan(3000, 4000) == get_sizing_policy("fit").plan(768, 1024)
+    plan = get_sizing_policy("fit").plan(3000, 4000)
+    assert (plan.width, plan.height) == (768, 1024)
+    assert plan.tokens == estimate_image_tokens(3000, 4000)
+    assert get_sizing_policy("fit").plan(400, 300).width == 400
+
+
+def test_min_tiles_policy_respects_legibility_floor():
+    receipt = get_sizing_policy("min_tiles", min_short_side=512).plan(1000, 3000)
+    assert tile_grid(receipt.width, receipt.height) == (1, 4)
+    assert receipt.tokens < estimate_image_tokens(1000, 3000)
+    assert min(receipt.width, receipt.height) >= 512
+
+    strict = get_sizing_policy("min_tiles", min_short_side=768).plan(3000, 4000)
+    assert (strict.width, strict.height) == (768, 1024)
+
+
+def test_low_detail_policy_and_unknown_policy():
+    plan = get_sizing_policy("low").plan(3000, 4000)
+    assert (plan.width, plan.height, plan.detail, plan.tokens) == (384, 512, "low", 85)
+    with pytest.raises(ValueError):
+        get_sizing_policy("tiny")
@@ -0,0 +1,104 @@
+import io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from providers.vision.image_tokens import estimate_image_tokens
+from providers.vision.preprocessing import ImagePreprocessor, detect_image_format, preprocess_image
+
+
+def _image_bytes(size=(3000, 4000), color=(240, 240, 240), format="JPEG", orientation=None, mode="RGB"):
+    image = Image.new(mode, size, color)
+    output = io.BytesIO()
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(output, format=format, exif=exif.tobytes())
+    else:
+        image.save(output, format=format)
+    return output.getvalue()
+
+
+def test_detect_image_format():
+    assert detect_image_format(_image_bytes(format="PNG")) == "image/png"
+    assert detect_image_format(_image_bytes()) == "image/jpeg"
+    assert detect_image_format(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert detect_image_format(b"not an image") is None
+
+
+def test_downscales_rotates_and_converts_documents_to_grayscale():
+    # Orientación 6: la foto se tomó con el teléfono girado 90 grados
+    result = preprocess_image(_image_bytes(size=(4000, 3000), orientation=6), max_long_edge=2048)
+
+    assert result.size == (1536, 2048)
+    assert result.original_size == (4000, 3000)
+    assert result.operations == ["orientation", "grayscale", "resize", "recompress"]
+    assert result.mime_type == "image/jpeg"
+    assert Image.open(io.BytesIO(result.data)).mode == "L"
+    assert result.tokens_after == estimate_image_tokens(1536, 2048)
+
+
+def test_keeps_color_and_converts_png_with_transparency_to_jpeg():
+    result = preprocess_image(
+        _image_bytes(size=(800, 600), color=(255, 0, 0, 128), format="PNG", mode="RGBA"),
+        grayscale="auto"
+    )
+
+    assert result.mime_type == "image/jpeg"
+    assert "grayscale" not in result.operations
+    assert Image.open(io.BytesIO(result.data)).mode == "RGB"
+
+
+def test_small_images_are_not_made_larger():
+    original = _image_bytes(size=(64, 64))
+    result = preprocess_image(original, quality=95, grayscale="never")
+
+    assert result.processed_bytes <= len(original)
+    assert result.size == (64, 64)
+
+
+def test_unreadable_images_pass_through():
+    result = preprocess_image(b"\xff\xd8\xff corrupted")
+
+    assert result.data == b"\xff\xd8\xff corrupted"
+    assert result.mime_type == "image/jpeg"
+    assert result.tokens_after is None
+
+
+@pytest.mark.asyncio
+async def test_preprocessor_runs_in_executor():
+    preprocessor = ImagePreprocessor(max_long_edge=1024)
+    result = await preprocessor.process(_image_bytes(size=(2048, 1024)))
+
+    assert result.size == (1024, 512)
+    assert result.processed_bytes < result.original_bytes
+
+
+@pytest.mark.asyncio
+async def test_sizing_policy_reduces_tiles_and_reports_tokens_saved():
+    from providers.vision.image_tokens import get_sizing_policy
+
+    preprocessor = ImagePreprocessor(sizing_policy=get_sizing_policy("min_tiles", min_short_side=512))
+    result = await preprocessor.process(_image_bytes(size=(3000, 4000)))
+
+    assert result.size == (512, 682)
+    assert result.tokens_after == 425
+    stats = preprocessor.stats()
+    assert stats["sizing_policy"] == "min_tiles"
+    assert stats["tokens_saved"] == result.tokens_before - result.tokens_after == 340
+
+
+@pytest.mark.asyncio
+async def test_recent_images_are_decoded_once():
+    preprocessor = ImagePreprocessor(recent=1)
+    first, second = _image_bytes(size=(800, 600)), _image_bytes(size=(600, 800))
+
+    # El pipeline calcula la huella y el proveedor de visión reutiliza el resultado
+    fingerprint = (await preprocessor.process(first)).dhash
+    assert (await preprocessor.process(first)).dhash == fingerprint is not None
+    await preprocessor.process(second)
+    await preprocessor.process(first)
+
+    stats = preprocessor.stats()
+    assert (stats["images"], stats["reused"]) == (3, 1)
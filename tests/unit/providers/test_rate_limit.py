@@ -0,0 +1,171 @@
+from contextlib import asynccontextmanager
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from pydantic_ai import Agent
+from pydantic_ai.models.test import TestModel
+
+from providers.http import HttpClientRegistry
+from providers.rate_limit import (
+    RateLimitedModel,
+    RateLimiter,
+    RateLimitRegistry,
+    SharedRateLimiter,
+    set_rate_limits
+)
+from providers.vision.openai_provider import OpenAIVisionProvider
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeTime:
+    """Reloj y sleep simulados: dormir avanza el reloj"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+async def test_requests_queue_locally_until_the_bucket_refills():
+    fake = FakeTime()
+    limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=10000, clock=fake.clock, sleep=fake.sleep)
+
+    await limiter.acquire(100)
+    await limiter.acquire(100)
+    await limiter.acquire(100)
+
+    # La tercera solicitud espera a que se recargue una (2 por minuto = 1 cada 30 s)
+    assert fake.sleeps == [pytest.approx(30.0)]
+    stats = limiter.stats()
+    assert stats["acquired"] == 3 and stats["delayed"] == 1
+    assert stats["wait_seconds"] == pytest.approx(30.0)
+
+
+async def test_token_estimates_are_reconciled_with_actual_usage():
+    fake = FakeTime()
+    limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=6000, clock=fake.clock, sleep=fake.sleep)
+
+    reservation = await limiter.acquire(5000)
+    assert limiter.stats()["tokens_available"] == 1000
+    await limiter.reconcile(reservation, 1200)
+    assert limiter.stats()["tokens_available"] == 4800
+
+    # Con el saldo devuelto, la siguiente llamada no espera
+    await limiter.acquire(4000)
+    assert fake.sleeps == []
+    assert limiter.stats()["actual_tokens"] == 1200
+
+
+async def test_headers_correct_limits_and_remaining_budget():
+    fake = FakeTime()
+    limiter = RateLimiter(requests_per_minute=500, tokens_per_minute=30000, clock=fake.clock, sleep=fake.sleep)
+
+    await limiter.update_from_headers({
+        "x-ratelimit-limit-requests": "5000",
+        "x-ratelimit-remaining-requests": "4999",
+        "x-ratelimit-limit-tokens": "800000",
+        "x-ratelimit-remaining-tokens": "1000",
+    })
+
+    stats = limiter.stats()
+    assert stats["requests_per_minute"] == 5000 and stats["tokens_per_minute"] == 800000
+    assert stats["requests_available"] == 500
+    assert stats["tokens_available"] == 1000
+    assert stats["header_syncs"] == 1
+
+
+async def test_shared_limiters_split_one_budget_between_processes(tmp_path):
+    path = str(tmp_path / "rate_limits.sqlite3")
+    first = SharedRateLimiter(path, "gpt-4o", requests_per_minute=2, tokens_per_minute=10000)
+    second = SharedRateLimiter(path, "gpt-4o", requests_per_minute=2, tokens_per_minute=10000)
+    other_model = SharedRateLimiter(path, "gpt-4", requests_per_minute=2, tokens_per_minute=10000)
+    try:
+        assert await first._try_take(100) == 0
+        assert await second._try_take(100) == 0
+        assert await first._try_take(100) > 25
+        assert await second._try_take(100) > 25
+        assert await other_model._try_take(100) == 0
+    finally:
+        for limiter in (first, second, other_model):
+            limiter.close()
+
+
+async def test_pydantic_ai_models_go_through_the_limiter():
+    registry = RateLimitRegistry(requests_per_minute=100, tokens_per_minute=100000)
+    set_rate_limits(registry)
+    try:
+        agent = Agent(RateLimitedModel(TestModel()))
+        result = await agent.run("Extrae la factura")
+    finally:
+        set_rate_limits(None)
+
+    stats = registry.stats()["models"]["test"]
+    assert stats["acquired"] == 1
+    assert stats["actual_tokens"] == result.usage().total_tokens
+    assert stats["estimated_tokens"] > stats["actual_tokens"]
+
+
+class UnavailableStreamModel(TestModel):
+    """Modelo cuyo stream falla al abrirse, como un 5xx de OpenAI"""
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters):
+        raise RuntimeError("OpenAI devolvió 503")
+        yield
+
+
+async def test_reservations_are_returned_when_a_stream_fails_to_open():
+    registry = RateLimitRegistry(requests_per_minute=100, tokens_per_minute=100000)
+    set_rate_limits(registry)
+    try:
+        agent = Agent(RateLimitedModel(UnavailableStreamModel()))
+        with pytest.raises(RuntimeError):
+            async with agent.run_stream("Extrae la factura"):
+                pass
+    finally:
+        set_rate_limits(None)
+
+    stats = registry.stats()["models"]["test"]
+    assert stats["acquired"] == 1 and stats["actual_tokens"] == 0
+    assert stats["tokens_available"] == 100000
+
+
+@pytest_asyncio.fixture
+async def server():
+    async def completions(request):
+        return web.json_response(
+            {"choices": [{"message": {"content": "FACTURA"}}], "usage": {"total_tokens": 900}},
+            headers={"x-ratelimit-limit-tokens": "450000", "x-ratelimit-remaining-tokens": "440000"},
+        )
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    async with TestServer(app) as test_server:
+        yield test_server
+
+
+async def test_vision_provider_charges_and_reconciles_the_model_limiter(server):
+    clients = HttpClientRegistry()
+    registry = RateLimitRegistry(requests_per_minute=100, tokens_per_minute=30000)
+    provider = OpenAIVisionProvider(http_clients=clients, rate_limits=registry)
+    provider.api_base = str(server.make_url("/v1"))
+    try:
+        await provider.process_image(b"imagen", "gpt-4o", "key")
+    finally:
+        await clients.close()
+
+    stats = registry.stats()["models"]["gpt-4o"]
+    assert stats["acquired"] == 1
+    # Imagen (peor caso sin dimensiones) + prompt + max_tokens
+    assert stats["estimated_tokens"] > 2000
+    assert stats["actual_tokens"] == 900
+    assert stats["tokens_per_minute"] == 450000
@@ -0,0 +1,203 @@
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from providers.http import HttpClientRegistry
+from providers.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ProviderAuthError,
+    ProviderTimeoutError,
+    RateLimitError,
+    ResilienceRegistry,
+    RetryPolicy,
+    UpstreamServerError,
+    error_from_exception,
+    error_from_status,
+    parse_retry_after
+)
+from providers.vision.openai_provider import OpenAIVisionProvider
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest_asyncio.fixture
+async def server():
+    """Servidor falso de OpenAI que responde con los fallos programados en `failures`"""
+    failures = []
+    calls = []
+
+    async def completions(request):
+        calls.append(request.path)
+        if failures:
+            status, headers = failures.pop(0)
+            return web.json_response({"error": {"message": f"fallo {status}"}}, status=status, headers=headers)
+        return web.json_response({
+            "choices": [{"message": {"content": "FACTURA INV-001"}}],
+            "usage": {"total_tokens": 900},
+        })
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    async with TestServer(app) as test_server:
+        test_server.failures = failures
+        test_server.calls = calls
+        yield test_server
+
+
+@pytest_asyncio.fixture
+async def clients():
+    registry = HttpClientRegistry()
+    yield registry
+    await registry.close()
+
+
+def make_provider(server, clients, resilience):
+    provider = OpenAIVisionProvider(http_clients=clients, resilience=resilience)
+    provider.api_base = str(server.make_url("/v1"))
+    return provider
+
+
+def make_resilience(delays, clock=None, **kwargs):
+    async def sleep(delay):
+        delays.append(delay)
+
+    return ResilienceRegistry(sleep=sleep, clock=clock or FakeClock(), **kwargs)
+
+
+def test_retry_after_is_parsed_in_seconds_milliseconds_and_dates():
+    assert parse_retry_after({"Retry-After": "7"}) == 7.0
+    assert parse_retry_after({"retry-after-ms": "1500", "Retry-After": "2"}) == 1.5
+    assert 0 < parse_retry_after({"Retry-After": "Wed, 21 Oct 2099 07:28:00 GMT"})
+    assert parse_retry_after({"Retry-After": "luego"}) is None
+    assert parse_retry_after({}) is None
+
+
+def test_errors_are_typed_by_status():
+    assert isinstance(error_from_status(429, headers={"Retry-After": "3"}), RateLimitError)
+    assert error_from_status(429, headers={"Retry-After": "3"}).retry_after == 3.0
+    assert isinstance(error_from_status(503), UpstreamServerError)
+    assert isinstance(error_from_status(401), ProviderAuthError)
+    assert not error_from_status(400).retryable
+
+
+def test_backoff_uses_full_jitter_and_honors_retry_after():
+    policy = RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=4.0, max_retry_after=10.0)
+    server_error = UpstreamServerError("503")
+
+    assert all(0 <= policy.delay(1, server_error) <= 1.0 for _ in range(50))
+    assert all(0 <= policy.delay(4, server_error) <= 4.0 for _ in range(50))
+    assert policy.delay(5, server_error) is None
+    assert 6.0 <= policy.delay(1, RateLimitError("429", retry_after=6.0)) <= 7.0
+    assert policy.delay(1, RateLimitError("429", retry_after=30.0)) is None
+    assert policy.delay(1, ProviderAuthError("401")) is None
+
+
+def test_circuit_opens_fails_fast_and_lets_one_probe_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    clock.now = 10.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.times_opened == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limits_and_server_errors_are_retried(server, clients):
+    delays = []
+    provider = make_provider(server, clients, make_resilience(delays))
+    server.failures.extend([(429, {"Retry-After": "2"}), (502, {})])
+
+    result = await provider.process_image(b"imagen", "gpt-4o", "key")
+
+    assert result["extracted_text"] == "FACTURA INV-001"
+    assert len(server.calls) == 3
+    assert 2.0 <= delays[0] <= 2.5 and delays[1] <= 1.0
+    stats = provider.resilience.stats()["hosts"][str(server.make_url("")).rstrip("/")]
+    assert stats["retries"] == 2 and stats["circuit"] == "closed"
+
+
+@pytest.mark.asyncio
+async def test_errors_are_raised_instead_of_returned_as_text(server, clients):
+    delays = []
+    provider = make_provider(server, clients, make_resilience(delays))
+    server.failures.append((401, {}))
+
+    with pytest.raises(ProviderAuthError):
+        await provider.process_image(b"imagen", "gpt-4o", "key")
+    # Un 4xx no se reintenta
+    assert len(server.calls) == 1 and delays == []
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast_while_the_upstream_is_down(server, clients):
+    clock = FakeClock()
+    resilience = make_resilience(
+        [], clock, retry_policy=RetryPolicy(max_attempts=2), failure_threshold=3, reset_timeout=30.0
+    )
+    provider = make_provider(server, clients, resilience)
+    server.failures.extend([(503, {})] * 4)
+
+    with pytest.raises(UpstreamServerError):
+        await provider.process_image(b"imagen", "gpt-4o", "key")
+    with pytest.raises(UpstreamServerError):
+        await provider.process_image(b"imagen", "gpt-4o", "key")
+    # Tercer fallo seguido: el circuito se abre y ya no se llama al servidor
+    assert len(server.calls) == 3
+    with pytest.raises(CircuitOpenError):
+        await provider.process_image(b"imagen", "gpt-4o", "key")
+    assert len(server.calls) == 3
+
+    # Pasado el tiempo de espera, una llamada de prueba exitosa cierra el circuito
+    server.failures.clear()
+    clock.now = 30.0
+    assert (await provider.process_image(b"imagen", "gpt-4o", "key"))["extracted_text"] == "FACTURA INV-001"
+    assert resilience.breaker(provider.api_base).state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error, idempotent, attempts", [
+    (UpstreamServerError("503", status=503), True, 3),
+    # Tras un 5xx o un timeout la solicitud pudo haberse procesado
+    (UpstreamServerError("503", status=503), False, 1),
+    (ProviderTimeoutError("timeout"), False, 1),
+    # Un 429 o un fallo al conectar garantizan que no se procesó
+    (RateLimitError("429", status=429), False, 3),
+    (error_from_exception(aiohttp.ClientConnectorError(
+        SimpleNamespace(host="graph.facebook.com", port=443, ssl=True), OSError(111, "Conexión rechazada")
+    )), False, 3),
+])
+async def test_non_idempotent_calls_are_only_retried_when_the_request_was_not_processed(error, idempotent, attempts):
+    delays = []
+    resilience = make_resilience(delays)
+    calls = []
+
+    async def operation():
+        calls.append(1)
+        raise error
+
+    with pytest.raises(type(error)):
+        await resilience.call("https://graph.facebook.com/v18.0", operation, idempotent=idempotent)
+    assert len(calls) == attempts and len(delays) == attempts - 1
@@ -0,0 +1,11 @@
+from collections import deque
+
+from providers.stats import percentile
+
+
+def test_percentile_uses_the_nearest_rank():
+    latencies = deque([0.4, 0.1, 0.3, 0.2, 1.0])
+
+    assert percentile(latencies, 0.5) == 0.3
+    assert percentile(latencies, 0.95) == 1.0
+    assert percentile([], 0.5) is None
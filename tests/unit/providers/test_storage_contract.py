@@ -0,0 +1,111 @@
+"""
+Pruebas de contrato de los proveedores de MongoDB.
+
+Ambos proveedores (pymongo en hilos y motor nativo) deben comportarse igual;
+se ejecutan contra mongomock y mongomock-motor, sin servidor.
+"""
+import pytest
+import pytest_asyncio
+from unittest.mock import patch
+
+mongomock = pytest.importorskip("mongomock")
+
+from models.invoice import Invoice
+
+def _pymongo_provider():
+    from providers.storage.mongodb_provider import MongoDBProvider
+    with patch("providers.storage.mongodb_provider.MongoClient", mongomock.MongoClient):
+        return MongoDBProvider("mongodb://test")
+
+
+def _motor_provider():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from providers.storage.motor_provider import MotorMongoDBProvider
+    with patch("providers.storage.motor_provider.AsyncIOMotorClient", mongomock_motor.AsyncMongoMockClient):
+        return MotorMongoDBProvider("mongodb://test")
+
+
+@pytest_asyncio.fixture(params=["pymongo", "motor"])
+async def provider(request):
+    provider = _pymongo_provider() if request.param == "pymongo" else _motor_provider()
+    await provider.ensure_indexes()
+    yield provider
+    await provider.close()
+
+
+@pytest.mark.asyncio
+async def test_save_get_and_delete(provider, sample_invoice):
+    assert await provider.save_invoice(sample_invoice) == "TEST-001"
+    stored = await provider.get_invoice("TEST-001")
+    # BSON guarda las fechas con precisión de milisegundos
+    assert stored.model_dump(exclude={"date"}) == sample_invoice.model_dump(exclude={"date"})
+    assert abs((stored.date - sample_invoice.date).total_seconds()) < 0.001
+
+    assert await provider.delete_invoice("TEST-001") is True
+    assert await provider.get_invoice("TEST-001") is None
+    assert await provider.delete_invoice("TEST-001") is False
+
+
+@pytest.mark.asyncio
+async def test_save_existing_invoice_replaces_it(provider, sample_invoice):
+    await provider.save_invoice(sample_invoice)
+    updated = sample_invoice.model_copy(update={"vendor_name": "Otro Vendedor"})
+    await provider.save_invoice(updated)
+
+    assert (await provider.get_invoice("TEST-001")).vendor_name == "Otro Vendedor"
+
+
+@pytest.mark.asyncio
+async def test_list_invoices_filters_by_vendor(provider, sample_invoice):
+    await provider.save_invoice(sample_invoice)
+    await provider.save_invoice(sample_invoice.model_copy(update={"invoice_number": "TEST-002", "vendor_name": "B"}))
+
+    assert {i.invoice_number for i in await provider.list_invoices()} == {"TEST-001", "TEST-002"}
+    assert [i.invoice_number for i in await provider.list_invoices(vendor_name="B")] == ["TEST-002"]
+
+
+@pytest.mark.asyncio
+async def test_seen_messages(provider):
+    assert await provider.mark_message_seen("wamid.1") is True
+    assert await provider.mark_message_seen("wamid.1") is False
+    await provider.forget_message_seen("wamid.1")
+    assert await provider.mark_message_seen("wamid.1") is True
+
+
+@pytest.mark.asyncio
+async def test_seen_messages_in_progress_are_taken_over_when_the_lease_expires(provider):
+    assert await provider.mark_message_seen("wamid.1", lease_seconds=0) is True
+    # El lease venció sin completarse: otro worker lo retoma
+    assert await provider.mark_message_seen("wamid.1", lease_seconds=60) is True
+    assert await provider.mark_message_seen("wamid.1", lease_seconds=60) is False
+
+    await provider.complete_message_seen("wamid.1")
+    assert await provider.mark_message_seen("wamid.1", lease_seconds=0) is False
+    assert await provider.mark_message_seen("wamid.1", lease_seconds=0) is False
+
+
+@pytest.mark.asyncio
+async def test_save_invoices_upserts_in_bulk(provider, sample_invoice):
+    await provider.save_invoice(sample_invoice)
+    invoices = [
+        sample_invoice.model_copy(update={"vendor_name": "Actualizado"}),
+        sample_invoice.model_copy(update={"invoice_number": "TEST-002"}),
+    ]
+
+    assert await provider.save_invoices(invoices) == ["TEST-001", "TEST-002"]
+    assert (await provider.get_invoice("TEST-001")).vendor_name == "Actualizado"
+    assert await provider.get_invoice("TEST-002") is not None
+    assert await provider.save_invoices([]) == []
+
+
+def test_bulk_write_errors_are_mapped_to_each_invoice(sample_invoice):
+    from pymongo.errors import BulkWriteError, WriteError
+    from providers.storage.mongodb_provider import bulk_write_results
+
+    invoices = [sample_invoice, sample_invoice.model_copy(update={"invoice_number": "TEST-002"})]
+    error = BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}]})
+
+    results = bulk_write_results(invoices, error)
+
+    assert results[0] == "TEST-001"
+    assert isinstance(results[1], WriteError)
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from pydantic import ValidationError
+
+from models.invoice import Invoice
+from providers.http import HttpClientRegistry
+from providers.resilience import ProviderError, ResilienceRegistry, RetryPolicy
+from providers.vision.openai_provider import OpenAIVisionProvider, strict_json_schema
+from tests.unit.mocks.providers import MockVisionProvider
+
+pytestmark = pytest.mark.asyncio
+
+INVOICE = {
+    "invoice_number": "INV-001",
+    "date": "2024-02-17T00:00:00",
+    "vendor_name": "Test Company",
+    "vendor_tax_id": None,
+    "total_amount": 119.0,
+    "tax_amount": 19.0,
+    "items": [{"description": "Item 1", "quantity": 1, "unit_price": 100.0, "total": 100.0}],
+    "currency": "USD",
+}
+
+
+def _objects(node):
+    if isinstance(node, dict):
+        if "properties" in node:
+            yield node
+        for value in node.values():
+            yield from _objects(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _objects(value)
+
+
+async def test_schema_follows_the_strict_mode_subset():
+    schema = strict_json_schema(Invoice)
+
+    objects = list(_objects(schema))
+    assert len(objects) == 2
+    for node in objects:
+        assert node["additionalProperties"] is False
+        assert set(node["required"]) == set(node["properties"])
+    serialized = json.dumps(schema)
+    assert '"default"' not in serialized and '"title"' not in serialized and '"example"' not in serialized
+    # Los campos opcionales siguen admitiendo null
+    assert {"type": "null"} in schema["properties"]["vendor_tax_id"]["anyOf"]
+
+
+@pytest_asyncio.fixture
+async def server():
+    responses = []
+    requests = []
+
+    async def completions(request):
+        requests.append(await request.json())
+        message = responses.pop(0)
+        return web.json_response({"choices": [{"message": message}], "usage": {"total_tokens": 1500}})
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    async with TestServer(app) as test_server:
+        test_server.responses = responses
+        test_server.requests = requests
+        yield test_server
+
+
+@pytest_asyncio.fixture
+async def provider(server):
+    clients = HttpClientRegistry()
+    provider = OpenAIVisionProvider(
+        http_clients=clients,
+        resilience=ResilienceRegistry(retry_policy=RetryPolicy(max_attempts=1))
+    )
+    provider.api_base = str(server.make_url("/v1"))
+    yield provider
+    await clients.close()
+
+
+async def test_image_is_extracted_to_an_invoice_in_one_call(server, provider):
+    server.responses.append({"content": json.dumps(INVOICE)})
+
+    result = await provider.extract_structured(b"imagen", "gpt-4o", "key", Invoice)
+
+    assert isinstance(result["data"], Invoice)
+    assert result["data"].invoice_number == "INV-001" and result["data"].total_amount == 119.0
+    assert result["usage"]["total_tokens"] == 1500
+    assert len(server.requests) == 1
+    response_format = server.requests[0]["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["strict"] is True
+    assert response_format["json_schema"]["schema"] == strict_json_schema(Invoice)
+
+
+async def test_refusals_and_invalid_invoices_raise(server, provider):
+    server.responses.append({"content": None, "refusal": "No puedo ayudar con eso"})
+    server.responses.append({"content": json.dumps({**INVOICE, "total_amount": 0})})
+
+    with pytest.raises(ProviderError, match="negó"):
+        await provider.extract_structured(b"imagen", "gpt-4o", "key", Invoice)
+    with pytest.raises(ValidationError):
+        await provider.extract_structured(b"imagen", "gpt-4o", "key", Invoice)
+
+
+async def test_providers_without_structured_outputs_say_so():
+    with pytest.raises(NotImplementedError):
+        await MockVisionProvider().extract_structured(b"imagen", "gpt-4o", "key", Invoice)
@@ -0,0 +1,130 @@
+import stat
+import sys
+
+import pytest
+
+from providers.vision.tesseract_provider import (
+    ConfidenceRoutingVisionProvider,
+    TesseractVisionProvider,
+    parse_tesseract_tsv
+)
+from tests.unit.mocks.providers import MockVisionProvider
+
+HEADER = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"
+
+
+def tsv(lines, confidence):
+    rows = [HEADER, "1\t1\t0\t0\t0\t0\t0\t0\t800\t600\t-1\t"]
+    for line_num, line in enumerate(lines, start=1):
+        rows.append(f"4\t1\t1\t1\t{line_num}\t0\t0\t0\t100\t20\t-1\t")
+        for word_num, word in enumerate(line.split(), start=1):
+            rows.append(f"5\t1\t1\t1\t{line_num}\t{word_num}\t0\t0\t10\t10\t{confidence}\t{word}")
+    return "\n".join(rows) + "\n"
+
+
+RECEIPT = ["FACTURA INV-001", "Vendedor: Test Company", "Total: 119.00 USD"]
+
+
+def fake_tesseract(tmp_path, output, exit_code=0):
+    """Ejecutable que imita a tesseract: lee la imagen por stdin y escribe el TSV"""
+    script = tmp_path / "tesseract"
+    script.write_text(
+        f"#!{sys.executable}\n"
+        "import sys\n"
+        "sys.stdin.buffer.read()\n"
+        f"sys.stdout.write({output!r})\n"
+        f"sys.exit({exit_code})\n"
+    )
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script)
+
+
+class CountingVisionProvider(MockVisionProvider):
+    def __init__(self):
+        self.calls = 0
+
+    async def process_image(self, image_data, model_name, api_key, **kwargs):
+        self.calls += 1
+        return await super().process_image(image_data, model_name, api_key, **kwargs)
+
+
+def test_tsv_is_parsed_into_lines_and_word_confidences():
+    text, words = parse_tesseract_tsv(tsv(RECEIPT, 91.5))
+
+    assert text == "\n".join(RECEIPT)
+    assert len(words) == 8
+    assert words[0] == {"text": "FACTURA", "confidence": 0.915}
+
+
+@pytest.mark.asyncio
+async def test_tesseract_runs_in_a_subprocess_and_reports_confidence(tmp_path):
+    provider = TesseractVisionProvider(command=fake_tesseract(tmp_path, tsv(RECEIPT, 90)), max_processes=2)
+
+    result = await provider.process_image(b"imagen", "gpt-4o", "key")
+
+    assert result["provider"] == "tesseract"
+    assert result["extracted_text"].startswith("FACTURA INV-001")
+    assert result["confidence"] == 0.9
+    assert provider.stats()["images"] == 1
+
+
+@pytest.mark.asyncio
+async def test_tesseract_failures_raise(tmp_path):
+    failing = TesseractVisionProvider(command=fake_tesseract(tmp_path, "", exit_code=1))
+    missing = TesseractVisionProvider(command=str(tmp_path / "no-existe"))
+
+    with pytest.raises(RuntimeError):
+        await failing.process_image(b"imagen", "gpt-4o", "key")
+    with pytest.raises(RuntimeError, match="no está instalado"):
+        await missing.process_image(b"imagen", "gpt-4o", "key")
+    assert not missing.available()
+
+
+@pytest.mark.asyncio
+async def test_confident_ocr_skips_the_vision_model(tmp_path):
+    fallback = CountingVisionProvider()
+    router = ConfidenceRoutingVisionProvider(
+        TesseractVisionProvider(command=fake_tesseract(tmp_path, tsv(RECEIPT, 95))),
+        fallback,
+        min_confidence=0.8,
+        min_words=5
+    )
+
+    result = await router.process_image(b"imagen", "gpt-4o", "key")
+
+    assert fallback.calls == 0
+    assert result["routed_to"] == "local" and result["provider"] == "tesseract"
+    assert router.stats()["local_ratio"] == 1.0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("confidence, min_words", [(55, 5), (95, 50)])
+async def test_low_confidence_or_too_few_words_fall_back(tmp_path, confidence, min_words):
+    fallback = CountingVisionProvider()
+    router = ConfidenceRoutingVisionProvider(
+        TesseractVisionProvider(command=fake_tesseract(tmp_path, tsv(RECEIPT, confidence))),
+        fallback,
+        min_words=min_words
+    )
+
+    result = await router.process_image(b"imagen", "gpt-4o", "key")
+
+    assert fallback.calls == 1
+    assert result["routed_to"] == "fallback" and result["provider"] == "mock_provider"
+    assert result["local_confidence"] == confidence / 100
+
+
+@pytest.mark.asyncio
+async def test_missing_tesseract_falls_back_when_streaming(tmp_path):
+    fallback = CountingVisionProvider()
+    router = ConfidenceRoutingVisionProvider(
+        TesseractVisionProvider(command=str(tmp_path / "no-existe")),
+        fallback
+    )
+
+    stream = router.stream_image(b"imagen", "gpt-4o", "key")
+    text = await stream.read()
+
+    assert "INV-001" in text
+    assert stream.result()["routed_to"] == "fallback"
+    assert router.stats()["local_errors"] == 1 and fallback.calls == 1
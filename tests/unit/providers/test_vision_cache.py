@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from providers.vision.cache import CachingVisionProvider, SqliteResultCache
+from providers.vision.routing import LatencyRoutingVisionProvider, VisionBackend
+from tests.unit.mocks.providers import MockVisionProvider
+
+pytestmark = pytest.mark.asyncio
+
+
+class CountingVisionProvider(MockVisionProvider):
+    """Cuenta las llamadas reales al proveedor"""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.calls = 0
+        self.delay = delay
+        self.fail = fail
+
+    async def process_image(self, image_data, model_name, api_key, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            return {"extracted_text": "Error", "model": model_name, "provider": "mock", "usage": {}, "error": True}
+        return {
+            "extracted_text": f"texto {len(image_data)}",
+            "model": model_name,
+            "provider": "mock",
+            "usage": {"total_tokens": 900},
+        }
+
+
+async def test_identical_images_hit_the_memory_cache():
+    inner = CountingVisionProvider()
+    provider = CachingVisionProvider(inner)
+
+    first = await provider.process_image(b"imagen", "gpt-4o", "key")
+    second = await provider.process_image(b"imagen", "gpt-4o", "otra-key")
+    other_model = await provider.process_image(b"imagen", "gpt-4o-mini", "key")
+
+    assert inner.calls == 2
+    assert "cached" not in first
+    assert second["cached"] is True and second["extracted_text"] == first["extracted_text"]
+    assert "cached" not in other_model
+    stats = provider.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["bytes_saved"] == len(b"imagen")
+    assert stats["tokens_saved"] == 900
+
+
+async def test_routed_backends_are_part_of_the_cache_key():
+    def router(*specs):
+        return LatencyRoutingVisionProvider([
+            VisionBackend(name, CountingVisionProvider(), model_name=model) for name, model in specs
+        ])
+
+    default = router(("gpt-4o", "gpt-4o"))
+    with_mini = router(("gpt-4o", "gpt-4o"), ("gpt-4o-mini@https://proxy/v1", "gpt-4o-mini"))
+    reordered = router(("gpt-4o-mini@https://proxy/v1", "gpt-4o-mini"), ("gpt-4o", "gpt-4o"))
+
+    def key(provider):
+        return CachingVisionProvider(provider).cache_key(b"imagen", "gpt-4o")
+
+    # Otro conjunto de backends puede producir otro texto aunque se pida el mismo modelo
+    assert key(default) != key(with_mini)
+    assert key(with_mini) == key(reordered)
+
+
+async def test_concurrent_requests_share_one_call_and_errors_are_not_cached():
+    inner = CountingVisionProvider(delay=0.01)
+    provider = CachingVisionProvider(inner)
+    results = await asyncio.gather(*(provider.process_image(b"imagen", "gpt-4o", "key") for _ in range(5)))
+    assert inner.calls == 1
+    assert provider.stats()["shared_in_flight"] == 4
+    assert all(r["extracted_text"] == results[0]["extracted_text"] for r in results)
+
+    failing = CountingVisionProvider(fail=True)
+    provider = CachingVisionProvider(failing)
+    await provider.process_image(b"imagen", "gpt-4o", "key")
+    await provider.process_image(b"imagen", "gpt-4o", "key")
+    assert failing.calls == 2
+
+
+async def test_disk_cache_survives_restarts(tmp_path):
+    path = str(tmp_path / "vision.sqlite3")
+
+    disk = SqliteResultCache(path, ttl=60)
+    disk.open()
+    inner = CountingVisionProvider()
+    await CachingVisionProvider(inner, disk_cache=disk).process_image(b"imagen", "gpt-4o", "key")
+    disk.close()
+
+    # Nuevo proceso: caché en memoria vacía, mismo archivo
+    disk = SqliteResultCache(path, ttl=60)
+    disk.open()
+    provider = CachingVisionProvider(inner, disk_cache=disk)
+    result = await provider.process_image(b"imagen", "gpt-4o", "key")
+    assert inner.calls == 1
+    assert result["cached"] is True
+    assert provider.stats()["disk_hits"] == 1
+    disk.close()
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+from providers.resilience import ProviderRequestError, UpstreamServerError
+from providers.vision.routing import LatencyRoutingVisionProvider, VisionBackend, parse_vision_backends
+from tests.unit.mocks.providers import MockVisionProvider
+
+
+class SlowVisionProvider(MockVisionProvider):
+    """Proveedor simulado con latencia configurable que anota llamadas y cancelaciones"""
+
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.models = []
+        self.cancelled = 0
+
+    async def process_image(self, image_data, model_name, api_key, **kwargs):
+        self.models.append(model_name)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return await super().process_image(image_data, model_name, api_key, **kwargs)
+
+
+def backend(name, provider, latencies=()):
+    result = VisionBackend(name, provider, model_name=name)
+    for latency in latencies:
+        result.record(latency, ok=True, now=0.0)
+    return result
+
+
+def test_backends_are_parsed_from_settings():
+    assert parse_vision_backends("gpt-4o, gpt-4o-mini@https://proxy.local/v1,") == [
+        ("gpt-4o", None),
+        ("gpt-4o-mini", "https://proxy.local/v1"),
+    ]
+    assert parse_vision_backends("") == []
+
+
+@pytest.mark.asyncio
+async def test_requests_go_to_the_fastest_healthy_backend():
+    slow, fast, fresh = SlowVisionProvider(), SlowVisionProvider(), SlowVisionProvider()
+    router = LatencyRoutingVisionProvider([
+        backend("slow", slow, [2.0] * 5),
+        backend("fast", fast, [0.5] * 5),
+    ])
+
+    result = await router.process_image(b"imagen", "gpt-4o", "key")
+    assert result["backend"] == "fast" and fast.models == ["fast"] and slow.models == []
+
+    # Un backend sin mediciones se prueba antes que los ya medidos
+    router.backends.append(backend("fresh", fresh))
+    assert (await router.process_image(b"imagen", "gpt-4o", "key"))["backend"] == "fresh"
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_the_loser_cancelled():
+    stalled = SlowVisionProvider(delay=5.0)
+    healthy = SlowVisionProvider(delay=0.01)
+    router = LatencyRoutingVisionProvider(
+        [backend("primary", stalled, [0.01] * 20), backend("secondary", healthy, [0.05] * 20)],
+        hedging=True,
+        min_hedge_delay=0.02
+    )
+
+    result = await asyncio.wait_for(router.process_image(b"imagen", "gpt-4o", "key"), timeout=1.0)
+
+    assert result["backend"] == "secondary"
+    assert stalled.cancelled == 1
+    stats = router.stats()
+    assert stats["hedges"] == 1 and stats["hedges_won"] == 1
+    # El perdedor cancelado se cuenta, pero su tiempo (una cota inferior) no entra en la latencia
+    loser = router.backends[0]
+    assert loser.stats()["cancelled"] == 1 and loser.samples == 20 and loser.latency == pytest.approx(0.01)
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_without_enough_samples_or_when_primary_is_fast():
+    primary = SlowVisionProvider(delay=0.01)
+    secondary = SlowVisionProvider()
+    router = LatencyRoutingVisionProvider(
+        [backend("primary", primary, [0.05] * 20), backend("secondary", secondary, [0.1] * 3)],
+        hedging=True,
+        min_hedge_delay=0.0
+    )
+
+    assert (await router.process_image(b"imagen", "gpt-4o", "key"))["backend"] == "primary"
+    assert router.stats()["hedges"] == 0 and secondary.models == []
+
+
+@pytest.mark.asyncio
+async def test_a_single_backend_is_never_hedged_against_itself():
+    only = SlowVisionProvider(delay=0.05)
+    router = LatencyRoutingVisionProvider(
+        [backend("only", only, [0.01] * 20)],
+        hedging=True,
+        min_hedge_delay=0.01
+    )
+
+    assert (await router.process_image(b"imagen", "gpt-4o", "key"))["backend"] == "only"
+    assert only.models == ["only"] and only.cancelled == 0
+    assert router.stats()["hedges"] == 0
+
+
+@pytest.mark.asyncio
+async def test_server_errors_fail_over_and_mark_the_backend_down():
+    now = [0.0]
+    broken = SlowVisionProvider(error=UpstreamServerError("503", status=503))
+    healthy = SlowVisionProvider()
+    router = LatencyRoutingVisionProvider(
+        [backend("broken", broken, [0.1] * 5), backend("healthy", healthy, [0.5] * 5)],
+        max_error_rate=0.15,
+        recovery_seconds=30.0,
+        clock=lambda: now[0]
+    )
+
+    result = await router.process_image(b"imagen", "gpt-4o", "key")
+    assert result["backend"] == "healthy" and router.stats()["failovers"] == 1
+
+    # Caído: el tráfico va al sano aunque sea más lento, hasta que pasa el tiempo de recuperación
+    await router.process_image(b"imagen", "gpt-4o", "key")
+    assert len(broken.models) == 1
+    now[0] = 31.0
+    assert router.ranked()[0].name == "broken"
+
+
+@pytest.mark.asyncio
+async def test_request_errors_are_not_retried_on_another_backend():
+    invalid = SlowVisionProvider(error=ProviderRequestError("imagen no válida", status=400))
+    other = SlowVisionProvider()
+    router = LatencyRoutingVisionProvider([backend("first", invalid), backend("second", other)])
+
+    with pytest.raises(ProviderRequestError):
+        await router.process_image(b"imagen", "gpt-4o", "key")
+    assert other.models == []
+    assert router.backends[0].error_rate == 0.0
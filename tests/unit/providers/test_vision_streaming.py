@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from providers.http import HttpClientRegistry
+from providers.vision.cache import CachingVisionProvider
+from providers.vision.openai_provider import OpenAIVisionProvider
+from providers.vision.streaming import VisionStreamMetrics
+from tests.unit.mocks.providers import MockVisionProvider
+
+pytestmark = pytest.mark.asyncio
+
+CHUNKS = ["FACTURA ", "Número: INV-001\n", "Total: 119.00 USD"]
+
+
+@pytest_asyncio.fixture
+async def server():
+    requests = []
+
+    async def completions(request):
+        payload = await request.json()
+        requests.append(payload)
+        if payload["model"] == "falla":
+            return web.json_response({"error": {"message": "model not found"}}, status=400)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for chunk in CHUNKS:
+            event = {"choices": [{"index": 0, "delta": {"content": chunk}}]}
+            await response.write(f"data: {json.dumps(event)}\n\n".encode())
+            await asyncio.sleep(0.02)
+        usage = {"choices": [], "usage": {"prompt_tokens": 800, "completion_tokens": 20, "total_tokens": 820}}
+        await response.write(f"data: {json.dumps(usage)}\n\ndata: [DONE]\n\n".encode())
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    async with TestServer(app) as test_server:
+        test_server.requests = requests
+        yield test_server
+
+
+@pytest_asyncio.fixture
+async def provider(server):
+    registry = HttpClientRegistry()
+    provider = OpenAIVisionProvider(http_clients=registry)
+    provider.api_base = str(server.make_url("/v1"))
+    yield provider
+    await registry.close()
+
+
+async def test_openai_stream_yields_text_incrementally(server, provider):
+    stream = provider.stream_image(b"imagen", "gpt-4o", "key")
+    received = []
+    async for chunk in stream:
+        received.append(chunk)
+        # El texto parcial está disponible antes de que termine la respuesta
+        assert stream.text == "".join(received)
+        assert not stream.done
+
+    assert received == CHUNKS
+    assert server.requests[0]["stream"] is True
+    assert 0 < stream.time_to_first_token < stream.total_time
+    result = stream.result()
+    assert result["extracted_text"] == "".join(CHUNKS)
+    assert result["provider"] == "openai"
+    assert result["usage"]["total_tokens"] == 820
+    assert result["timings"]["total_time"] == stream.total_time
+
+
+async def test_openai_stream_raises_on_api_errors(provider):
+    with pytest.raises(Exception, match="model not found"):
+        await provider.stream_image(b"imagen", "falla", "key").read()
+
+
+async def test_default_stream_wraps_process_image():
+    stream = MockVisionProvider().stream_image(b"imagen", "gpt-4o", "key")
+
+    assert [chunk async for chunk in stream] == [stream.text]
+    assert stream.result()["provider"] == "mock_provider"
+    assert "INV-001" in stream.text
+    with pytest.raises(RuntimeError):
+        stream.__aiter__()
+
+
+async def test_cached_streams_are_served_in_one_chunk(server, provider):
+    caching = CachingVisionProvider(provider)
+    metrics = VisionStreamMetrics()
+
+    first = caching.stream_image(b"imagen", "gpt-4o", "key")
+    assert [chunk async for chunk in first] == CHUNKS
+    metrics.record(first)
+    second = caching.stream_image(b"imagen", "gpt-4o", "key")
+    assert [chunk async for chunk in second] == ["".join(CHUNKS)]
+    metrics.record(second)
+
+    assert len(server.requests) == 1
+    assert second.details["cached"] is True
+    assert second.result()["usage"]["total_tokens"] == 820
+    # El resultado en streaming también sirve a process_image
+    assert (await caching.process_image(b"imagen", "gpt-4o", "key"))["cached"] is True
+    assert caching.stats()["memory_hits"] == 2
+    stats = metrics.stats()
+    assert stats["streams"] == 2 and stats["cached"] == 1
+    assert stats["time_to_first_token_p50"] == first.time_to_first_token
@@ -0,0 +1,114 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from providers.vision.tiling import TilingVisionProvider, plan_tiles, stitch_tile_texts
+from tests.unit.mocks.providers import MockVisionProvider
+
+RECEIPT_LINES = [f"{index:02d} PRODUCTO {index} 1 x {index}.50" for index in range(1, 31)]
+
+
+def jpeg(width, height):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(output, format="JPEG")
+    return output.getvalue()
+
+
+class TileReadingProvider(MockVisionProvider):
+    """Devuelve el texto de cada franja según su posición y mide cuántas se procesan a la vez"""
+
+    def __init__(self, tile_texts):
+        self.tile_texts = tile_texts
+        self.sizes = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def process_image(self, image_data, model_name, api_key, **kwargs):
+        index = len(self.sizes)
+        self.sizes.append(Image.open(io.BytesIO(image_data)).size)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return {
+            "extracted_text": self.tile_texts[index],
+            "model": model_name,
+            "provider": "mock_provider",
+            "usage": {"total_tokens": 1000},
+        }
+
+
+def test_only_tall_images_are_tiled_and_tiles_cover_the_image():
+    assert plan_tiles(1000, 1400) == [(0, 1400)]
+
+    tiles = plan_tiles(1000, 6000, tile_aspect_ratio=2.0, overlap=0.15)
+    assert len(tiles) == 4
+    assert tiles[0][0] == 0 and tiles[-1][1] == 6000
+    assert all(bottom - top == 2000 for top, bottom in tiles)
+    # Cada franja se solapa con la siguiente
+    assert all(tiles[i + 1][0] < tiles[i][1] for i in range(len(tiles) - 1))
+
+    # Si no alcanzan las franjas permitidas, se hacen más altas
+    limited = plan_tiles(500, 10000, tile_aspect_ratio=2.0, max_tiles=3)
+    assert len(limited) == 3 and limited[-1][1] == 10000
+    assert all(limited[i + 1][0] < limited[i][1] for i in range(2))
+
+
+def test_overlapping_lines_are_removed_when_stitching():
+    first = "\n".join(RECEIPT_LINES[:12] + ["13 PRODU"])
+    # La línea cortada por el borde aparece completa en la franja siguiente, con otro espaciado
+    second = "\n".join(["ODUCTO 10 1 x", "11  producto 11 1 x 11.50"] + RECEIPT_LINES[11:22])
+    third = "\n".join(RECEIPT_LINES[19:])
+
+    assert stitch_tile_texts([first, second, third]) == "\n".join(RECEIPT_LINES)
+
+
+def test_tiles_without_a_reliable_overlap_are_concatenated():
+    assert stitch_tile_texts(["TOTAL", "1", "TOTAL"]) == "TOTAL\n1\nTOTAL"
+    assert stitch_tile_texts(["A\nx 1", "x 1\nB"]) == "A\nx 1\nx 1\nB"
+
+
+def test_every_tiling_parameter_is_part_of_the_cache_key():
+    inner = MockVisionProvider()
+    base = TilingVisionProvider(inner).prompt_version
+
+    assert TilingVisionProvider(inner, min_aspect_ratio=3.0).prompt_version != base
+    assert TilingVisionProvider(inner, tile_aspect_ratio=1.5).prompt_version != base
+    assert TilingVisionProvider(inner, overlap=0.2).prompt_version != base
+    assert TilingVisionProvider(inner, max_tiles=4).prompt_version != base
+
+
+@pytest.mark.asyncio
+async def test_tall_receipts_are_processed_as_concurrent_tiles():
+    tile_texts = [
+        "\n".join(RECEIPT_LINES[:10]),
+        "\n".join(RECEIPT_LINES[8:20]),
+        "\n".join(RECEIPT_LINES[18:27]),
+        "\n".join(RECEIPT_LINES[25:]),
+    ]
+    inner = TileReadingProvider(tile_texts)
+    provider = TilingVisionProvider(inner, tile_aspect_ratio=2.0, overlap=0.15)
+
+    result = await provider.process_image(jpeg(300, 1800), "gpt-4o", "key")
+
+    assert result["tiles"] == 4 and inner.max_in_flight == 4
+    assert all(size == (300, 600) for size in inner.sizes)
+    assert result["extracted_text"] == "\n".join(RECEIPT_LINES)
+    assert result["usage"] == {"total_tokens": 4000}
+    assert provider.stats()["tiled"] == 1
+
+
+@pytest.mark.asyncio
+async def test_regular_images_go_through_untouched_also_when_streaming():
+    provider = TilingVisionProvider(MockVisionProvider())
+    image = jpeg(800, 1200)
+
+    result = await provider.process_image(image, "gpt-4o", "key")
+    stream = provider.stream_image(image, "gpt-4o", "key")
+    text = await stream.read()
+
+    assert "tiles" not in result
+    assert text == result["extracted_text"] and stream.result()["provider"] == "mock_provider"
+    assert provider.stats() == {"images": 2, "tiled": 0, "tiles": 0, "average_tiles": None}
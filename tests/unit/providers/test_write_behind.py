@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from providers.storage.write_behind import WriteBehindStorageProvider
+from tests.unit.mocks.providers import MockStorageProvider
+
+pytestmark = pytest.mark.asyncio
+
+
+class RecordingStorageProvider(MockStorageProvider):
+    """Registra cada lote recibido y falla las facturas indicadas"""
+
+    def __init__(self, failing=()):
+        super().__init__()
+        self.batches = []
+        self.failing = set(failing)
+
+    async def save_invoices(self, invoices):
+        self.batches.append([invoice.invoice_number for invoice in invoices])
+        results = []
+        for invoice in invoices:
+            if invoice.invoice_number in self.failing:
+                results.append(ValueError("rechazada"))
+            else:
+                self.invoices[invoice.invoice_number] = invoice
+                results.append(invoice.invoice_number)
+        return results
+
+
+def _copy(invoice, number, **update):
+    return invoice.model_copy(update={"invoice_number": number, **update})
+
+
+async def test_flushes_when_batch_is_full(sample_invoice):
+    inner = RecordingStorageProvider()
+    provider = WriteBehindStorageProvider(inner, max_batch_size=3, flush_interval=60)
+
+    results = await asyncio.gather(*(provider.save_invoice(_copy(sample_invoice, f"F-{i}")) for i in range(3)))
+
+    assert results == ["F-0", "F-1", "F-2"]
+    assert inner.batches == [["F-0", "F-1", "F-2"]]
+    await provider.close()
+
+
+async def test_flushes_after_interval_and_collapses_duplicates(sample_invoice):
+    inner = RecordingStorageProvider()
+    provider = WriteBehindStorageProvider(inner, max_batch_size=100, flush_interval=0.01)
+
+    first = provider.submit(_copy(sample_invoice, "F-1", vendor_name="v1"))
+    second = provider.submit(_copy(sample_invoice, "F-1", vendor_name="v2"))
+    assert (await provider.get_invoice("F-1")).vendor_name == "v2"
+
+    assert await asyncio.gather(first, second) == ["F-1", "F-1"]
+    assert inner.batches == [["F-1"]]
+    assert inner.invoices["F-1"].vendor_name == "v2"
+    await provider.close()
+
+
+async def test_reports_per_item_results_to_callbacks(sample_invoice):
+    inner = RecordingStorageProvider(failing={"F-2"})
+    provider = WriteBehindStorageProvider(inner, max_batch_size=100, flush_interval=60)
+    reported = {}
+
+    ok = provider.submit(_copy(sample_invoice, "F-1"), callback=lambda n, e: reported.setdefault(n, e))
+    failed = provider.submit(_copy(sample_invoice, "F-2"), callback=lambda n, e: reported.setdefault(n, e))
+    await provider.flush()
+
+    assert await ok == "F-1"
+    with pytest.raises(ValueError):
+        await failed
+    assert reported["F-1"] is None
+    assert isinstance(reported["F-2"], ValueError)
+    assert provider.stats()["written"] == 1
+    assert provider.stats()["failed"] == 1
+    await provider.close()
+
+
+async def test_close_flushes_pending_invoices(sample_invoice):
+    inner = RecordingStorageProvider()
+    provider = WriteBehindStorageProvider(inner, max_batch_size=100, flush_interval=60)
+
+    pending = provider.submit(_copy(sample_invoice, "F-1"))
+    await provider.close()
+
+    assert await pending == "F-1"
+    assert "F-1" in inner.invoices
+    with pytest.raises(RuntimeError):
+        provider.submit(_copy(sample_invoice, "F-2"))
@@ -3,6 +3,8 @@ import aiohttp
 import logging
 from typing import Dict, Any, Optional
 from app.config import settings
+from providers.http import get_http_clients
+from providers.resilience import get_resilience, raise_for_response
 
 async def send_whatsapp_message(to_number: str, message: str) -> Dict[str, Any]:
     """Envía un mensaje de WhatsApp a través de la API de Meta."""
@@ -40,16 +42,22 @@ async def send_whatsapp_message(to_number: str, message: str) -> Dict[str, Any]:
         logging.info(f"Payload: {payload}")
 
         # Enviar mensaje
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
+        # Sesión compartida con keep-alive hacia la Graph API
+        async def attempt() -> Dict[str, Any]:
+            async with get_http_clients().session(url).post(url, json=payload, headers=headers) as response:
                 # Log de la respuesta
                 logging.info(f"Respuesta de WhatsApp: {response.status}")
                 response_text = await response.text()
                 logging.info(f"Contenido de respuesta: {response_text}")
-                response.raise_for_status()
+                await raise_for_response(response)
                 
                 return await response.json()
         
+        # Enviar no es idempotente: solo se reintentan los 429 y los fallos al conectar, porque
+        # tras un timeout o un 5xx Meta puede haber entregado ya el mensaje. Con la Graph API
+        # caída el circuito falla de inmediato
+        return await get_resilience().call(url, attempt, idempotent=False)
+        
     except aiohttp.ClientError as e:
         logging.error(f"Error de API: {str(e)}")
         raise
@@ -68,6 +76,7 @@ async def get_image_from_whatsapp(message: Dict[str, Any]) -> bytes:
         
     Raises:
         ValueError: Si no se encuentra la imagen en el mensaje
+        ProviderError: Si la descarga falla tras los reintentos
         Exception: Si hay un error al descargar la imagen
     """
     try:
@@ -88,19 +97,22 @@ async def get_image_from_whatsapp(message: Dict[str, Any]) -> bytes:
             "Authorization": f"Bearer {token}"
         }
         
+        http_clients = get_http_clients()
+        resilience = get_resilience()
+        
+        async def fetch(target: str, read_json: bool):
+            async with http_clients.session(target).get(target, headers=headers) as response:
+                await raise_for_response(response)
+                return await response.json() if read_json else await response.read()
+        
         # Obtener la URL de la imagen
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response.raise_for_status()
-                image_data = await response.json()
-                
-                if 'url' not in image_data:
-                    raise ValueError("No se encontró la URL de la imagen")
-                    
-                # Descargar la imagen
-                async with session.get(image_data['url'], headers=headers) as img_response:
-                    img_response.raise_for_status()
-                    return await img_response.read()
+        image_data = await resilience.call(url, lambda: fetch(url, True))
+            
+        if 'url' not in image_data:
+            raise ValueError("No se encontró la URL de la imagen")
+            
+        # Descargar la imagen (el CDN de Meta es otro host y tiene su propio pool y circuito)
+        return await resilience.call(image_data['url'], lambda: fetch(image_data['url'], False))
                     
     except aiohttp.ClientError as e:
         logging.error(f"Error al descargar la imagen: {str(e)}")